@@ -1,6 +1,10 @@
 import random
-import matplotlib.pyplot as plt
 import numpy as np
+from randomsource import RandomSource
+
+#transitions tallied by a counters.TransitionCounters attached to the PSIIs or CountLayers of a leaf:
+#closure (ground -> closed ground), excitation (closed ground -> closed excited), absorption by a closed excited PSII and the two decays
+TRANSITIONS = ['closure', 'excitation', 'multipleExcitation', 'fluorescence', 'radiationlessDecay']
 
 def chunks(l, numberOfGroups):
     """
@@ -15,7 +19,7 @@ class PSII(object):
     Representation of a PSII particle
     """   
 
-    def __init__(self, layer = 1, size = 1, state = "ground", photonFlux = 1000, leafArea = 1000):
+    def __init__(self, layer = 1, size = 1, state = "ground", photonFlux = 1000, leafArea = 1000, rng = None):
         """
 
         Initialize a PSII instance, saves all parameters as attributes of the instance.
@@ -28,6 +32,7 @@ class PSII(object):
             probabilityFluorescence: float in the range 0-1 representing the probability of a closed excited RC to fluoresce a photon
             probabilityRadiationless: float in the range 0-1 representing the probability of a closed excited RC to decay non-radiatively through Internal Conversion or Intersystem Crossing
             probablilityAnihilation: float in the range 0-1 representing the probability of a closed excited RC to decay to the closed ground state during a double excitation event
+            rng: source of the random numbers, e.g. a randomsource.RandomSource (the random module if None)
 
         Values calculated:
             absCrossection: float calculated from the the PSII size normalized to the leafArea
@@ -43,6 +48,11 @@ class PSII(object):
         self.absCrossection = self.size
         self.probabilityAbsorbed = self.photonFlux/float(self.leafArea) * self.absCrossection
         self.probabilityDecay = 1-np.exp(-20/self.lifetime)
+        self.FluorescenceYield = 0.3
+        if rng is None:
+            rng = random
+        self.rng = rng
+        self.counters = None #counters.TransitionCounters tallying the transitions, None to switch the counting off
 
 
 
@@ -66,13 +76,16 @@ class PSII(object):
 
         returns boolean: True if photon is fluoresced False otherwise
         """          
-        FluorescenceYield=0.3
         if self.state == "closed excited":
-            if random.random() <= self.probabilityDecay:
+            if self.rng.random() <= self.probabilityDecay:
                 self.state = "closed ground"
-                if random.random() <= FluorescenceYield:	#important change to get more fl!
+                if self.rng.random() <= self.FluorescenceYield:	#important change to get more fl!
+                    if self.counters is not None:
+                        self.counters.count('fluorescence')
                     return True
                 else:
+                    if self.counters is not None:
+                        self.counters.count('radiationlessDecay')
                     return False                                    #radiationless decay
             else:
                 return False
@@ -100,8 +113,10 @@ class PSII(object):
                          
                                                                     
             Absorbed = False
-            if random.random() <= self.probabilityAbsorbed:
+            if self.rng.random() <= self.probabilityAbsorbed:
                 Absorbed = True
+                if self.counters is not None:
+                    self.counters.count({"ground": 'closure', "closed ground": 'excitation', "closed excited": 'multipleExcitation'}[self.state])
                 if self.state == "ground":
                     self.state = "closed ground"
                     return Absorbed, False
@@ -174,6 +189,103 @@ class Layer(object):
 
         return self.FCount, self.AbsorbedCount
 
+class CountLayer(object):
+    """
+    Representation of a layer that only tracks how many of its (identical) PSIIs are in each state.
+    """    
+    def __init__(self, numPSIIs, layersNumber, size = 1, leafArea = 10000, rng = None):
+        """
+
+        Initialization function, puts all PSIIs of the layer in the ground state.
+
+        Input:
+            numPSIIs: int representing the number of PSIIs assigned to this layer
+            layersNumber: int representing the number of the layer
+            size, leafArea: PSII parameters shared by all PSIIs of the layer (see PSII)
+            rng: source of the transition counts, a randomsource.RandomSource or numpy RandomState (numpy's global one if None)
+
+        counts: dict with the number of PSIIs in the "ground", "closed ground" and "closed excited" states
+        Fcount: int representing the number of photons fluoresced from a layer
+        AbsorbedCount: int representing the number of photons absorbed by the layer        
+        """
+        psii = PSII(size = size, leafArea = leafArea)
+        self.size = size
+        self.leafArea = leafArea
+        self.probabilityDecay = psii.probabilityDecay
+        self.FluorescenceYield = psii.FluorescenceYield
+        self.layersNumber = layersNumber
+        self.counts = {"ground": numPSIIs, "closed ground": 0, "closed excited": 0}
+        self.FCount = 0
+        self.AbsorbedCount = 0
+        if rng is None:
+            rng = np.random
+        self.rng = rng
+        self.counters = None
+
+    def excite(self, probabilityAbsorbed):
+        """
+        Draws the number of PSIIs taking each transition of PSII.update("on") during one excitation,
+        with all PSIIs of a state handled by a single binomial/multinomial draw.
+        """
+        a = probabilityAbsorbed
+        d = self.probabilityDecay
+        f = self.FluorescenceYield
+        ground, closedGround, closedExcited = self.counts["ground"], self.counts["closed ground"], self.counts["closed excited"]
+
+        groundAbsorbed = self.rng.binomial(ground, a)
+
+        #closed ground: not absorbed, absorbed and fluoresced, absorbed and decayed radiationless, absorbed and still excited
+        cgStays, cgFluoresced, cgRadiationless, cgExcited = self.rng.multinomial(closedGround, [1-a, a*d*f, a*d*(1-f), a*(1-d)])
+
+        #closed excited, absorbed or not: still excited, fluoresced, decayed radiationless
+        ceOutcomes = self.rng.multinomial(closedExcited, [a*(1-d), a*d*f, a*d*(1-f), (1-a)*(1-d), (1-a)*d*f, (1-a)*d*(1-f)])
+        ceAbsorbed = ceOutcomes[:3].sum()
+        ceExcited = ceOutcomes[0] + ceOutcomes[3]
+        ceFluoresced = ceOutcomes[1] + ceOutcomes[4]
+
+        self.counts["ground"] = ground - groundAbsorbed
+        self.counts["closed excited"] = cgExcited + ceExcited
+        self.counts["closed ground"] = ground + closedGround + closedExcited - self.counts["ground"] - self.counts["closed excited"]
+        self.AbsorbedCount += groundAbsorbed + closedGround - cgStays + ceAbsorbed
+        self.FCount += cgFluoresced + ceFluoresced
+        if self.counters is not None:
+            self.counters.count('closure', groundAbsorbed)
+            self.counters.count('excitation', closedGround - cgStays)
+            self.counters.count('multipleExcitation', ceAbsorbed)
+            self.counters.count('fluorescence', cgFluoresced + ceFluoresced)
+            self.counters.count('radiationlessDecay', cgRadiationless + ceOutcomes[2] + ceOutcomes[5])
+
+    def updatePSIIs(self, light, PhotonFlux):
+        """
+        Count-based counterpart of Layer.updatePSIIs, the cost per timestep does not depend on the number of PSIIs.
+
+        returns: a pair of int representing the number of Fluoresced and Absorbed photons by the layer 
+        """       
+        self.FCount = 0
+        self.AbsorbedCount = 0
+        probabilityAbsorbed = PhotonFlux * self.size/float(self.leafArea)
+        if light == "on":
+            if probabilityAbsorbed < 1:
+                self.excite(max(probabilityAbsorbed, 0.0))
+            else:
+                for excitation in range(0,int(probabilityAbsorbed)):
+                    self.excite(1.0)
+
+        if light == "off":
+            closedExcited = self.counts["closed excited"]
+            d = self.probabilityDecay
+            f = self.FluorescenceYield
+            #closed excited: decayed radiationless, fluoresced, still excited
+            decayed, fluoresced = self.rng.multinomial(closedExcited, [d*(1-f), d*f, 1-d])[:2]
+            self.counts["closed excited"] -= decayed + fluoresced
+            self.counts["closed ground"] += decayed + fluoresced
+            self.FCount += fluoresced
+            if self.counters is not None:
+                self.counters.count('fluorescence', fluoresced)
+                self.counters.count('radiationlessDecay', decayed)
+
+        return self.FCount, self.AbsorbedCount
+
 class Leaf(object):
     """
     Representation of a simplified leaf.
@@ -245,29 +357,103 @@ class Leaf(object):
             PhotonFlux = PhotonFlux - Absorbed + Fluoresced
         return self.totalFluoresced, self.totalAbsorbed
 
+class CountLeaf(Leaf):
+    """
+    Representation of a simplified leaf whose layers only track PSII state counts.
+    """    
+    def __init__(self, numPSIIs, layersNumber, size = 1, photonFlux = 1000, leafArea = 10000, rng = None):
+        """
+        
+        Initialization function, no PSII objects are created.
+
+        Input:
+            numPSIIs: int representing the number of PSIIs in the leaf, split evenly over the layers
+            layersNumber: int representing the number of layers
+            size, photonFlux, leafArea: PSII parameters shared by all PSIIs (see PSII)
+            rng: source of the transition counts, a randomsource.RandomSource or numpy RandomState (numpy's global one if None)
+        """
+        Leaf.__init__(self, [], layersNumber)
+        self.numPSIIs = numPSIIs
+        self.size = size
+        self.photonFlux = photonFlux
+        self.leafArea = leafArea
+        self.rng = rng
+
+    def createLayers(self):
+        """
+        Creates the count-based layer objects.
+        """        
+        for layer in range(0, self.layersNumber):
+            self.Layers.append(CountLayer(self.numPSIIs//self.layersNumber, layer, size = self.size, leafArea = self.leafArea, rng = self.rng))
+
+    def updateLayers(self, light):
+        """
+        Calculates how much light is fluoresced and absorbed by passing through all the layers.
+
+        returns: a pair of int representing the total amount of Fluoresced and Absorbed lught by the leaf
+        """            
+        self.totalFluoresced = 0
+        self.totalAbsorbed = 0
+        PhotonFlux = self.photonFlux
+        for layer in self.Layers:
+            Fluoresced, Absorbed = layer.updatePSIIs(light, PhotonFlux)
+            self.totalFluoresced += Fluoresced
+            self.totalAbsorbed += Absorbed
+            PhotonFlux = PhotonFlux - Absorbed + Fluoresced
+        return self.totalFluoresced, self.totalAbsorbed
+
 selectedTimepoint = []
 
-def simulatingLeaf(numPSIIs = 1000, timeSteps = 100, trialsNum = 1, size = 1, photonFlux = 1000, layers = 1):
+def leafTrials(numPSIIs = 1000, timeSteps = 100, trialsNum = 1, size = 1, photonFlux = 1000, layers = 1, countBased = False, seed = None,
+               checkpointFile = None, checkpointInterval = 600.0, counters = None):
     """
-    Runs simulations and plots graphs for PSIIs in the leaf.
+    Runs trialsNum simulations of PSIIs in the leaf, without plotting.
+    With countBased the layers only track how many PSIIs are in each state (see CountLayer),
+    which makes a timestep independent of numPSIIs.
+    With a seed all PSIIs draw from one explicitly seeded RandomSource instead of the global generators.
+    With checkpointFile the summed fluorescence, the trial counter and the random numbers are saved after a trial
+    at most every checkpointInterval seconds; calling it again with the same arguments (or resumeLeafTrials) continues from there.
+    With counters (see transitionCounters) the transitions of all PSIIs are tallied, its bins divide the timesteps equally.
+
+    returns: list with the fluorescence summed over the trials for every timestep
     """
-    global selectedTimepoint
-    timepoint = 10
     trialsSum = [0]
     for time in range(1, timeSteps + 1):
         trialsSum.append(0)
 
-    for trial in range(0, trialsNum):
-        PSIIs = []                                      #Creating PSIIs
-        for nr in range(0, numPSIIs):
-            PSIIs.append(PSII(size = size, state = "ground", photonFlux = photonFlux, leafArea = 10000))
-        simulatedLeaf = Leaf(PSIIs, layers)             #Creating the leaf
-        simulatedLeaf.assignPSIIToLayers()              #Creating layers in the leaf
-        simulatedLeaf.createLayers()
+    rng = None if seed is None and checkpointFile is None else RandomSource(seed)
+    first = 0
+    if checkpointFile is not None:
+        from checkpoint import Checkpointer
+        checkpointer = Checkpointer(checkpointFile, checkpointInterval, {'numPSIIs': numPSIIs, 'timeSteps': timeSteps, 'trialsNum': trialsNum, 'size': size,
+                                                                         'photonFlux': photonFlux, 'layers': layers, 'countBased': countBased, 'seed': seed})
+        state = checkpointer.load()
+        if state is not None and state['finished']:
+            return state['result']
+        if state is not None:
+            trialsSum, rng, first = state['trialsSum'], state['rng'], state['trial']
+            if counters is not None and state.get('counters') is not None:
+                counters.__dict__.update(state['counters'].__dict__)
+    for trial in range(first, trialsNum):
+        if countBased:
+            simulatedLeaf = CountLeaf(numPSIIs, layers, size = size, photonFlux = photonFlux, leafArea = 10000, rng = rng)
+            simulatedLeaf.createLayers()
+        else:
+            PSIIs = []                                      #Creating PSIIs
+            for nr in range(0, numPSIIs):
+                PSIIs.append(PSII(size = size, state = "ground", photonFlux = photonFlux, leafArea = 10000, rng = rng))
+            simulatedLeaf = Leaf(PSIIs, layers)             #Creating the leaf
+            simulatedLeaf.assignPSIIToLayers()              #Creating layers in the leaf
+            simulatedLeaf.createLayers()
+        if counters is not None:
+            for counted in simulatedLeaf.Layers if countBased else simulatedLeaf.PSIIs:
+                counted.counters = counters
 
         Fluorescence = [0]
 
         for time in range(1, timeSteps+1):
+            if counters is not None:
+                counters.bin = (time - 1)*counters.bins//timeSteps
             Fluoresced, Absorbed = simulatedLeaf.updateLayers(light = "on")
             #print "Fluoresced: %i Absorbed: %i" % (Fluoresced, Absorbed)
             Fluorescence.append(Fluoresced)
@@ -283,10 +469,64 @@ def simulatingLeaf(numPSIIs = 1000, timeSteps = 100, trialsNum = 1, size = 1, ph
         #    trialsSum[time] += Fluorescence[time]
         if trial%10 == 0:
             print 'Trial nr: %i' % trial
+        if checkpointFile is not None and checkpointer.due():
+            checkpointer.save({'trialsSum': trialsSum, 'rng': rng, 'trial': trial + 1, 'counters': counters})
+    if checkpointFile is not None:
+        checkpointer.finish(trialsSum)
+    return trialsSum
 
+def transitionCounters(bins = 1):
+    """
+    returns counters.TransitionCounters for the transitions of the leaf PSIIs (TRANSITIONS) with bins time bins
+    """
+    from counters import TransitionCounters
+    return TransitionCounters('leaf PSII', TRANSITIONS, bins)
+
+def resumeLeafTrials(checkpointFile):
+    """
+    Continues an interrupted leafTrials() run from its checkpoint, with the arguments stored in the checkpoint.
+    """
+    from checkpoint import loadCheckpoint
+    return leafTrials(checkpointFile = checkpointFile, **loadCheckpoint(checkpointFile)['arguments'])
+
+def plotLeaf(trialsSum, timeSteps = 100, size = 1, photonFlux = 1000, layers = 1):
+    """
+    Plots the summed fluorescence of the leaf trials and stores its value at the selected timepoint.
+    """
+    import matplotlib.pyplot as plt
+    from plotting import plotSeries
+    global selectedTimepoint
+    timepoint = 10
     selectedTimepoint.append(trialsSum[timepoint])
-    plt.plot(range(0,timeSteps + 1), trialsSum, label = "Size: " + str(size) + " PhotonFlux: " + str(photonFlux) + " Layers: " + str(layers) )
+    plotSeries(plt.gca(), np.arange(timeSteps + 1), trialsSum, label = "Size: " + str(size) + " PhotonFlux: " + str(photonFlux) + " Layers: " + str(layers) )
     plt.xlim(xmin = 0,xmax = timeSteps + 1)
+
+def simulatingLeaf(numPSIIs = 1000, timeSteps = 100, trialsNum = 1, size = 1, photonFlux = 1000, layers = 1, countBased = False, processes = None, seed = 0, batchSize = 10, cache = None, shared = False):
+    """
+    Runs simulations and plots graphs for PSIIs in the leaf.
+    With countBased the layers only track how many PSIIs are in each state (see CountLayer),
+    which makes a timestep independent of numPSIIs.
+    With processes the trials are split into batches of batchSize that run on a process pool (see sweep.runSweep).
+    With cache (a resultcache.ResultCache or its directory) a leaf that was simulated before is not rerun,
+    and a larger trialsNum only runs the missing trials (see sweep.cachedSweep).
+    With processes and shared the workers sum their trialsSum in shared memory instead (see sweep.runSharedSweep).
+    """
+    from sweep import runSweep, runSharedSweep
+    from resultcache import modelParameters
+    if shared and cache is not None:
+        raise ValueError('the shared-memory sums are not cached, pass either shared or cache')
+    if processes is None and cache is None:
+        trialsSum = leafTrials(numPSIIs, timeSteps, trialsNum, size, photonFlux, layers, countBased)
+    elif shared:
+        point = {'numPSIIs': numPSIIs, 'timeSteps': timeSteps, 'size': size, 'photonFlux': photonFlux, 'layers': layers, 'countBased': countBased}
+        trialsSum = list(runSharedSweep(leafTrials, [point], trialsNum, (timeSteps + 1,), batchSize = batchSize, trialsArgument = 'trialsNum', processes = processes,
+                                        seed = seed, seedArgument = 'seed')[0])
+    else:
+        point = {'numPSIIs': numPSIIs, 'timeSteps': timeSteps, 'size': size, 'photonFlux': photonFlux, 'layers': layers, 'countBased': countBased}
+        model = modelParameters(PSII(size = size, photonFlux = photonFlux, leafArea = 10000))
+        trialsSum = list(runSweep(leafTrials, [point], trialsNum, batchSize = batchSize, trialsArgument = 'trialsNum', processes = 1 if processes is None else processes,
+                                  seed = seed, seedArgument = 'seed', cache = cache, models = [model])[0])
+    plotLeaf(trialsSum, timeSteps, size, photonFlux, layers)
     return trialsSum
 
 #####################################################
@@ -312,27 +552,72 @@ def simulatingLeaf(numPSIIs = 1000, timeSteps = 100, trialsNum = 1, size = 1, ph
 #plt.close()
 #plt.show()
 
-numPSIIs = 10000
-timeSteps = 100
-trialsNum = 1
-size = 1
-layer = 1
-photonFluxList =range(200,1001,200)
-
-projectPath = 'D:/Dropbox/Python course/Leaf Project Ludwik/'
-def Simulate(numPSIIs, timeSteps, trialsNum, photonFluxList, size, layer):
-    for light in photonFluxList:
-        print 'Light: %i' % light
-        simulatingLeaf(numPSIIs = numPSIIs, timeSteps = timeSteps, trialsNum = trialsNum, size = size, photonFlux = light, layers = layer)
+def lightDependency(numPSIIs, timeSteps, trialsNum, photonFluxList, size, layer, countBased = False, processes = None, seed = 0, batchSize = 10, cache = None, shared = False):
+    """
+    Simulates the leaf for every photon flux in photonFluxList, without plotting.
+    With processes or cache the photon fluxes x trial batches run through sweep.runSweep, with processes and shared
+    through sweep.runSharedSweep.
+
+    returns: list with the trialsSum (see leafTrials) of every photon flux
+    """
+    from sweep import runSweep, runSharedSweep
+    from resultcache import modelParameters
+    if processes is None and cache is None:
+        results = []
+        for light in photonFluxList:
+            print 'Light: %i' % light
+            results.append(leafTrials(numPSIIs, timeSteps, trialsNum, size, light, layer, countBased))
+        return results
+    points = [{'numPSIIs': numPSIIs, 'timeSteps': timeSteps, 'size': size, 'photonFlux': light, 'layers': layer, 'countBased': countBased} for light in photonFluxList]
+    if shared:
+        if cache is not None:
+            raise ValueError('the shared-memory sums are not cached, pass either shared or cache')
+        results = runSharedSweep(leafTrials, points, trialsNum, (timeSteps + 1,), batchSize = batchSize, trialsArgument = 'trialsNum', processes = processes,
+                                 seed = seed, seedArgument = 'seed')
+        return [list(trialsSum) for trialsSum in results]
+    models = [modelParameters(PSII(size = size, photonFlux = light, leafArea = 10000)) for light in photonFluxList]
+    results = runSweep(leafTrials, points, trialsNum, batchSize = batchSize, trialsArgument = 'trialsNum', processes = 1 if processes is None else processes,
+                       seed = seed, seedArgument = 'seed', cache = cache, models = models)
+    return [list(trialsSum) for trialsSum in results]
+
+def lightDependencyManifest(path, numPSIIs, timeSteps, trialsNum, photonFluxList, sizes, layersList, countBased = False, seed = 0, batchSize = 10, unitsPerShard = 1):
+    """
+    Writes the manifest of a sharded light dependency study over every combination of photon flux, PSII size and
+    number of layers (see shards.createManifest). Every node of a cluster with a shared filesystem then runs
+        python shards.py run path
+    and shards.py merge path gives the trialsSum of every point, exactly as lightDependency with the same seed and batchSize.
+
+    returns dict with the manifest, its points hold the leafTrials arguments of every combination
+    """
+    from shards import createManifest
+    points = [{'numPSIIs': numPSIIs, 'timeSteps': timeSteps, 'size': size, 'photonFlux': light, 'layers': layers, 'countBased': countBased}
+              for size in sizes for layers in layersList for light in photonFluxList]
+    return createManifest(path, 'leaf', 'leafTrials', points, trialsNum, batchSize, trialsArgument = 'trialsNum', seed = seed, seedArgument = 'seed',
+                          unitsPerShard = unitsPerShard)
+
+def Simulate(numPSIIs, timeSteps, trialsNum, photonFluxList, size, layer, processes = None, seed = 0, batchSize = 10, projectPath = ''):
+    import matplotlib.pyplot as plt
+    results = lightDependency(numPSIIs, timeSteps, trialsNum, photonFluxList, size, layer, processes = processes, seed = seed, batchSize = batchSize)
+    for light, trialsSum in zip(photonFluxList, results):
+        plotLeaf(trialsSum, timeSteps, size, light, layer)
     plt.legend(loc = "best", fontsize = 'small')
     plt.xlabel("Time [a.u.]")
     plt.ylabel("Ft [counts]")
     fileName = str('numPSIIs%i timeSteps%i trialsNum%i size%.2f layers%i lightDependency.png' % (numPSIIs, timeSteps, trialsNum, size, layer))
     plt.savefig(projectPath + fileName, width = 30, height = 8)
     plt.close()
-    
 
-Simulate(numPSIIs, timeSteps, trialsNum, photonFluxList, size, layer)
+
+if __name__ == '__main__':
+    numPSIIs = 10000
+    timeSteps = 100
+    trialsNum = 1
+    size = 1
+    layer = 1
+    photonFluxList =range(200,1001,200)
+
+    projectPath = 'D:/Dropbox/Python course/Leaf Project Ludwik/'
+    Simulate(numPSIIs, timeSteps, trialsNum, photonFluxList, size, layer, projectPath = projectPath)
 #selectedTimepoint1 = selectedTimepoint 
 #for time in range(0, len(selectedTimepoint1)):
 #    selectedTimepoint1[time] /= float(photonFluxList[time])
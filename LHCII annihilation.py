@@ -1,6 +1,13 @@
 import random
-import matplotlib.pyplot as plt
 import numpy as np
+from randomsource import RandomSource
+from histograms import StepRecorder, IntervalRecorder
+
+#transitions tallied by a counters.TransitionCounters attached to a LHCII; the decays include those that fluoresce or form a triplet
+TRANSITIONS=['absorption','singletSingletAnnihilation','singletDecay','fluorescence','tripletFormation',
+             'quenchedDecay','quenchedFluorescence','quenchedTripletFormation','tripletRelaxation']
+#transitions tallied for a LHCIINetwork in addition: hops of singlets to a neighbour and singlets annihilated on encounter
+NETWORKTRANSITIONS=TRANSITIONS+['migration','encounterAnnihilation']
 
 
 class LHCII(object):
@@ -8,10 +15,11 @@ class LHCII(object):
     Representation of a LHCII particle
     """   
 
-    def __init__(self,state = "ground", Intensity = 75,timestep=13.14E-9):
+    def __init__(self,state = "ground", Intensity = 75,timestep=13.14E-9,rng = None):
         """
 
         Initialize a LHCII instance, saves all parameters as attributes of the instance.
+        rng is the source of the random numbers, e.g. a randomsource.RandomSource (the random module if None).
         """
 
         self.timestep=timestep #in seconds
@@ -20,10 +28,21 @@ class LHCII(object):
         self.absCrossection = 1.4E-15 #cm^2
         self.absorptionrate = self.Intensity * self.absCrossection/(3.14*10**-19) #per second
         self.absorptionProbability=self.absorptionrate*self.timestep  #absorption probability per timestep
-        self.probabilityDecay = 1-np.exp(-timestep/3.5E-9) #Probability for excited state decay during timestep without a car triplet
-        self.probabilityDecayTriplet = 1-np.exp(-timestep/35E-12) #Probability for excited state decay during timestep in the presence of a car triplet
+        self.lifetime=3.5E-9 #excited state lifetime without a car triplet, in seconds
+        self.lifetimeTriplet=35E-12 #excited state lifetime in the presence of a car triplet, in seconds
+        self.TripletLifetime=9E-6 #car triplet lifetime, in seconds
+        self.probabilityDecay = 1-np.exp(-timestep/self.lifetime) #Probability for excited state decay during timestep without a car triplet
+        self.probabilityDecayTriplet = 1-np.exp(-timestep/self.lifetimeTriplet) #Probability for excited state decay during timestep in the presence of a car triplet
         self.triplet=0 # 0 equals no triplet; 1 equals a triplet
-        self.TripletDecay=1-np.exp(-timestep/9E-6) #Probability for car triplet state decay during timestep
+        self.TripletDecay=1-np.exp(-timestep/self.TripletLifetime) #Probability for car triplet state decay during timestep
+        self.FlYield=0.33 #fluorescence yield of a decaying singlet without a car triplet
+        self.TripletYield=0.5 #car triplet formation probability of a non-fluorescing singlet without a car triplet
+        self.FlYieldTriplet=0.0033 #fluorescence yield of a decaying singlet in the presence of a car triplet
+        self.TripletYieldTriplet=0.005 #car triplet formation probability of a non-fluorescing singlet in the presence of a car triplet
+        if rng is None:
+            rng = random
+        self.rng = rng
+        self.counters = None #counters.TransitionCounters tallying the transitions, None to switch the counting off
 
 
 
@@ -36,6 +55,28 @@ class LHCII(object):
         self.absorptionrate = self.Intensity * self.absCrossection/(3.14*10**-19) #per second
         self.absorptionProbability=self.absorptionrate*self.timestep  
 
+    def setParameters(self, parameters):
+        """
+        Overrides parameters, e.g. {'FlYield':0.3,'lifetime':3E-9}, and updates the probabilities that depend on them.
+        Only the probabilities whose parameters are given are recomputed, so a probability such as probabilityDecay
+        can also be set directly.
+
+        input: dict with the attribute names and values
+        """
+        for name, value in parameters.items():
+            if not hasattr(self, name):
+                raise ValueError('%s has no parameter %r' % (type(self).__name__, name))
+            setattr(self, name, value)
+        changed = lambda *names: any(name in parameters for name in names + ('timestep',))
+        if changed('Intensity', 'absCrossection'):
+            self.updatePhotonFlux(self.Intensity)
+        if changed('lifetime'):
+            self.probabilityDecay = 1-np.exp(-self.timestep/self.lifetime)
+        if changed('lifetimeTriplet'):
+            self.probabilityDecayTriplet = 1-np.exp(-self.timestep/self.lifetimeTriplet)
+        if changed('TripletLifetime'):
+            self.TripletDecay=1-np.exp(-self.timestep/self.TripletLifetime)
+
     def doesFluoresce(self):
         """
         Checks for fluorescence from the excited LHCII complex, the probablities are different for the two cases:
@@ -45,24 +86,36 @@ class LHCII(object):
         returns boolean: True if photon is fluoresced False otherwise
         """          
         if self.state == "excited" and self.triplet==0:
-            if random.random() <= self.probabilityDecay:
+            if self.rng.random() <= self.probabilityDecay:
                 self.state = "ground"
-                if random.random() <= 0.33:	
+                if self.counters is not None:
+                    self.counters.count('singletDecay')
+                if self.rng.random() <= self.FlYield:	
+                    if self.counters is not None:
+                        self.counters.count('fluorescence')
                     return True
-                if random.random()<= 0.5:
+                if self.rng.random()<= self.TripletYield:
                     self.triplet+=1
+                    if self.counters is not None:
+                        self.counters.count('tripletFormation')
                     return False
                 else:
                     return False                                    
             else:
                 return False
         if self.state == "excited" and self.triplet>=1:
-            if random.random() <= self.probabilityDecayTriplet:
+            if self.rng.random() <= self.probabilityDecayTriplet:
                 self.state = "ground"
-                if random.random() <= 0.0033:
+                if self.counters is not None:
+                    self.counters.count('quenchedDecay')
+                if self.rng.random() <= self.FlYieldTriplet:
+                    if self.counters is not None:
+                        self.counters.count('quenchedFluorescence')
                     return True
-                if random.random()<= 0.005:
+                if self.rng.random()<= self.TripletYieldTriplet:
                     self.triplet+=1
+                    if self.counters is not None:
+                        self.counters.count('quenchedTripletFormation')
                 else:
                     return False
             else:
@@ -83,8 +136,10 @@ class LHCII(object):
         """            
         if light == "off":
             if self.triplet>=1:
-                if random.random() <= self.TripletDecay:
+                if self.rng.random() <= self.TripletDecay:
                     self.triplet-=1
+                    if self.counters is not None:
+                        self.counters.count('tripletRelaxation')
             if self.state == "excited":
                 return False, self.doesFluoresce() 
             else:
@@ -92,16 +147,22 @@ class LHCII(object):
 
         if light == "on":  
             if self.triplet>=1:
-                if random.random() <= self.TripletDecay:
+                if self.rng.random() <= self.TripletDecay:
                     self.triplet-=1      
+                    if self.counters is not None:
+                        self.counters.count('tripletRelaxation')
             Absorbed = False
-            if random.random() <= self.absorptionProbability:
+            if self.rng.random() <= self.absorptionProbability:
                 Absorbed = True
+                if self.counters is not None:
+                    self.counters.count('absorption')
                 if self.state == "ground":
                     self.state = "excited"
                     return Absorbed, self.doesFluoresce()
                 if self.state == "excited":
                     #print 'Singlet=Singlet annihilation!'
+                    if self.counters is not None:
+                        self.counters.count('singletSingletAnnihilation')
                     return Absorbed, self.doesFluoresce()
                     
             else:
@@ -110,8 +171,500 @@ class LHCII(object):
                 else:   
                     return False, False  
                     
-def simulation(repetitions=10000000,Intensity=75,light='on'):
-    complex=LHCII(Intensity=Intensity)
+    def propagateDark(self, steps):
+        """
+        Advances the complex by steps timesteps without light, as steps calls of update('off') would, but at the cost
+        of a few timesteps: the complex is stepped only while it is excited. Afterwards nothing but the car triplet
+        relaxation is left, one triplet per timestep with probability TripletDecay, so the remaining timesteps relax
+        min(triplet, Binomial(remaining timesteps, TripletDecay)) triplets, which is exact.
+
+        Input:
+            steps: int representing the number of timesteps of the dark interval
+
+        returns the number of photons fluoresced during the dark interval
+        """
+        fluoresced = 0
+        while steps > 0 and self.state == "excited":
+            Abs, Fl = self.update("off")
+            if Fl:
+                fluoresced += Fl
+            steps -= 1
+        if steps > 0 and self.triplet >= 1:
+            relaxed = min(self.triplet, int(getattr(self.rng, 'binomial', np.random.binomial)(steps, self.TripletDecay)))
+            self.triplet -= relaxed
+            if self.counters is not None:
+                self.counters.count('tripletRelaxation', relaxed)
+        return fluoresced
+
+    def propagateLight(self, propagator):
+        """
+        Advances the complex by a segment of constant illumination in one draw, as the update('on') calls summarized
+        by propagator (see segmentPropagator) would: the state after the segment is drawn from the row of the current
+        state. Nothing is recorded or counted.
+
+        Input:
+            propagator: array with the probabilities of the states after the segment for every initial state
+        """
+        numTriplets = len(propagator)//2
+        if self.triplet >= numTriplets:
+            raise ValueError('%i car triplets are beyond the %i of the propagator' % (self.triplet, numTriplets-1))
+        row = propagator[(self.state == "excited")*numTriplets+self.triplet]
+        state = min(int(np.searchsorted(np.cumsum(row), self.rng.random()*row.sum())), len(row)-1)
+        excited, self.triplet = divmod(state, numTriplets)
+        self.state = "excited" if excited else "ground"
+
+class LHCIIWeighted(LHCII):
+    """
+    Representation of a LHCII particle whose rare triplet-quenched emission is recorded as a statistical weight
+    """
+
+    def doesFluoresce(self):
+        """
+        Same transitions as LHCII.doesFluoresce, except that a decay in the presence of a car triplet does not draw
+        its rare fluorescence (yield FlYieldTriplet). The car triplet formation is drawn with its marginal probability
+        (1-FlYieldTriplet)*TripletYieldTriplet and the decay returns the probability that it fluoresced given that
+        outcome. The trajectories follow the same law as those of LHCII and the summed weights are an unbiased
+        estimate of the quenched emission, without the variance of drawing an event with a yield of 0.0033.
+
+        returns True if a photon is fluoresced by an unquenched singlet, the fluorescence weight (float) of a
+        quenched decay without triplet formation, False otherwise
+        """
+        if self.state == "excited" and self.triplet>=1:
+            if self.rng.random() <= self.probabilityDecayTriplet:
+                self.state = "ground"
+                if self.counters is not None:
+                    self.counters.count('quenchedDecay')
+                if self.rng.random() <= (1-self.FlYieldTriplet)*self.TripletYieldTriplet:
+                    self.triplet+=1
+                    if self.counters is not None:
+                        self.counters.count('quenchedTripletFormation')
+                    return False
+                weight=self.FlYieldTriplet/(1-(1-self.FlYieldTriplet)*self.TripletYieldTriplet)
+                if self.counters is not None:
+                    self.counters.count('quenchedFluorescence',weight)
+                return weight
+            return False
+        return LHCII.doesFluoresce(self)
+
+class LHCIIEnsemble(LHCII):
+    """
+    Representation of an ensemble of independent LHCII particles, kept as NumPy state arrays
+    """   
+
+    def __init__(self, numComplexes = 1000, Intensity = 75, timestep=13.14E-9, rng = None):
+        """
+
+        Initialize a LHCIIEnsemble instance. All rate constants and yields are taken from LHCII,
+        the per-complex state is kept in arrays:
+            excited: boolean array, True where the complex is in the excited singlet state
+            triplet: int array with the number of car triplets present on each complex
+            rng: source of the bulk random draws, a randomsource.RandomSource or numpy RandomState (a new unseeded one if None)
+        """
+        LHCII.__init__(self, Intensity=Intensity, timestep=timestep)
+        self.numComplexes = numComplexes
+        self.excited = np.zeros(numComplexes, dtype=bool)
+        self.triplet = np.zeros(numComplexes, dtype=np.int64)
+        if rng is None:
+            rng = np.random.RandomState()
+        self.rng = rng
+        self.disorder = None #dict with the per-complex parameter arrays drawn by disorder.applyDisorder, None if homogeneous
+
+    def doesFluoresce(self):
+        """
+        Vectorized LHCII.doesFluoresce: every excited complex decays with the probability belonging to
+        its triplet state, then fluoresces or forms a car triplet with the corresponding yields.
+
+        returns boolean array: True where a photon is fluoresced
+        """          
+        n = self.numComplexes
+        quenched = self.triplet >= 1
+        decays = self.rng.random_sample(n) <= np.where(quenched, self.probabilityDecayTriplet, self.probabilityDecay)
+        decays &= self.excited
+        self.excited &= ~decays
+        fluoresced = decays & (self.rng.random_sample(n) <= np.where(quenched, self.FlYieldTriplet, self.FlYield))
+        formsTriplet = decays & ~fluoresced & (self.rng.random_sample(n) <= np.where(quenched, self.TripletYieldTriplet, self.TripletYield))
+        self.triplet += formsTriplet
+        if self.counters is not None:
+            for transition, happened in [('singletDecay', decays & ~quenched), ('fluorescence', fluoresced & ~quenched), ('tripletFormation', formsTriplet & ~quenched),
+                                         ('quenchedDecay', decays & quenched), ('quenchedFluorescence', fluoresced & quenched), ('quenchedTripletFormation', formsTriplet & quenched)]:
+                self.counters.count(transition, np.count_nonzero(happened))
+        return fluoresced
+
+    def update(self, light):
+        """
+        Advances all complexes by one timestep, following the same order of transitions as LHCII.update:
+        car triplet decay, absorption (only if light is "on") and decay of the excited complexes.
+
+        Input:
+            light: str "on" or "off" representing if the photon flux will be hitting the complexes during a timestep
+
+        returns a pair of boolean arrays: absorbed and fluoresced photons per complex
+        """            
+        n = self.numComplexes
+        relaxes = (self.triplet >= 1) & (self.rng.random_sample(n) <= self.TripletDecay)
+        self.triplet -= relaxes
+        if light == "on":
+            absorbed = self.rng.random_sample(n) <= self.absorptionProbability
+            if self.counters is not None:
+                self.counters.count('absorption', np.count_nonzero(absorbed))
+                self.counters.count('singletSingletAnnihilation', np.count_nonzero(absorbed & self.excited))
+            self.excited |= absorbed
+        else:
+            absorbed = np.zeros(n, dtype=bool)
+        if self.counters is not None:
+            self.counters.count('tripletRelaxation', np.count_nonzero(relaxes))
+        return absorbed, self.doesFluoresce()
+
+    def propagateDark(self, steps):
+        """
+        Vectorized LHCII.propagateDark: the ensemble is stepped while any complex is excited, then the car triplets
+        of every complex relax by min(triplet, Binomial(remaining timesteps, TripletDecay)).
+
+        returns the number of photons fluoresced during the dark interval
+        """
+        fluoresced = 0
+        while steps > 0 and self.excited.any():
+            Abs, Fl = self.update("off")
+            fluoresced += np.count_nonzero(Fl)
+            steps -= 1
+        if steps > 0:
+            relaxed = np.minimum(self.triplet, self.rng.binomial(steps, self.TripletDecay, size=self.numComplexes))
+            self.triplet -= relaxed
+            if self.counters is not None:
+                self.counters.count('tripletRelaxation', int(relaxed.sum()))
+        return fluoresced
+
+class LHCIINetwork(LHCIIEnsemble):
+    """
+    Representation of connected LHCII particles, e.g. the trimers of a membrane patch, between which the excitations migrate
+    """
+
+    def __init__(self, neighbours, Intensity = 75, timestep=13.14E-9, rng = None, migrationSteps = 1, hoppingProbability = 1.0, neighbourQuenching = True):
+        """
+
+        Initialize a LHCIINetwork instance. The rate constants, yields and per-complex state arrays are those of LHCIIEnsemble.
+            neighbours: int array of shape (complexes, largest number of neighbours) with the neighbours of every complex,
+                padded with -1, e.g. network.squareLattice(rows, columns) or network.fromEdges(edges, complexes)
+            migrationSteps: int representing the number of hops an excited singlet attempts during a timestep,
+                after the absorption and before its decay is drawn
+            hoppingProbability: float, probability that a hop attempt moves the singlet to a random neighbour
+            neighbourQuenching: boolean, True if car triplets also quench the singlets on neighbouring complexes,
+                which then decay with the lifetime and yields in the presence of a car triplet
+        """
+        neighbours = np.asarray(neighbours)
+        LHCIIEnsemble.__init__(self, numComplexes=len(neighbours), Intensity=Intensity, timestep=timestep, rng=rng)
+        self.neighbours = neighbours
+        self.degree = np.count_nonzero(neighbours >= 0, axis=1)
+        self.migrationSteps = migrationSteps
+        self.hoppingProbability = hoppingProbability
+        self.neighbourQuenching = neighbourQuenching
+        self.encounters = 0 #number of singlets annihilated on encounter since the start
+        self.refresh()
+
+    def refresh(self):
+        """
+        Rebuilds the indices of the excited complexes (sorted) and of the complexes with car triplets, which the network
+        keeps up to date in every step instead of searching the state arrays. Call it after changing excited or triplet directly.
+        """
+        self.excitedComplexes = np.flatnonzero(self.excited)
+        self.tripletComplexes = np.flatnonzero(self.triplet >= 1)
+
+    def parameter(self, name, complexes):
+        """
+        returns the parameter name of the given complexes, an array if it is disordered (see disorder.applyDisorder), else a float
+        """
+        value = getattr(self, name)
+        return value[complexes] if np.ndim(value) else value
+
+    def migrate(self):
+        """
+        One hop attempt of every excited singlet. The singlets that hop leave their complex for a random neighbour;
+        a singlet that arrives on an excited complex, or together with another one, annihilates with it, so every
+        complex keeps at most one singlet. Two singlets that swap complexes cross on the way and annihilate as well.
+        Only the excited complexes and their neighbour lists are touched.
+
+        returns the number of singlets annihilated on encounter
+        """
+        excited = self.excitedComplexes
+        if len(excited) == 0:
+            return 0
+        hopping = (self.rng.random_sample(len(excited)) <= self.hoppingProbability) & (self.degree[excited] > 0)
+        hops = excited[hopping]
+        if len(hops) == 0:
+            return 0
+        targets = self.neighbours[hops, (self.rng.random_sample(len(hops))*self.degree[hops]).astype(np.int64)]
+        partner = np.minimum(np.searchsorted(hops, targets), len(hops) - 1)
+        crossing = (hops[partner] == targets) & (targets[partner] == hops) #of a crossing pair only the singlet hopping to the higher index arrives
+        self.excited[hops] = False
+        moving = targets[~(crossing & (targets < hops))]
+        arrived = np.unique(moving[~self.excited[moving]])
+        self.excited[arrived] = True
+        self.excitedComplexes = np.union1d(excited[~hopping], arrived)
+        annihilated = len(hops) - len(arrived)
+        self.encounters += annihilated
+        if self.counters is not None:
+            self.counters.count('migration', len(hops))
+            self.counters.count('encounterAnnihilation', annihilated)
+        return annihilated
+
+    def quenched(self, complexes):
+        """
+        returns boolean array: True for the given complexes if an excited singlet on them decays in the presence of a
+        car triplet on its own complex or, with neighbourQuenching, on a neighbouring one
+        """
+        quenched = self.triplet[complexes] >= 1
+        if self.neighbourQuenching:
+            neighbours = self.neighbours[complexes]
+            quenched |= ((self.triplet[neighbours] >= 1) & (neighbours >= 0)).any(axis=1)
+        return quenched
+
+    def select(self, size, probability):
+        """
+        Draws to which of size candidates an event of the given probability happens during a timestep. With a homogeneous
+        probability the number of events is drawn first and then as many distinct candidates, which costs time in
+        proportion to the events; a disordered probability (an array) needs a draw per candidate.
+
+        returns sorted int array with the positions of the selected candidates
+        """
+        if np.ndim(probability):
+            return np.flatnonzero(self.rng.random_sample(size) <= probability)
+        count = self.rng.binomial(size, min(probability, 1.0))
+        selected = np.unique((self.rng.random_sample(count)*size).astype(np.int64))
+        while len(selected) < count: #drawn again until count distinct candidates, a uniformly random subset
+            selected = np.union1d(selected, (self.rng.random_sample(count - len(selected))*size).astype(np.int64))
+        return selected
+
+    def doesFluoresce(self):
+        """
+        Migration of the excited singlets (migrationSteps hop attempts, see migrate), then the decay of
+        LHCIIEnsemble.doesFluoresce, drawn for the excited complexes only.
+
+        returns boolean array: True where a photon is fluoresced
+        """
+        for step in range(self.migrationSteps):
+            self.migrate()
+        excited = self.excitedComplexes
+        quenched = self.quenched(excited)
+        decays = self.rng.random_sample(len(excited)) <= np.where(quenched, self.parameter('probabilityDecayTriplet', excited), self.parameter('probabilityDecay', excited))
+        decayed, quenched = excited[decays], quenched[decays]
+        fluoresces = self.rng.random_sample(len(decayed)) <= np.where(quenched, self.parameter('FlYieldTriplet', decayed), self.parameter('FlYield', decayed))
+        formsTriplet = ~fluoresces & (self.rng.random_sample(len(decayed)) <= np.where(quenched, self.parameter('TripletYieldTriplet', decayed), self.parameter('TripletYield', decayed)))
+        self.excited[decayed] = False
+        self.excitedComplexes = excited[~decays]
+        formed = decayed[formsTriplet]
+        self.triplet[formed] += 1
+        formed = formed[self.triplet[formed] == 1] #complexes with their first car triplet
+        if len(formed):
+            self.tripletComplexes = np.concatenate([self.tripletComplexes, formed])
+        fluoresced = np.zeros(self.numComplexes, dtype=bool)
+        fluoresced[decayed[fluoresces]] = True
+        if self.counters is not None:
+            for transition, happened in [('singletDecay', ~quenched), ('fluorescence', fluoresces & ~quenched), ('tripletFormation', formsTriplet & ~quenched),
+                                         ('quenchedDecay', quenched), ('quenchedFluorescence', fluoresces & quenched), ('quenchedTripletFormation', formsTriplet & quenched)]:
+                self.counters.count(transition, np.count_nonzero(happened))
+        return fluoresced
+
+    def update(self, light):
+        """
+        LHCIIEnsemble.update that only draws for the complexes concerned: the car triplets relax on the complexes that
+        carry them, the relaxing and absorbing complexes are drawn directly (see select) and only the excited singlets migrate and
+        decay. A timestep thus costs time in proportion to the excitations and car triplets, not to the size of the network.
+
+        returns a pair of boolean arrays: absorbed and fluoresced photons per complex
+        """
+        carriers = self.tripletComplexes
+        positions = self.select(len(carriers), self.parameter('TripletDecay', carriers))
+        relaxes = carriers[positions]
+        self.triplet[relaxes] -= 1
+        emptied = positions[self.triplet[relaxes] == 0]
+        if len(emptied):
+            keep = np.ones(len(carriers), dtype=bool)
+            keep[emptied] = False
+            self.tripletComplexes = carriers[keep]
+        absorbed = np.zeros(self.numComplexes, dtype=bool)
+        if light == "on":
+            absorbing = self.select(self.numComplexes, self.absorptionProbability)
+            absorbed[absorbing] = True
+            if self.counters is not None:
+                self.counters.count('absorption', len(absorbing))
+                self.counters.count('singletSingletAnnihilation', np.count_nonzero(self.excited[absorbing]))
+            self.excited[absorbing] = True
+            self.excitedComplexes = np.union1d(self.excitedComplexes, absorbing)
+        if self.counters is not None:
+            self.counters.count('tripletRelaxation', len(relaxes))
+        return absorbed, self.doesFluoresce()
+
+    def propagateDark(self, steps):
+        """
+        LHCIIEnsemble.propagateDark, the car triplets only relax on the complexes that carry them.
+
+        returns the number of photons fluoresced during the dark interval
+        """
+        fluoresced = 0
+        while steps > 0 and len(self.excitedComplexes):
+            Abs, Fl = self.update("off")
+            fluoresced += np.count_nonzero(Fl)
+            steps -= 1
+        if steps > 0:
+            carriers = self.tripletComplexes
+            relaxed = np.minimum(self.triplet[carriers], self.rng.binomial(steps, self.parameter('TripletDecay', carriers), size=len(carriers)))
+            self.triplet[carriers] -= relaxed
+            self.tripletComplexes = carriers[self.triplet[carriers] >= 1]
+            if self.counters is not None:
+                self.counters.count('tripletRelaxation', int(relaxed.sum()))
+        return fluoresced
+
+class LHCIIEventDriven(LHCII):
+    """
+    Continuous-time (Gillespie) representation of a LHCII particle
+    """   
+
+    def __init__(self, state = "ground", Intensity = 75, timestep=13.14E-9, rng = None):
+        """
+
+        Initialize a LHCIIEventDriven instance. Instead of the per-timestep probabilities the rates are used:
+        absorptionrate, 1/lifetime or 1/lifetimeTriplet for the excited state decay and 1/TripletLifetime for the
+        car triplet decay. As in LHCII.update at most one car triplet relaxes at a time, independent of their number.
+        timestep is only kept to convert results to the units of the stepped simulations.
+            rng: source of the waiting times and branchings, e.g. a randomsource.RandomSource (the random module if None)
+        """
+        LHCII.__init__(self, state=state, Intensity=Intensity, timestep=timestep, rng=rng)
+
+    def advance(self, duration, light):
+        """
+        Advances the complex by duration seconds, jumping directly from one event to the next.
+        The waiting times are exponential, so stopping at duration and restarting later is exact.
+
+        Input:
+            duration: float, time in seconds
+            light: str "on" or "off" representing if the photon flux will be hitting the complex
+
+        yields for every event: the time since the start of the interval, the car triplet count before
+        the event and True/False if a photon is fluoresced
+        """
+        absorptionrate = self.absorptionrate if light == "on" else 0.0
+        time = 0.0
+        while True:
+            decayrate = 0.0
+            if self.state == "excited":
+                decayrate = 1/self.lifetimeTriplet if self.triplet>=1 else 1/self.lifetime
+            relaxrate = 1/self.TripletLifetime if self.triplet>=1 else 0.0
+            totalrate = absorptionrate + decayrate + relaxrate
+            if totalrate == 0:
+                return
+            time += self.rng.expovariate(totalrate)
+            if time > duration:
+                return
+            triplet = self.triplet
+            fluoresced = False
+            event = self.rng.random()*totalrate
+            if event < absorptionrate:
+                if self.counters is not None:
+                    self.counters.count('absorption')
+                    if self.state == "excited":
+                        self.counters.count('singletSingletAnnihilation')
+                self.state = "excited" #absorption by an excited complex changes nothing
+            elif event < absorptionrate + decayrate:
+                self.state = "ground"
+                formed = False
+                if triplet == 0:
+                    if self.rng.random() <= self.FlYield:
+                        fluoresced = True
+                    elif self.rng.random() <= self.TripletYield:
+                        self.triplet += 1
+                        formed = True
+                else:
+                    if self.rng.random() <= self.FlYieldTriplet:
+                        fluoresced = True
+                    elif self.rng.random() <= self.TripletYieldTriplet:
+                        self.triplet += 1
+                        formed = True
+                if self.counters is not None:
+                    self.counters.count('singletDecay' if triplet == 0 else 'quenchedDecay')
+                    if fluoresced:
+                        self.counters.count('fluorescence' if triplet == 0 else 'quenchedFluorescence')
+                    if formed:
+                        self.counters.count('tripletFormation' if triplet == 0 else 'quenchedTripletFormation')
+            else:
+                self.triplet -= 1
+                if self.counters is not None:
+                    self.counters.count('tripletRelaxation')
+            yield time, triplet, fluoresced
+
+class LHCIIMultiscale(LHCII):
+    """
+    Multiscale representation of a LHCII particle: the slow car triplet population is advanced on its own clock
+    in continuous time, the fast singlet dynamics are resolved within each absorption event
+    """   
+
+    def __init__(self, state = "ground", Intensity = 75, timestep=13.14E-9, rng = None):
+        """
+
+        Initialize a LHCIIMultiscale instance. The rates are those of LHCIIEventDriven. The singlet lifetime (ns) is far
+        shorter than the time between absorptions and the car triplet lifetime (9 us), so the triplet population
+        only changes by triplet formation after an excitation or by relaxation. Between two such slow events the
+        excitations form a renewal process of rate 1/(1/absorptionrate + singlet lifetime), which is taken as Poisson,
+        and every excitation ends in fluorescence, nothing or a triplet formation with the yields of
+        LHCII.doesFluoresce. Only the slow events are iterated; the photons between them follow from their rate.
+        timestep is only kept to convert results to the units of the stepped simulations.
+            rng: a randomsource.RandomSource (a new unseeded one if None)
+        """
+        if rng is None:
+            rng = RandomSource()
+        LHCII.__init__(self, state=state, Intensity=Intensity, timestep=timestep, rng=rng)
+
+    def slowRates(self, light):
+        """
+        Rates in the current triplet state.
+
+        returns the rate of fluoresced photons and the list of slow events as (rate, name)
+        """
+        absorptionrate = self.absorptionrate if light == "on" else 0.0
+        if self.triplet>=1:
+            excitationrate = absorptionrate/(1 + absorptionrate*self.lifetimeTriplet)
+            fluorescencerate = excitationrate*self.FlYieldTriplet
+            events = [(excitationrate*(1 - self.FlYieldTriplet)*self.TripletYieldTriplet, 'quenchedTripletFormation'),
+                      (1/self.TripletLifetime, 'tripletRelaxation')]
+        else:
+            excitationrate = absorptionrate/(1 + absorptionrate*self.lifetime)
+            fluorescencerate = excitationrate*self.FlYield
+            events = [(excitationrate*(1 - self.FlYield)*self.TripletYield, 'tripletFormation')]
+        return fluorescencerate, events
+
+    def advance(self, duration, light):
+        """
+        Advances the complex by duration seconds, jumping from one slow event to the next.
+
+        Input:
+            duration: float, time in seconds
+            light: str "on" or "off" representing if the photon flux will be hitting the complex
+
+        yields for every interval of constant triplet population: its start and end time, the triplet count
+        and the rate of fluoresced photons during the interval
+        """
+        time = 0.0
+        while True:
+            fluorescencerate, events = self.slowRates(light)
+            totalrate = sum(rate for rate, name in events)
+            end = time + self.rng.expovariate(totalrate) if totalrate > 0 else duration
+            if end >= duration:
+                yield time, duration, self.triplet, fluorescencerate
+                return
+            triplet = self.triplet
+            if self.rng.random()*totalrate < events[0][0]:
+                self.triplet += 1
+                name = events[0][1]
+            else:
+                self.triplet -= 1
+                name = 'tripletRelaxation'
+            if self.counters is not None:
+                self.counters.count(name)
+            yield time, end, triplet, fluorescencerate
+            time = end
+
+def simulation(repetitions=10000000,Intensity=75,light='on',seed=None,counters=None):
+    complex=LHCII(Intensity=Intensity,rng=None if seed is None else RandomSource(seed))
+    complex.counters=counters #optional counters.TransitionCounters, see transitionCounters()
     fluorescence=0
     SumTriplets=0
     for num in range(repetitions):
@@ -124,15 +677,287 @@ def simulation(repetitions=10000000,Intensity=75,light='on'):
     TripletPro=SumTriplets/float(repetitions)
     return fluorescence,TripletPro
             
-def saturation(intensities):
+def simulationEnsemble(repetitions=100000,numComplexes=1000,Intensity=75,light='on',seed=None,counters=None,disorder=None,breakdown=None):
+    """
+    Ensemble counterpart of simulation(): advances numComplexes independent LHCIIs in parallel
+    for repetitions timesteps. The results are averaged over time and over the complexes, so they
+    are directly comparable to simulation() with repetitions*numComplexes steps of statistics.
+    With disorder every complex draws its parameters from the given distributions (see disorder.py), e.g.
+    {'absCrossection':('lognormal',np.log(1.4E-15),0.2)}. With breakdown, a pair of a parameter name and bin edges,
+    the results are also given per parameter bin.
+
+    returns the fluorescence in counts per second and the average car triplet population, with breakdown also a dict
+    with the edges, the number of complexes, the fluorescence and the triplet population of every parameter bin
+    """
+    ensemble=LHCIIEnsemble(numComplexes=numComplexes,Intensity=Intensity,rng=RandomSource(seed))
+    if disorder is not None:
+        from disorder import applyDisorder
+        applyDisorder(ensemble,disorder)
+    ensemble.counters=counters
+    fluorescence=np.zeros(numComplexes,dtype=np.int64) #per complex, summed over the complexes (or parameter bins) at the end
+    SumTriplets=np.zeros(numComplexes,dtype=np.int64)
+    for num in range(repetitions):
+        SumTriplets+=ensemble.triplet
+        Abs,Fl= ensemble.update(light)
+        fluorescence+=Fl
+    DetectionEfficiency=0.075
+    scale=DetectionEfficiency/float(repetitions*ensemble.timestep) #converted to counts per second per complex and adjusted for the detection efficiency of our setup
+    if breakdown is not None:
+        from disorder import parameterBins, binSums
+        name,edges=breakdown
+        index,bins=parameterBins(getattr(ensemble,name)*np.ones(numComplexes),edges)
+        complexes=binSums(np.ones(numComplexes),index,bins)
+        with np.errstate(invalid='ignore',divide='ignore'):
+            perBin={'edges':np.asarray(edges,dtype=float),'complexes':complexes.astype(np.int64),
+                    'fluorescence':binSums(fluorescence,index,bins)*scale/complexes,
+                    'triplets':binSums(SumTriplets,index,bins)/float(repetitions)/complexes}
+        return fluorescence.sum()*scale/numComplexes,SumTriplets.sum()/float(repetitions*numComplexes),perBin
+    return fluorescence.sum()*scale/numComplexes,SumTriplets.sum()/float(repetitions*numComplexes)
+            
+def simulationNetwork(repetitions=100000,neighbours=None,rows=100,columns=100,Intensity=75,light='on',seed=None,counters=None,migrationSteps=1,hoppingProbability=1.0,neighbourQuenching=True):
+    """
+    Network counterpart of simulationEnsemble(): the LHCIIs are connected, their singlets migrate between neighbours,
+    annihilate on encounter and are quenched by the car triplets of neighbouring complexes (see LHCIINetwork).
+    The complexes sit on a periodic rows x columns square lattice unless a neighbour table is given (see network.py).
+    Pass counters from transitionCounters(network=True) to also tally the hops and encounter annihilations.
+
+    returns the fluorescence in counts per second per complex, the average car triplet population and the fraction
+    of the absorbed photons lost to annihilation (on a complex and on encounter)
+    """
+    from network import squareLattice
+    if neighbours is None:
+        neighbours=squareLattice(rows,columns)
+    network=LHCIINetwork(neighbours,Intensity=Intensity,rng=RandomSource(seed),migrationSteps=migrationSteps,hoppingProbability=hoppingProbability,neighbourQuenching=neighbourQuenching)
+    network.counters=counters
+    numComplexes=network.numComplexes
+    fluorescence=0
+    SumTriplets=0
+    absorbed=0
+    annihilated=0
+    for num in range(repetitions):
+        SumTriplets+=network.triplet[network.tripletComplexes].sum()
+        excited=network.excitedComplexes
+        Abs,Fl= network.update(light)
+        absorbed+=np.count_nonzero(Abs)
+        annihilated+=np.count_nonzero(Abs[excited]) #absorbed by an excited complex
+        fluorescence+=np.count_nonzero(Fl)
+    annihilated+=network.encounters
+    DetectionEfficiency=0.075
+    fluorescence=fluorescence/float(repetitions*numComplexes*network.timestep)*DetectionEfficiency #converted to counts per second per complex and adjusted for the detection efficiency of our setup
+    TripletPro=SumTriplets/float(repetitions*numComplexes)
+    return fluorescence,TripletPro,annihilated/float(max(absorbed,1))
+
+def simulationEventDriven(repetitions=10000000,Intensity=75,light='on',emissionTimes=False,seed=None,counters=None):
+    """
+    Event-driven counterpart of simulation(): covers the same time span of repetitions timesteps,
+    but only iterates over absorption, decay and triplet relaxation events.
+
+    returns the fluorescence in counts per second, the time averaged car triplet population and,
+    if emissionTimes, an array with the exact emission times of all fluoresced photons in seconds
+    """
+    complex=LHCIIEventDriven(Intensity=Intensity,rng=RandomSource(seed))
+    complex.counters=counters
+    duration=repetitions*complex.timestep
+    fluorescence=0
+    SumTriplets=0.0
+    times=[]
+    previous=0.0
+    for time,triplet,Fl in complex.advance(duration,light):
+        SumTriplets+=triplet*(time-previous)
+        previous=time
+        if Fl==True:
+            fluorescence+=1
+            if emissionTimes:
+                times.append(time)
+    SumTriplets+=complex.triplet*(duration-previous)
+    DetectionEfficiency=0.075
+    fluorescence=fluorescence/float(duration)*DetectionEfficiency #converted to counts per second and adjusted for the detection efficiency of our setup
+    TripletPro=SumTriplets/duration
+    if emissionTimes:
+        return fluorescence,TripletPro,np.asarray(times)
+    return fluorescence,TripletPro
+
+def simulationAdaptive(relativePrecision=0.01,timeBudget=None,Intensity=75,light='on',seed=None,blockSteps=20000,maxRepetitions=None,confidence=0.95,precisionObservables=None,counters=None):
+    """
+    Adaptive counterpart of simulation(): one complex is run in blocks of blockSteps timesteps until the
+    confidence intervals of the fluorescence rate and of the car triplet population are narrower than
+    relativePrecision (half width relative to the mean), or timeBudget seconds or maxRepetitions timesteps are used up.
+    The standard errors are estimated on line by batch means (see batchmeans.runAdaptive); the batches grow
+    with the run until they are much longer than the car triplet lifetime, so its autocorrelation is accounted for.
+
+    Input:
+        precisionObservables: list of 'fluorescence' and/or 'triplets' that have to reach relativePrecision (both if None)
+
+    returns the fluorescence in counts per second, the average car triplet population and a dict with the
+    estimates of both (mean, standardError, interval, ...), repetitions, elapsed and converged
+    """
+    from batchmeans import runAdaptive
+    complex=LHCII(Intensity=Intensity,rng=None if seed is None else RandomSource(seed))
+    complex.counters=counters
+    DetectionEfficiency=0.075
+    def block():
+        fluorescence=0
+        SumTriplets=0
+        for num in xrange(blockSteps):
+            SumTriplets+=complex.triplet
+            Abs,Fl= complex.update(light)
+            if Fl==True:
+                fluorescence+=1
+        return {'fluorescence':fluorescence/float(blockSteps*complex.timestep)*DetectionEfficiency,'triplets':SumTriplets/float(blockSteps)}
+    estimate=runAdaptive(block,['fluorescence','triplets'],relativePrecision,timeBudget,None if maxRepetitions is None else max(1,maxRepetitions//blockSteps),
+                         confidence,precisionObservables=precisionObservables)
+    estimate['repetitions']=estimate['blocks']*blockSteps
+    return estimate['fluorescence']['mean'],estimate['triplets']['mean'],estimate
+
+def transitionMatrices(complex,maxTriplets=50):
+    """
+    Builds the per-timestep transition matrices of LHCII.update from the probabilities of complex, split
+    into its three stages: car triplet relaxation, absorption of a photon (with certainty) and decay of the
+    excited state. States are numbered excited*(maxTriplets+1)+triplet, the triplet count is truncated at maxTriplets.
+
+    returns the relaxation, excitation and decay matrices and the probability to fluoresce in the decay stage per state
+    """
+    numTriplets=maxTriplets+1
+    n=2*numTriplets
+    relaxation=np.eye(n)
+    excitation=np.zeros((n,n))
+    decay=np.eye(n)
+    fluoresces=np.zeros(n)
+    for k in range(numTriplets):
+        if k>=1:
+            for e in range(2):
+                relaxation[e*numTriplets+k,e*numTriplets+k]=1-complex.TripletDecay
+                relaxation[e*numTriplets+k,e*numTriplets+k-1]=complex.TripletDecay
+        excitation[k,numTriplets+k]=1
+        excitation[numTriplets+k,numTriplets+k]=1
+        if k==0:
+            probabilityDecay,FlYield,TripletYield=complex.probabilityDecay,complex.FlYield,complex.TripletYield
+        else:
+            probabilityDecay,FlYield,TripletYield=complex.probabilityDecayTriplet,complex.FlYieldTriplet,complex.TripletYieldTriplet
+        excited=numTriplets+k
+        decay[excited,excited]=1-probabilityDecay
+        decay[excited,k]+=probabilityDecay*(1-(1-FlYield)*TripletYield)
+        decay[excited,min(k+1,maxTriplets)]+=probabilityDecay*(1-FlYield)*TripletYield
+        fluoresces[excited]=probabilityDecay*FlYield
+    return relaxation,excitation,decay,fluoresces
+
+def stationaryState(complex,light='on',maxTriplets=50):
+    """
+    Solves the master equation of the stepped model for its stationary state instead of sampling it.
+
+    returns the stationary state distribution (see transitionMatrices), the probability to fluoresce per timestep
+    and the average car triplet population
+    """
+    relaxation,excitation,decay,fluoresces=transitionMatrices(complex,maxTriplets)
+    absorptionProbability=min(complex.absorptionProbability,1.0) if light=='on' else 0.0
+    transition=(1-absorptionProbability)*relaxation.dot(decay)+absorptionProbability*relaxation.dot(excitation).dot(decay)
+    fluorescence=(1-absorptionProbability)*relaxation.dot(fluoresces)+absorptionProbability*relaxation.dot(excitation).dot(fluoresces)
+    n=len(fluoresces)
+    equations=transition.T-np.eye(n)
+    equations[-1,:]=1
+    rhs=np.zeros(n)
+    rhs[-1]=1
+    distribution=np.linalg.solve(equations,rhs)
+    triplets=np.tile(np.arange(maxTriplets+1),2)
+    return distribution,distribution.dot(fluorescence),distribution.dot(triplets)
+
+def segmentPropagator(complex,steps,maxTriplets=50):
+    """
+    Transition matrix of steps timesteps of update('on') at the current intensity of complex: the steps-th power of the
+    per-timestep matrix of the master equation (see stationaryState), computed by repeated squaring. It is exact as long
+    as the car triplet count stays below maxTriplets.
+
+    returns array with the probabilities of the states (see transitionMatrices) after the steps for every initial state
+    """
+    relaxation,excitation,decay,fluoresces=transitionMatrices(complex,maxTriplets)
+    absorptionProbability=min(complex.absorptionProbability,1.0)
+    transition=(1-absorptionProbability)*relaxation.dot(decay)+absorptionProbability*relaxation.dot(excitation).dot(decay)
+    return np.linalg.matrix_power(transition,steps)
+
+def saturationMasterEquation(intensities,maxTriplets=50,parameters=None):
+    """
+    Deterministic counterpart of the simulation() calls in saturation(): the stationary fluorescence
+    and car triplet population for every intensity, from the same per-timestep probabilities.
+    parameters overrides model parameters (see LHCII.setParameters).
+
+    returns arrays with the fluorescence in counts per second and the average car triplet population
+    """
     Fl=[]
     Tr=[]
-    plt.figure(1)
     for e in intensities:
-        print e
-        Fluo,Trip=simulation(Intensity=e)
+        complex=LHCII(Intensity=e)
+        if parameters is not None:
+            complex.setParameters(parameters)
+        distribution,Fluo,Trip=stationaryState(complex,maxTriplets=maxTriplets)
+        DetectionEfficiency=0.075
+        Fl.append(Fluo/complex.timestep*DetectionEfficiency)
+        Tr.append(Trip)
+    return np.asarray(Fl),np.asarray(Tr)
+
+def saturationCurve(intensities,numComplexes=None,masterEquation=False,processes=None,seed=0,repetitions=10000000,cache=None,disorder=None):
+    """
+    Computes the saturation curve without plotting, the arguments are those of saturation().
+    With numComplexes the repetitions are split over the complexes of an ensemble, which runs repetitions/numComplexes
+    timesteps, and with disorder its complexes draw their parameters from distributions (see simulationEnsemble).
+    Disorder needs the ensemble, i.e. numComplexes, and is not available with masterEquation.
+
+    returns lists with the fluorescence rate and the average car triplet population for every intensity
+    """
+    from sweep import runSweep, meanResults
+    from resultcache import modelParameters
+    if numComplexes is not None and repetitions%numComplexes:
+        raise ValueError('the repetitions are split over the complexes, %i is not a multiple of numComplexes=%i' % (repetitions,numComplexes))
+    if disorder is not None and (numComplexes is None or masterEquation):
+        raise ValueError('disorder is only simulated by the ensemble, give numComplexes and no masterEquation')
+    Fl=[]
+    Tr=[]
+    if masterEquation:
+        Fl,Tr=saturationMasterEquation(intensities)
+    elif numComplexes is not None and (processes is not None or cache is not None): #as below, batches of 10^7 complex timesteps (many triplet lifetimes) with the ensemble arguments in the cache key
+        results=runSweep(simulationEnsemble,[{'Intensity':e,'numComplexes':numComplexes,'disorder':disorder} for e in intensities],repetitions//numComplexes,
+                         batchSize=max(10000000//numComplexes,1),trialsArgument='repetitions',merge=meanResults,processes=1 if processes is None else processes,seed=seed,seedArgument='seed',
+                         cache=cache,models=[modelParameters(LHCII(Intensity=e)) for e in intensities])
+        Fl=[Fluo for Fluo,Trip in results]
+        Tr=[Trip for Fluo,Trip in results]
+    elif processes is not None or cache is not None: #intensities x batches of 10^6 repetitions spread over a process pool, cached intensities are not rerun (see sweep.cachedSweep)
+        results=runSweep(simulation,[{'Intensity':e} for e in intensities],repetitions,batchSize=1000000,trialsArgument='repetitions',merge=meanResults,processes=1 if processes is None else processes,seed=seed,seedArgument='seed',
+                         cache=cache,models=[modelParameters(LHCII(Intensity=e)) for e in intensities])
+        Fl=[Fluo for Fluo,Trip in results]
+        Tr=[Trip for Fluo,Trip in results]
+    else:
+        for e in intensities:
+            print e
+            if numComplexes is None:
+                Fluo,Trip=simulation(repetitions,Intensity=e)
+            else:
+                Fluo,Trip=simulationEnsemble(repetitions//numComplexes,numComplexes=numComplexes,Intensity=e,seed=seed,disorder=disorder)
+            Fl.append(Fluo)
+            Tr.append(Trip)
+    return Fl,Tr
+
+def saturationCurveAdaptive(intensities,relativePrecision=0.01,timeBudget=None,seed=0,blockSteps=20000,maxRepetitions=None,confidence=0.95):
+    """
+    Saturation curve with simulationAdaptive(): every intensity runs until its fluorescence rate and car triplet
+    population are known to relativePrecision, or for at most timeBudget seconds.
+
+    returns lists with the fluorescence rate and the average car triplet population for every intensity
+    and a list with the estimate dict of simulationAdaptive() for every intensity
+    """
+    from sweep import streamSeed
+    Fl=[]
+    Tr=[]
+    estimates=[]
+    for i,e in enumerate(intensities):
+        Fluo,Trip,estimate=simulationAdaptive(relativePrecision,timeBudget,Intensity=e,seed=None if seed is None else streamSeed(seed,i,0),
+                                              blockSteps=blockSteps,maxRepetitions=maxRepetitions,confidence=confidence)
         Fl.append(Fluo)
         Tr.append(Trip)
+        estimates.append(estimate)
+    return Fl,Tr,estimates
+
+def plotSaturation(intensities,Fl,Tr):
+    import matplotlib.pyplot as plt
+    plt.figure(1)
     plt.plot(intensities,Fl)
     plt.xlabel('Excitation intensity [W/cm^2]', size=15)
     plt.ylabel('Fluorescence Intensity [cps]', size=15)
@@ -143,45 +968,310 @@ def saturation(intensities):
     plt.ylabel('Average population of Car triplet states', size=15)
     plt.title('Average population of Car triplets present during one laser pulse', size=13)
     plt.show()
+
+def saturation(intensities,numComplexes=None,masterEquation=False,processes=None,seed=0,repetitions=10000000,cache=None,disorder=None):
+    Fl,Tr=saturationCurve(intensities,numComplexes,masterEquation,processes,seed,repetitions,cache,disorder)
+    plotSaturation(intensities,Fl,Tr)
     return Fl
     
 #saturation([10,30, 50, 100, 200,400,600,800])
 
-def simulationAOM(numtrials=100,AOMtimes=[50E-6,50E-6],Intensity=75):
-    complex2=LHCII(Intensity=Intensity)
+def steadyStatePulses(AOMtimes,lifetimes=5):
+    """
+    Number of AOM pulses after which a complex that started in the ground state has reached the periodic steady
+    state of the pulse train: lifetimes car triplet lifetimes divided by the pulse period.
+
+    returns int
+    """
+    return int(np.ceil(lifetimes*LHCII().TripletLifetime/float(AOMtimes[0]+AOMtimes[1])))
+
+def warmUp(complex,pulses,AOMtimes):
+    """
+    Runs pulses unrecorded AOM pulses on a complex, which carries its car triplets into the recorded pulses.
+    """
+    steps=int(AOMtimes[0]/complex.timestep)
+    offsteps=int(round(AOMtimes[1]/complex.timestep))
+    for e in range(pulses):
+        for num in range(steps):
+            complex.update('on')
+        complex.propagateDark(offsteps)
+
+def simulationAOM(numtrials=100,AOMtimes=[50E-6,50E-6],Intensity=75,seed=None,recorder=None,photonFile=None,checkpointFile=None,checkpointInterval=600.0,counters=None,weighted=False,warmupPulses=0):
+    """
+    Simulates numtrials AOM pulses on one LHCII. The fluoresced photons are recorded per timestep in a
+    histograms.StepRecorder and binned in bulk at the end; pass a recorder to rebin them afterwards with any bin width.
+    With photonFile every photon is also appended to a time-tagged photon stream (see photonstream.PhotonStream).
+    With checkpointFile the complete state (complex, histograms, random numbers, trial counter) is saved at most every
+    checkpointInterval seconds; calling it again with the same arguments (or resumeSimulationAOM) continues from there.
+    With counters (see transitionCounters) the transitions are tallied; its bins-1 first bins divide the pulse
+    into equal time bins, the last bin collects the dark intervals.
+    With weighted the triplet-quenched emission is recorded as a statistical weight (see LHCIIWeighted) instead of
+    being drawn, which gives unbiased histograms with a far smaller variance of their quenched part.
+    warmupPulses unrecorded pulses are run first, so that a batch of a sweep starts from the periodic steady state
+    (see steadyStatePulses) instead of the ground state.
+
+    returns the fluorescence histogram with 1 us bins (float if weighted)
+    """
+    if weighted and photonFile is not None:
+        raise ValueError('a photon stream records single photons, it cannot be combined with weighted')
+    if checkpointFile is not None:
+        from checkpoint import Checkpointer
+        arguments={'numtrials':numtrials,'AOMtimes':list(AOMtimes),'Intensity':Intensity,'seed':seed,'photonFile':photonFile}
+        if weighted:
+            arguments['weighted']=True
+        if warmupPulses:
+            arguments['warmupPulses']=warmupPulses
+        checkpointer=Checkpointer(checkpointFile,checkpointInterval,arguments)
+        state=checkpointer.load()
+        if state is not None and state['finished']:
+            return state['result']
+    complex2=(LHCIIWeighted if weighted else LHCII)(Intensity=Intensity,rng=None if seed is None and checkpointFile is None else RandomSource(seed))
+    timestep=float(complex2.timestep)
+    binning=1.0E-6
+    steps=int(AOMtimes[0]/timestep)
+    offsteps=int(round(AOMtimes[1]/timestep))
+    if recorder is None and weighted:
+        recorder=StepRecorder(steps,timestep,weightedChannels=['fluorescence','Annihilation'])
+    elif recorder is None:
+        recorder=StepRecorder(steps,timestep,eventChannels=['fluorescence','Annihilation'])
+    if photonFile is not None:
+        from photonstream import PhotonWriter, tripletFlags
+        photonStream=PhotonWriter(photonFile,{'model':'LHCII','Intensity':Intensity,'duration':AOMtimes[0],'offtime':AOMtimes[1],'timestep':timestep},append=checkpointFile is not None and state is not None)
+    first=0
+    if checkpointFile is not None and state is not None:
+        complex2=state['complex']
+        recorder.__dict__.update(state['recorder'].__dict__)
+        first=state['trial']
+        if photonFile is not None:
+            photonStream.truncate(state['photonFileSize'])
+    else:
+        warmUp(complex2,warmupPulses,AOMtimes)
+    if counters is not None:
+        if getattr(complex2,'counters',None) is not None: #resumed from a checkpoint
+            counters.__dict__.update(complex2.counters.__dict__)
+        complex2.counters=counters
+        counterBins=np.minimum(np.arange(steps)*(counters.bins-1)//steps,max(counters.bins-2,0)).tolist()
+    fluorescence=recorder.events['fluorescence']
+    Annihilation=recorder.events['Annihilation']
+    if weighted:
+        fluorescenceWeights=recorder.weights['fluorescence']
+        AnnihilationWeights=recorder.weights['Annihilation']
+    if checkpointFile is not None and state is None: #a crash before the first periodic checkpoint resumes from the start, without the photons written since
+        checkpointer.save({'complex':complex2,'recorder':recorder,'trial':0,'photonFileSize':photonStream.tell() if photonFile is not None else None})
+    for e in range(first,numtrials):
+        for num in range(steps):            
+            if counters is not None:
+                counters.bin=counterBins[num]
+            Abs,Fl= complex2.update('on')
+            if Fl: #True, or the weight of a quenched decay if weighted
+                fluorescence.append(num)
+                if weighted:
+                    fluorescenceWeights.append(Fl)
+                if complex2.triplet>=1:
+                    Annihilation.append(num)
+                    if weighted:
+                        AnnihilationWeights.append(Fl)
+        if photonFile is not None:
+            photonStream.append(e,np.asarray(fluorescence)*timestep,tripletFlags(CarTriplet=np.in1d(fluorescence,Annihilation)))
+        recorder.endPulse()
+        if counters is not None:
+            counters.bin=counters.bins-1
+        complex2.propagateDark(offsteps) #exact and at the cost of a few timesteps, see LHCII.propagateDark
+        if checkpointFile is not None and checkpointer.due():
+            checkpointer.save({'complex':complex2,'recorder':recorder,'trial':e+1,'photonFileSize':photonStream.tell() if photonFile is not None else None})
+
+    if photonFile is not None:
+        photonStream.close()
+    fluorescence=recorder.histogram('fluorescence',binning,AOMtimes[0])
+    if checkpointFile is not None:
+        checkpointer.finish(fluorescence)
+    return fluorescence
+
+def transitionCounters(bins=1,network=False):
+    """
+    returns counters.TransitionCounters for the LHCII transitions (TRANSITIONS, NETWORKTRANSITIONS with network) with bins time bins
+    """
+    from counters import TransitionCounters
+    if network:
+        return TransitionCounters('LHCIINetwork',NETWORKTRANSITIONS,bins)
+    return TransitionCounters('LHCII',TRANSITIONS,bins)
+
+def resumeSimulationAOM(checkpointFile):
+    """
+    Continues an interrupted simulationAOM() run from its checkpoint, with the arguments stored in the checkpoint.
+    """
+    from checkpoint import loadCheckpoint
+    return simulationAOM(checkpointFile=checkpointFile,**loadCheckpoint(checkpointFile)['arguments'])
+
+def simulationProtocol(protocol,numtrials=100,seed=None,binning=1.0E-6,counters=None,weighted=False):
+    """
+    Simulates numtrials repetitions of an illumination protocol on one LHCII, e.g. pulse trains, ramps or multi-level
+    steps (see illumination.Protocol). Recorded segments are stepped at their intensity; segments that are not recorded
+    are propagated in one draw, the dark ones with the triplet relaxation (see LHCII.propagateDark) and the lit ones with
+    the transition matrix of the whole segment (see segmentPropagator), so their cost does not grow with their length.
+    With counters (see transitionCounters) the transitions of all segments are tallied, so the unrecorded lit segments
+    are stepped as well; with weighted the triplet-quenched emission is recorded as a statistical weight (see simulationAOM).
+
+    Input:
+        protocol: illumination.Protocol or its list of (duration, intensity, record) segments
+
+    returns the fluorescence, car triplet and annihilation histograms with bins of width binning over the
+    recorded timeline (the recorded segments one after the other)
+    """
+    from illumination import Protocol
+    if not isinstance(protocol,Protocol):
+        protocol=Protocol(protocol)
+    complex2=(LHCIIWeighted if weighted else LHCII)(rng=None if seed is None else RandomSource(seed))
+    complex2.counters=counters
     timestep=float(complex2.timestep)
-    fluorescence=[]
+    timeline,steps=protocol.timeline(timestep)
+    if steps==0:
+        raise ValueError('the protocol does not record any timestep')
+    if weighted:
+        recorder=StepRecorder(steps,timestep,valueChannels=['triplet'],weightedChannels=['fluorescence','Annihilation'])
+        fluorescenceWeights=recorder.weights['fluorescence']
+        AnnihilationWeights=recorder.weights['Annihilation']
+    else:
+        recorder=StepRecorder(steps,timestep,valueChannels=['triplet'],eventChannels=['fluorescence','Annihilation'])
+    SumTriplets=recorder.values['triplet']
+    fluorescence=recorder.events['fluorescence']
+    Annihilation=recorder.events['Annihilation']
+    propagators={} #per unrecorded lit segment, computed in the first trial
+    for e in range(numtrials):
+        for j,(segmentSteps,Intensity,offset) in enumerate(timeline):
+            if offset is None and Intensity==0:
+                complex2.propagateDark(segmentSteps)
+                continue
+            complex2.Intensity=Intensity
+            complex2.updatePhotonFlux(Intensity)
+            light='on' if Intensity>0 else 'off'
+            if offset is None and counters is None:
+                if j not in propagators:
+                    propagators[j]=segmentPropagator(complex2,segmentSteps)
+                complex2.propagateLight(propagators[j])
+                continue
+            if offset is None:
+                for num in range(segmentSteps):
+                    complex2.update(light)
+                continue
+            for num in range(offset,offset+segmentSteps):
+                Abs,Fl= complex2.update(light)
+                SumTriplets[num]=complex2.triplet
+                if Fl:
+                    fluorescence.append(num)
+                    if weighted:
+                        fluorescenceWeights.append(Fl)
+                    if complex2.triplet>=1:
+                        Annihilation.append(num)
+                        if weighted:
+                            AnnihilationWeights.append(Fl)
+        recorder.endPulse()
+    return tuple(recorder.histogram(channel,binning) for channel in ['fluorescence','triplet','Annihilation'])
+
+def simulationAOMEventDriven(numtrials=100,AOMtimes=[50E-6,50E-6],Intensity=75,emissionTimes=False,seed=None):
+    """
+    Event-driven counterpart of simulationAOM(). The dark interval is propagated with the exact
+    triplet relaxation events in continuous time.
+
+    returns the fluorescence histogram with 1 us bins and, if emissionTimes, an array with
+    the trial index and the exact time in the pulse of every fluoresced photon
+    """
+    complex2=LHCIIEventDriven(Intensity=Intensity,rng=RandomSource(seed))
     binning=1.0E-6
     num_bins=int(AOMtimes[0]/binning)
-    for i in range(num_bins):
-        fluorescence.append(0)
+    fluorescence=np.zeros(num_bins,dtype=np.int64)
+    times=[]
     for e in range(numtrials):
-        for num in range(int(AOMtimes[0]/timestep)):            
-            Abs,Fl= complex2.update('on')
+        for time,triplet,Fl in complex2.advance(AOMtimes[0],'on'):
             if Fl==True:
-                fluorescence[int(num*timestep/AOMtimes[0]*num_bins)]+=1
-        complex2.TripletDecay=1-np.exp(-(AOMtimes[1]/3.0)/9.0E-6)
-        for num in range(3):
-            Abs,Fl= complex2.update('off')
-        
-        complex2.TripletDecay=1-np.exp(-timestep/9.0E-6)
-
+                fluorescence[min(int(time/AOMtimes[0]*num_bins),num_bins-1)]+=1
+                if emissionTimes:
+                    times.append((e,time))
+        for event in complex2.advance(AOMtimes[1],'off'):
+            pass
+    if emissionTimes:
+        return fluorescence,np.asarray(times).reshape(-1,2)
     return fluorescence
 
-def AOM(numtrials=5000,AOMtimes=[50E-6,50E-6],Intensities=[500]):
-    
+def simulationAOMMultiscale(numtrials=100,AOMtimes=[50E-6,50E-6],Intensity=75,seed=None,weighted=False,counters=None,parameters=None,warmupPulses=0):
+    """
+    Multiscale counterpart of simulationAOM() (see LHCIIMultiscale): only the car triplet formations and relaxations
+    are iterated, instead of one update per 13 ns timestep, and the dark interval is propagated with the exact triplet
+    relaxations. The photons between two slow events are drawn from their Poisson distribution, or with weighted
+    recorded as their expected number (float histogram with less variance). With counters the slow transitions are tallied.
+    parameters overrides model parameters (see LHCII.setParameters). warmupPulses unrecorded pulses are run first (see simulationAOM).
+
+    returns the fluorescence histogram with 1 us bins
+    """
+    complex2=LHCIIMultiscale(Intensity=Intensity,rng=RandomSource(seed))
+    if parameters is not None:
+        complex2.setParameters(parameters)
+    for e in range(warmupPulses):
+        for interval in complex2.advance(AOMtimes[0],'on'):
+            pass
+        for interval in complex2.advance(AOMtimes[1],'off'):
+            pass
+    complex2.counters=counters
+    recorder=IntervalRecorder(AOMtimes[0],1.0E-6,['fluorescence'])
+    for e in range(numtrials):
+        for start,end,triplet,fluorescencerate in complex2.advance(AOMtimes[0],'on'):
+            if weighted:
+                recorder.addRates(start,end,{'fluorescence':fluorescencerate})
+            else:
+                recorder.addPoissonEvents(['fluorescence'],start,end,fluorescencerate,complex2.rng)
+        for interval in complex2.advance(AOMtimes[1],'off'):
+            pass
+    if weighted:
+        return recorder.totals['fluorescence']
+    return np.rint(recorder.totals['fluorescence']).astype(np.int64)
+
+def AOMCurves(numtrials=5000,AOMtimes=[50E-6,50E-6],Intensities=[500],processes=None,seed=0,batchSize=250,checkpoint=None,weighted=False,multiscale=False,shared=False,warmupPulses=None):
+    """
+    Computes the AOM fluorescence transients without plotting, the arguments are those of AOM().
+    With weighted the triplet-quenched emission is recorded as a statistical weight (see simulationAOM),
+    with multiscale the transients are computed with simulationAOMMultiscale, which has no checkpoints.
+    With processes and shared the workers sum their histograms in shared memory (see sweep.runSharedSweep), which
+    returns float histograms.
+    With processes every trial batch runs on a new complex, which first runs warmupPulses unrecorded pulses
+    (steadyStatePulses(AOMtimes) if None) to carry the car triplets into its first pulse as the serial run does.
+    With too few warm-up pulses the result depends on batchSize, because every batch starts from the ground state.
+
+    returns list with the fluorescence histogram (1 us bins) of every intensity
+    """
+    from sweep import runSweep, runSharedSweep
+    if multiscale and checkpoint is not None:
+        raise ValueError('simulationAOMMultiscale does not write checkpoints')
+    simulate=simulationAOMMultiscale if multiscale else simulationAOM
+    curves=[]
+    if processes is not None: #intensities x trial batches spread over a process pool, every batch is warmed up from the ground state
+        if warmupPulses is None:
+            warmupPulses=steadyStatePulses(AOMtimes)
+        points=[{'AOMtimes':AOMtimes,'Intensity':Intensity,'weighted':weighted,'warmupPulses':warmupPulses} for Intensity in Intensities]
+        if shared:
+            results=runSharedSweep(simulate,points,numtrials,(int(AOMtimes[0]/1.0E-6),),batchSize=batchSize,processes=processes,seed=seed,seedArgument='seed')
+        else:
+            results=runSweep(simulate,points,numtrials,batchSize=batchSize,processes=processes,seed=seed,seedArgument='seed')
+    for j in range(len(Intensities)):
+        print j
+        if processes is None and checkpoint is not None: #one checkpoint file per intensity, rerun AOM to resume
+            fluorescence=simulationAOM(numtrials,AOMtimes,Intensity=Intensities[j],seed=seed+j,checkpointFile='%s.%i' % (checkpoint,j),weighted=weighted)
+        elif processes is None:
+            fluorescence=simulate(numtrials,AOMtimes,Intensity=Intensities[j],weighted=weighted)
+        else:
+            fluorescence=results[j]
+        curves.append(np.asarray(fluorescence))
+    return curves
+
+def plotAOM(AOMtimes,curves):
+    from plotting import plotHistogram
+    import matplotlib.pyplot as plt
     plt.figure(3)
     plt.clf()
     colors=['k','r','b','g']
-    for j in range(len(Intensities)):
-        print j
-        fluorescence=simulationAOM(numtrials,AOMtimes,Intensity=Intensities[j])
-        fluorescence=np.asarray(fluorescence)
-        fluorescence=fluorescence/float(max(fluorescence))
-        xaxis=[]
-        for i in range(len(fluorescence)):
-            xaxis.append(AOMtimes[0]/float(len(fluorescence))*i*1E6)     
-        plt.bar(xaxis,fluorescence,width=1.0E-6*1E6,color=colors[j])
+    for j in range(len(curves)):
+        fluorescence=curves[j]
+        fluorescence=np.asarray(fluorescence)/float(max(fluorescence))
+        plotHistogram(plt.gca(),fluorescence,AOMtimes[0]/float(len(fluorescence))*1E6,fill=True,color=colors[j])
     plt.xlabel('AOM time [us]',size=15)
     plt.ylabel('Fluorescence Intensity [a.u.]',size=15)
     #plt.ylim([0,700])
@@ -189,8 +1279,73 @@ def AOM(numtrials=5000,AOMtimes=[50E-6,50E-6],Intensities=[500]):
     plt.legend((r'75 $W/cm^2$', r'150 $W/cm^2$',r'500 $W/cm^2$',r'1500 $W/cm^2$'),prop={'size':13})
     plt.title('Pulse wave excitation: Triplet accumulation',size=15)
     plt.show()
-    
-AOM(Intensities=[75,150,500,1500])
+
+def AOM(numtrials=5000,AOMtimes=[50E-6,50E-6],Intensities=[500],processes=None,seed=0,batchSize=250,checkpoint=None,weighted=False,multiscale=False,shared=False,warmupPulses=None):
+    plotAOM(AOMtimes,AOMCurves(numtrials,AOMtimes,Intensities,processes,seed,batchSize,checkpoint,weighted,multiscale,shared,warmupPulses))
+
+def fitAOM(data,start,steps,bounds=None,numtrials=1000,AOMtimes=[50E-6,50E-6],Intensity=500,errors=None,scale=True,
+           processes=1,seed=0,batchSize=None,cache=None,iterations=10,tolerance=1E-3):
+    """
+    Fits model parameters to a measured AOM fluorescence trace (see fitting.fitParameters). Every iteration simulates a
+    batch of candidate parameter sets with simulationAOMMultiscale (weighted), spread over processes, and all candidates
+    draw the same random numbers (common random numbers), so the chi square is smooth in the parameters.
+    The multiscale simulation agrees with simulationAOM() as long as the absorption stays far below one photon per
+    timestep, i.e. up to thousands of W/cm^2.
+    With cache (see sweep.runSweep) candidates that were simulated before, e.g. in an earlier fit, are not rerun.
+    The errors only account for the noise of data, so numtrials should make the simulated trace far less noisy than data.
+
+    Input:
+        data: array with the measured fluorescence per 1 us bin during the pulse
+        start: dict with the initial value of every fitted parameter, e.g. {'TripletYield':0.5,'TripletLifetime':9E-6}
+            (any attribute of LHCII, see LHCII.setParameters)
+        steps: dict with the initial step size of every fitted parameter
+        bounds: dict with (lower, upper) limits, the physical limits if None (see fitting.parameterBounds)
+        numtrials: int representing the number of simulated pulses per candidate
+        errors: array or float with the standard deviation of data, None to estimate it from the residuals
+        scale: bool, True for data in arbitrary units (the amplitude is fitted as well), False for data in photons per pulse
+
+    returns dict of fitting.fitParameters, with the amplitude and the simulated trace (curve) of the best parameters
+    """
+    from sweep import runSweep
+    from fitting import fitParameters, chiSquare, parameterBounds
+    if not Intensity>0:
+        raise ValueError('the AOM pulses need an intensity > 0, not %r' % Intensity)
+    data=np.asarray(data,dtype=float)
+    if bounds is None:
+        bounds=parameterBounds(start)
+    def simulate(candidates):
+        points=[{'AOMtimes':AOMtimes,'Intensity':Intensity,'weighted':True,'parameters':candidate} for candidate in candidates]
+        results=runSweep(simulationAOMMultiscale,points,numtrials,batchSize=batchSize,processes=processes,seed=seed,seedArgument='seed',cache=cache,commonStreams=True)
+        return [fluorescence/float(numtrials) for fluorescence in results]
+    def evaluate(candidates):
+        return [chiSquare(data,curve,errors,scale)[0] for curve in simulate(candidates)]
+    fit=fitParameters(evaluate,start,steps,bounds,iterations,tolerance=tolerance,degreesOfFreedom=None if errors is not None else len(data)-len(start)-scale)
+    curve=simulate([fit['parameters']])[0]
+    fit['amplitude']=chiSquare(data,curve,errors,scale)[1]
+    fit['curve']=fit['amplitude']*curve
+    return fit
+
+def fitSaturation(intensities,data,start,steps,bounds=None,errors=None,scale=True,maxTriplets=50,iterations=10,tolerance=1E-3):
+    """
+    Fits model parameters to a measured saturation curve with saturationMasterEquation(), which has no sampling noise.
+    The arguments are those of fitAOM(), data holds the fluorescence at every intensity.
+
+    returns dict of fitting.fitParameters, with the amplitude and the fluorescence (curve) of the best parameters
+    """
+    from fitting import fitParameters, chiSquare, parameterBounds
+    data=np.asarray(data,dtype=float)
+    if bounds is None:
+        bounds=parameterBounds(start)
+    def evaluate(candidates):
+        return [chiSquare(data,saturationMasterEquation(intensities,maxTriplets,candidate)[0],errors,scale)[0] for candidate in candidates]
+    fit=fitParameters(evaluate,start,steps,bounds,iterations,tolerance=tolerance,degreesOfFreedom=None if errors is not None else len(data)-len(start)-scale)
+    curve=saturationMasterEquation(intensities,maxTriplets,fit['parameters'])[0]
+    fit['amplitude']=chiSquare(data,curve,errors,scale)[1]
+    fit['curve']=fit['amplitude']*curve
+    return fit
+
+if __name__=='__main__':
+    AOM(Intensities=[75,150,500,1500])
 
 
 
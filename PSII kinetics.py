@@ -1,7 +1,11 @@
 import random
-import matplotlib.pyplot as plt
 import numpy as np
-from multiprocessing import Pool
+from randomsource import RandomSource
+from histograms import StepRecorder, IntervalRecorder
+
+#transitions tallied by a counters.TransitionCounters attached to a PSII; the decays include those that fluoresce or form a triplet
+TRANSITIONS=['absorption','singletSingletAnnihilation','singletDecay','fluorescence','ChlTripletFormation','CarTripletFormation',
+             'quenchedDecay','quenchedFluorescence','quenchedCarTripletFormation','ChlTripletRelaxation','CarTripletRelaxation']
 
 
 class PSII(object):
@@ -9,10 +13,11 @@ class PSII(object):
     Representation of a LHCII particle
     """   
 
-    def __init__(self,state = "ground", Intensity = 75,timestep=2.5E-7):
+    def __init__(self,state = "ground", Intensity = 75,timestep=2.5E-7,rng = None):
         """
 
         Initialize a LHCII instance, saves all parameters as attributes of the instance.
+        rng is the source of the random numbers, e.g. a randomsource.RandomSource (the random module if None).
         """
 
         self.timestep=timestep #in seconds
@@ -21,16 +26,24 @@ class PSII(object):
         self.absCrossection =7E-15 #cm^2
         self.absorptionrate = self.Intensity * self.absCrossection/(3.14*10**-19) #per second
         self.absorptionProbability=self.absorptionrate*self.timestep  #absorption probability per timestep
-        self.probabilityDecay = 1-np.exp(-timestep/1.5E-9) #Probability for excited state decay during timestep without a car triplet
-        self.probabilityDecayTriplet = 1-np.exp(-timestep/150E-12) #Probability for excited state decay during timestep in the presence of a car triplet
+        self.lifetime=1.5E-9 #excited state lifetime without a triplet, in seconds
+        self.lifetimeTriplet=150E-12 #excited state lifetime in the presence of a triplet, in seconds
+        self.CarTripletLifetime=9E-6 #car triplet lifetime, in seconds
+        self.ChlTripletLifetime=2E-3 #Chl triplet lifetime, in seconds
+        self.probabilityDecay = 1-np.exp(-timestep/self.lifetime) #Probability for excited state decay during timestep without a car triplet
+        self.probabilityDecayTriplet = 1-np.exp(-timestep/self.lifetimeTriplet) #Probability for excited state decay during timestep in the presence of a car triplet
         self.ChlTriplet=0 # 0 equals no triplet; 1 equals a triplet
         self.CarTriplet=0 # 0 equals no triplet; 1 equals a triplet
-        self.CarTripletDecay=1-np.exp(-timestep/9E-6) #Probability for car triplet state decay during timestep
-        self.ChlTripletDecay=1-np.exp(-timestep/2E-3) #Probability for Chl triplet state decay during timestep
+        self.CarTripletDecay=1-np.exp(-timestep/self.CarTripletLifetime) #Probability for car triplet state decay during timestep
+        self.ChlTripletDecay=1-np.exp(-timestep/self.ChlTripletLifetime) #Probability for Chl triplet state decay during timestep
         self.ChlTripletYield=0.1
         self.CarTripletYield=0.1
         self.FlYield=0.180
         self.FlYieldTriplet=0.01
+        if rng is None:
+            rng = random
+        self.rng = rng
+        self.counters = None #counters.TransitionCounters tallying the transitions, None to switch the counting off
         
 
 
@@ -44,6 +57,44 @@ class PSII(object):
         self.absorptionrate = self.Intensity * self.absCrossection/(3.14*10**-19) #per second
         self.absorptionProbability=self.absorptionrate*self.timestep  
 
+    def continuousRates(self, light):
+        """
+        Rates of the continuous-time counterparts (see PSIIEventDriven) that reproduce the stepped chain of update:
+        at most one absorption per timestep with probability absorptionProbability, which saturates at one absorption
+        per timestep above ~180 W/cm^2, and at most one Chl and one car triplet relaxation per timestep with
+        probability ChlTripletDecay and CarTripletDecay.
+
+        input: str "on" or "off"
+
+        returns the absorption rate and the Chl and car triplet relaxation rates, per second
+        """
+        absorptionrate = min(self.absorptionProbability, 1.0)/self.timestep if light == "on" else 0.0
+        return absorptionrate, self.ChlTripletDecay/self.timestep, self.CarTripletDecay/self.timestep
+
+    def setParameters(self, parameters):
+        """
+        Overrides parameters, e.g. {'FlYield':0.2,'ChlTripletLifetime':1E-3}, and updates the probabilities that depend on them.
+        Only the probabilities whose parameters are given are recomputed, so a probability such as probabilityDecay
+        can also be set directly.
+
+        input: dict with the attribute names and values
+        """
+        for name, value in parameters.items():
+            if not hasattr(self, name):
+                raise ValueError('%s has no parameter %r' % (type(self).__name__, name))
+            setattr(self, name, value)
+        changed = lambda *names: any(name in parameters for name in names + ('timestep',))
+        if changed('Intensity', 'absCrossection'):
+            self.updatePhotonFlux(self.Intensity)
+        if changed('lifetime'):
+            self.probabilityDecay = 1-np.exp(-self.timestep/self.lifetime)
+        if changed('lifetimeTriplet'):
+            self.probabilityDecayTriplet = 1-np.exp(-self.timestep/self.lifetimeTriplet)
+        if changed('CarTripletLifetime'):
+            self.CarTripletDecay=1-np.exp(-self.timestep/self.CarTripletLifetime)
+        if changed('ChlTripletLifetime'):
+            self.ChlTripletDecay=1-np.exp(-self.timestep/self.ChlTripletLifetime)
+
     def doesFluoresce(self):
         """
         Checks for fluorescence from the excited LHCII complex, the probablities are different for the two cases:
@@ -53,30 +104,46 @@ class PSII(object):
         returns boolean: True if photon is fluoresced False otherwise
         """          
         if self.state == "excited" and self.CarTriplet==0 and self.ChlTriplet==0:
-            if random.random() <= self.probabilityDecay:
+            if self.rng.random() <= self.probabilityDecay:
                 self.state = "ground"
-                if random.random() <= self.FlYield:	
+                if self.counters is not None:
+                    self.counters.count('singletDecay')
+                if self.rng.random() <= self.FlYield:	
+                    if self.counters is not None:
+                        self.counters.count('fluorescence')
                     return True
-                if random.random()<= self.ChlTripletYield:
+                if self.rng.random()<= self.ChlTripletYield:
                     self.ChlTriplet=1
+                    if self.counters is not None:
+                        self.counters.count('ChlTripletFormation')
                     return False
-                elif random.random()<= self.CarTripletYield:
+                elif self.rng.random()<= self.CarTripletYield:
                     self.CarTriplet+=1
+                    if self.counters is not None:
+                        self.counters.count('CarTripletFormation')
                     return False
                 else:
                     return False                                    
             else:
                 return False
         if self.state == "excited" and (self.CarTriplet>=1 or self.ChlTriplet>=1):
-            if random.random() <= self.probabilityDecayTriplet:
+            if self.rng.random() <= self.probabilityDecayTriplet:
                 self.state = "ground"
-                if random.random()<= self.CarTripletYield/10.0:
+                if self.counters is not None:
+                    self.counters.count('quenchedDecay')
+                if self.rng.random()<= self.CarTripletYield/10.0:
                     self.CarTriplet+=1
+                    if self.counters is not None:
+                        self.counters.count('quenchedCarTripletFormation')
                 if self.CarTriplet+self.ChlTriplet>=2:
-                    if random.random() <= self.FlYieldTriplet:
+                    if self.rng.random() <= self.FlYieldTriplet:
+                        if self.counters is not None:
+                            self.counters.count('quenchedFluorescence')
                         return True
                 elif self.CarTriplet+self.ChlTriplet==1:
-                    if random.random() <= self.FlYieldTriplet:
+                    if self.rng.random() <= self.FlYieldTriplet:
+                        if self.counters is not None:
+                            self.counters.count('quenchedFluorescence')
                         return True
                 else:
                     return False
@@ -98,11 +165,15 @@ class PSII(object):
         """            
         if light == "off":
             if self.ChlTriplet>=1:
-                if random.random() <= self.ChlTripletDecay:
+                if self.rng.random() <= self.ChlTripletDecay:
                     self.ChlTriplet-=1 
+                    if self.counters is not None:
+                        self.counters.count('ChlTripletRelaxation')
             if self.CarTriplet>=1:
-                if random.random() <= self.CarTripletDecay:
+                if self.rng.random() <= self.CarTripletDecay:
                     self.CarTriplet-=1 
+                    if self.counters is not None:
+                        self.counters.count('CarTripletRelaxation')
             if self.state == "excited":
                 return False, self.doesFluoresce() 
             else:
@@ -110,19 +181,27 @@ class PSII(object):
 
         if light == "on":  
             if self.ChlTriplet>=1:
-                if random.random() <= self.ChlTripletDecay:
+                if self.rng.random() <= self.ChlTripletDecay:
                     self.ChlTriplet-=1
+                    if self.counters is not None:
+                        self.counters.count('ChlTripletRelaxation')
             if self.CarTriplet>=1:
-                if random.random() <= self.CarTripletDecay:
+                if self.rng.random() <= self.CarTripletDecay:
                     self.CarTriplet-=1       
+                    if self.counters is not None:
+                        self.counters.count('CarTripletRelaxation')
             Absorbed = False
-            if random.random() <= self.absorptionProbability:
+            if self.rng.random() <= self.absorptionProbability:
                 Absorbed = True
+                if self.counters is not None:
+                    self.counters.count('absorption')
                 if self.state == "ground":
                     self.state = "excited"
                     return Absorbed, self.doesFluoresce()
                 if self.state == "excited":
                     #print 'Singlet=Singlet annihilation!'
+                    if self.counters is not None:
+                        self.counters.count('singletSingletAnnihilation')
                     return Absorbed, self.doesFluoresce()
                     
             else:
@@ -131,8 +210,374 @@ class PSII(object):
                 else:   
                     return False, False  
                     
-def simulation(repetitions=1000000,Intensity=75,light='on'):
-    complex=PSII(Intensity=Intensity)
+    def propagateDark(self, steps):
+        """
+        Advances the complex by steps timesteps without light, as steps calls of update('off') would, but at the cost
+        of a few timesteps: the complex is stepped only while it is excited. Afterwards nothing but the triplet
+        relaxation is left, at most one Chl and one car triplet per timestep with probability ChlTripletDecay and
+        CarTripletDecay, so the remaining timesteps relax min(ChlTriplet, Binomial(remaining timesteps, ChlTripletDecay))
+        Chl triplets and likewise car triplets, which is exact.
+
+        Input:
+            steps: int representing the number of timesteps of the dark interval
+
+        returns the number of photons fluoresced during the dark interval
+        """
+        fluoresced = 0
+        while steps > 0 and self.state == "excited":
+            Abs, Fl = self.update("off")
+            if Fl:
+                fluoresced += Fl
+            steps -= 1
+        if steps > 0 and (self.ChlTriplet >= 1 or self.CarTriplet >= 1):
+            binomial = getattr(self.rng, 'binomial', np.random.binomial)
+            ChlRelaxed = min(self.ChlTriplet, int(binomial(steps, self.ChlTripletDecay))) if self.ChlTriplet >= 1 else 0
+            CarRelaxed = min(self.CarTriplet, int(binomial(steps, self.CarTripletDecay))) if self.CarTriplet >= 1 else 0
+            self.ChlTriplet -= ChlRelaxed
+            self.CarTriplet -= CarRelaxed
+            if self.counters is not None:
+                self.counters.count('ChlTripletRelaxation', ChlRelaxed)
+                self.counters.count('CarTripletRelaxation', CarRelaxed)
+        return fluoresced
+
+    def propagateLight(self, propagator):
+        """
+        Advances the complex by a segment of constant illumination in one draw, as the update('on') calls summarized
+        by propagator (see segmentPropagator) would: the state after the segment is drawn from the row of the current
+        state. Nothing is recorded or counted.
+
+        Input:
+            propagator: array with the probabilities of the states after the segment for every initial state
+        """
+        numTriplets = len(propagator)//4
+        if self.CarTriplet >= numTriplets:
+            raise ValueError('%i car triplets are beyond the %i of the propagator' % (self.CarTriplet, numTriplets-1))
+        row = propagator[((self.state == "excited")*2+self.ChlTriplet)*numTriplets+self.CarTriplet]
+        state = min(int(np.searchsorted(np.cumsum(row), self.rng.random()*row.sum())), len(row)-1)
+        excitedChl, self.CarTriplet = divmod(state, numTriplets)
+        excited, self.ChlTriplet = divmod(excitedChl, 2)
+        self.state = "excited" if excited else "ground"
+
+class PSIIWeighted(PSII):
+    """
+    Representation of a C2S2 supercomplex whose rare triplet-quenched emission is recorded as a statistical weight
+    """
+
+    def doesFluoresce(self):
+        """
+        Same transitions as PSII.doesFluoresce, except that a decay in the presence of a triplet does not draw its
+        rare fluorescence (yield FlYieldTriplet) but returns FlYieldTriplet as the weight of the decay. The state after a
+        quenched decay does not depend on whether it fluoresced, so the trajectories follow the same law as those of
+        PSII and the summed weights are an unbiased estimate of the quenched emission with a far smaller variance.
+
+        returns True if a photon is fluoresced by an unquenched singlet, the fluorescence weight (float) of a
+        quenched decay, False otherwise
+        """
+        if self.state == "excited" and (self.CarTriplet>=1 or self.ChlTriplet>=1):
+            if self.rng.random() <= self.probabilityDecayTriplet:
+                self.state = "ground"
+                if self.counters is not None:
+                    self.counters.count('quenchedDecay')
+                if self.rng.random()<= self.CarTripletYield/10.0:
+                    self.CarTriplet+=1
+                    if self.counters is not None:
+                        self.counters.count('quenchedCarTripletFormation')
+                if self.counters is not None:
+                    self.counters.count('quenchedFluorescence',self.FlYieldTriplet)
+                return self.FlYieldTriplet
+            return False
+        return PSII.doesFluoresce(self)
+
+class PSIIEnsemble(PSII):
+    """
+    Representation of an ensemble of independent C2S2 supercomplexes, kept as NumPy state arrays
+    """   
+
+    def __init__(self, numComplexes = 1000, Intensity = 75, timestep=2.5E-7, rng = None):
+        """
+
+        Initialize a PSIIEnsemble instance. All rate constants and yields are taken from PSII,
+        the per-complex state is kept in arrays:
+            excited: boolean array, True where the complex is in the excited singlet state
+            ChlTriplet: int array with the number of Chl triplets present on each complex
+            CarTriplet: int array with the number of car triplets present on each complex
+            rng: source of the bulk random draws, a randomsource.RandomSource or numpy RandomState (a new unseeded one if None)
+        """
+        PSII.__init__(self, Intensity=Intensity, timestep=timestep)
+        self.numComplexes = numComplexes
+        self.excited = np.zeros(numComplexes, dtype=bool)
+        self.ChlTriplet = np.zeros(numComplexes, dtype=np.int64)
+        self.CarTriplet = np.zeros(numComplexes, dtype=np.int64)
+        if rng is None:
+            rng = np.random.RandomState()
+        self.rng = rng
+        self.disorder = None #dict with the per-complex parameter arrays drawn by disorder.applyDisorder, None if homogeneous
+
+    def doesFluoresce(self):
+        """
+        Vectorized PSII.doesFluoresce. Excited complexes without triplets decay and then fluoresce, form a
+        Chl triplet or form a car triplet, in that order. Excited complexes with a triplet decay with the
+        quenched probability, may form an additional car triplet and fluoresce with FlYieldTriplet.
+
+        returns boolean array: True where a photon is fluoresced
+        """          
+        n = self.numComplexes
+        quenched = (self.ChlTriplet >= 1) | (self.CarTriplet >= 1)
+        decays = self.rng.random_sample(n) <= np.where(quenched, self.probabilityDecayTriplet, self.probabilityDecay)
+        decays &= self.excited
+        self.excited &= ~decays
+        free = decays & ~quenched
+        quench = decays & quenched
+        first = self.rng.random_sample(n)
+        second = self.rng.random_sample(n)
+        third = self.rng.random_sample(n)
+        fluoresced = free & (first <= self.FlYield)
+        formsChl = free & ~fluoresced & (second <= self.ChlTripletYield)
+        formsCar = free & ~fluoresced & ~formsChl & (third <= self.CarTripletYield)
+        quenchedCar = quench & (first <= self.CarTripletYield/10.0)
+        quenchedFluorescence = quench & (second <= self.FlYieldTriplet)
+        if self.counters is not None:
+            for transition, happened in [('singletDecay', free), ('fluorescence', fluoresced), ('ChlTripletFormation', formsChl), ('CarTripletFormation', formsCar),
+                                         ('quenchedDecay', quench), ('quenchedFluorescence', quenchedFluorescence), ('quenchedCarTripletFormation', quenchedCar)]:
+                self.counters.count(transition, np.count_nonzero(happened))
+        formsCar |= quenchedCar
+        fluoresced |= quenchedFluorescence
+        self.ChlTriplet[formsChl] = 1
+        self.CarTriplet += formsCar
+        return fluoresced
+
+    def update(self, light):
+        """
+        Advances all complexes by one timestep, following the same order of transitions as PSII.update:
+        Chl and car triplet decay, absorption (only if light is "on") and decay of the excited complexes.
+
+        Input:
+            light: str "on" or "off" representing if the photon flux will be hitting the complexes during a timestep
+
+        returns a pair of boolean arrays: absorbed and fluoresced photons per complex
+        """            
+        n = self.numComplexes
+        ChlRelaxes = (self.ChlTriplet >= 1) & (self.rng.random_sample(n) <= self.ChlTripletDecay)
+        CarRelaxes = (self.CarTriplet >= 1) & (self.rng.random_sample(n) <= self.CarTripletDecay)
+        self.ChlTriplet -= ChlRelaxes
+        self.CarTriplet -= CarRelaxes
+        if self.counters is not None:
+            self.counters.count('ChlTripletRelaxation', np.count_nonzero(ChlRelaxes))
+            self.counters.count('CarTripletRelaxation', np.count_nonzero(CarRelaxes))
+        if light == "on":
+            absorbed = self.rng.random_sample(n) <= self.absorptionProbability
+            if self.counters is not None:
+                self.counters.count('absorption', np.count_nonzero(absorbed))
+                self.counters.count('singletSingletAnnihilation', np.count_nonzero(absorbed & self.excited))
+            self.excited |= absorbed
+        else:
+            absorbed = np.zeros(n, dtype=bool)
+        return absorbed, self.doesFluoresce()
+
+    def propagateDark(self, steps):
+        """
+        Vectorized PSII.propagateDark: the ensemble is stepped while any complex is excited, then the Chl and car
+        triplets of every complex relax by min(triplets, Binomial(remaining timesteps, decay probability)).
+
+        returns the number of photons fluoresced during the dark interval
+        """
+        fluoresced = 0
+        while steps > 0 and self.excited.any():
+            Abs, Fl = self.update("off")
+            fluoresced += np.count_nonzero(Fl)
+            steps -= 1
+        if steps > 0:
+            ChlRelaxed = np.minimum(self.ChlTriplet, self.rng.binomial(steps, self.ChlTripletDecay, size=self.numComplexes))
+            CarRelaxed = np.minimum(self.CarTriplet, self.rng.binomial(steps, self.CarTripletDecay, size=self.numComplexes))
+            self.ChlTriplet -= ChlRelaxed
+            self.CarTriplet -= CarRelaxed
+            if self.counters is not None:
+                self.counters.count('ChlTripletRelaxation', int(ChlRelaxed.sum()))
+                self.counters.count('CarTripletRelaxation', int(CarRelaxed.sum()))
+        return fluoresced
+
+class PSIIEventDriven(PSII):
+    """
+    Continuous-time (Gillespie) representation of a C2S2 supercomplex
+    """   
+
+    def __init__(self, state = "ground", Intensity = 75, timestep=2.5E-7, rng = None):
+        """
+
+        Initialize a PSIIEventDriven instance. Instead of the per-timestep probabilities the rates of the same chain
+        are used (see PSII.continuousRates): the absorption rate, which saturates at one absorption per timestep as in
+        PSII.update, 1/lifetime or 1/lifetimeTriplet for the excited state decay and the triplet relaxation rates.
+        As in PSII.update at most one triplet of each kind relaxes at a time.
+            rng: source of the waiting times and branchings, e.g. a randomsource.RandomSource (the random module if None)
+        """
+        PSII.__init__(self, state=state, Intensity=Intensity, timestep=timestep, rng=rng)
+
+    def advance(self, duration, light):
+        """
+        Advances the complex by duration seconds, jumping directly from one event to the next.
+        The waiting times are exponential, so stopping at duration and restarting later is exact.
+
+        Input:
+            duration: float, time in seconds
+            light: str "on" or "off" representing if the photon flux will be hitting the complex
+
+        yields for every event: the time since the start of the interval, the Chl and car triplet counts
+        before the event, True/False if a photon is absorbed and True/False if a photon is fluoresced
+        """
+        absorptionrate, chlrelaxation, carrelaxation = self.continuousRates(light)
+        time = 0.0
+        while True:
+            quenched = self.ChlTriplet>=1 or self.CarTriplet>=1
+            decayrate = 0.0
+            if self.state == "excited":
+                decayrate = 1/self.lifetimeTriplet if quenched else 1/self.lifetime
+            chlrate = chlrelaxation if self.ChlTriplet>=1 else 0.0
+            carrate = carrelaxation if self.CarTriplet>=1 else 0.0
+            totalrate = absorptionrate + decayrate + chlrate + carrate
+            if totalrate == 0:
+                return
+            time += self.rng.expovariate(totalrate)
+            if time > duration:
+                return
+            ChlTriplet, CarTriplet = self.ChlTriplet, self.CarTriplet
+            Absorbed = False
+            fluoresced = False
+            event = self.rng.random()*totalrate
+            if event < absorptionrate:
+                Absorbed = True
+                if self.counters is not None:
+                    self.counters.count('absorption')
+                    if self.state == "excited":
+                        self.counters.count('singletSingletAnnihilation')
+                self.state = "excited" #absorption by an excited complex changes nothing
+            elif event < absorptionrate + decayrate:
+                self.state = "ground"
+                if not quenched:
+                    if self.rng.random() <= self.FlYield:
+                        fluoresced = True
+                    elif self.rng.random() <= self.ChlTripletYield:
+                        self.ChlTriplet = 1
+                    elif self.rng.random() <= self.CarTripletYield:
+                        self.CarTriplet += 1
+                else:
+                    if self.rng.random() <= self.CarTripletYield/10.0:
+                        self.CarTriplet += 1
+                    if self.rng.random() <= self.FlYieldTriplet:
+                        fluoresced = True
+                if self.counters is not None:
+                    if not quenched:
+                        self.counters.count('singletDecay')
+                        self.counters.count('fluorescence', fluoresced)
+                        self.counters.count('ChlTripletFormation', self.ChlTriplet > ChlTriplet)
+                        self.counters.count('CarTripletFormation', self.CarTriplet > CarTriplet)
+                    else:
+                        self.counters.count('quenchedDecay')
+                        self.counters.count('quenchedFluorescence', fluoresced)
+                        self.counters.count('quenchedCarTripletFormation', self.CarTriplet > CarTriplet)
+            elif event < absorptionrate + decayrate + chlrate:
+                self.ChlTriplet -= 1
+                if self.counters is not None:
+                    self.counters.count('ChlTripletRelaxation')
+            else:
+                self.CarTriplet -= 1
+                if self.counters is not None:
+                    self.counters.count('CarTripletRelaxation')
+            yield time, ChlTriplet, CarTriplet, Absorbed, fluoresced
+
+class PSIIMultiscale(PSII):
+    """
+    Multiscale representation of a C2S2 supercomplex: the slow triplet populations are advanced on their own
+    clock in continuous time, the fast singlet dynamics are resolved within each absorption event
+    """   
+
+    def __init__(self, state = "ground", Intensity = 75, timestep=2.5E-7, rng = None):
+        """
+
+        Initialize a PSIIMultiscale instance. The rates are those of PSIIEventDriven, so the absorption saturates at one
+        per timestep as in PSII.update (see PSII.continuousRates). The singlet lifetimes (ns) are far
+        shorter than the time between absorptions and the triplet lifetimes (us to ms), so the triplet populations
+        only change by triplet formation after an excitation or by relaxation. Between two such slow events the
+        excitations form a renewal process of rate 1/(1/absorptionrate + singlet lifetime), which is taken as Poisson
+        (the absorptions during the singlet lifetime are the singlet-singlet annihilation), and every excitation ends
+        in fluorescence, nothing or a triplet formation with the yields of PSII.doesFluoresce. Only the slow events
+        are iterated; the photons and absorptions between them follow from their rates.
+        timestep sets the saturation of the absorption and converts results to the units of the stepped simulations.
+            rng: a randomsource.RandomSource (a new unseeded one if None)
+        """
+        if rng is None:
+            rng = RandomSource()
+        PSII.__init__(self, state=state, Intensity=Intensity, timestep=timestep, rng=rng)
+
+    def slowRates(self, light):
+        """
+        Rates in the current triplet state.
+
+        returns the rate of fluoresced photons and of absorptions that leave the triplets unchanged, and the list of
+        slow events as (rate, name, probability that the event fluoresces a photon, True if the event is an absorption)
+        """
+        absorptionrate, chlrelaxation, carrelaxation = self.continuousRates(light)
+        quenched = self.ChlTriplet>=1 or self.CarTriplet>=1
+        excitationrate = absorptionrate/(1 + absorptionrate*(self.lifetimeTriplet if quenched else self.lifetime))
+        events = []
+        if quenched:
+            carFormation = self.CarTripletYield/10.0 #the quenched fluorescence is independent of the car triplet formation
+            fluorescencerate = excitationrate*(1 - carFormation)*self.FlYieldTriplet
+            events.append((excitationrate*carFormation, 'CarTripletFormation', self.FlYieldTriplet, True))
+        else:
+            chlFormation = (1 - self.FlYield)*self.ChlTripletYield
+            carFormation = (1 - self.FlYield)*(1 - self.ChlTripletYield)*self.CarTripletYield
+            fluorescencerate = excitationrate*self.FlYield
+            events.append((excitationrate*chlFormation, 'ChlTripletFormation', 0.0, True))
+            events.append((excitationrate*carFormation, 'CarTripletFormation', 0.0, True))
+        if self.ChlTriplet>=1:
+            events.append((chlrelaxation, 'ChlTripletRelaxation', 0.0, False))
+        if self.CarTriplet>=1:
+            events.append((carrelaxation, 'CarTripletRelaxation', 0.0, False))
+        absorbed = absorptionrate - sum(rate for rate, name, photon, absorption in events if absorption)
+        return fluorescencerate, absorbed, events
+
+    def advance(self, duration, light):
+        """
+        Advances the complex by duration seconds, jumping from one slow event to the next.
+
+        Input:
+            duration: float, time in seconds
+            light: str "on" or "off" representing if the photon flux will be hitting the complex
+
+        yields for every interval of constant triplet populations: its start and end time, the Chl and car triplet
+        counts, the rates of fluoresced photons and of absorptions during the interval, and the slow event at its
+        end as (True if it is an absorption, probability that it fluoresces a photon), None at the end of duration
+        """
+        time = 0.0
+        while True:
+            fluorescencerate, absorbed, events = self.slowRates(light)
+            totalrate = sum(rate for rate, name, photon, absorption in events)
+            end = time + self.rng.expovariate(totalrate) if totalrate > 0 else duration
+            if end >= duration:
+                yield time, duration, self.ChlTriplet, self.CarTriplet, fluorescencerate, absorbed, None
+                return
+            ChlTriplet, CarTriplet = self.ChlTriplet, self.CarTriplet
+            event = self.rng.random()*totalrate
+            for rate, name, photon, absorption in events:
+                event -= rate
+                if event < 0:
+                    break
+            if name == 'ChlTripletFormation':
+                self.ChlTriplet = 1
+            elif name == 'CarTripletFormation':
+                self.CarTriplet += 1
+            elif name == 'ChlTripletRelaxation':
+                self.ChlTriplet -= 1
+            else:
+                self.CarTriplet -= 1
+            if self.counters is not None:
+                self.counters.count('quenchedCarTripletFormation' if name == 'CarTripletFormation' and (ChlTriplet or CarTriplet) else name)
+            yield time, end, ChlTriplet, CarTriplet, fluorescencerate, absorbed, (absorption, photon)
+            time = end
+
+def simulation(repetitions=1000000,Intensity=75,light='on',seed=None,counters=None):
+    complex=PSII(Intensity=Intensity,rng=None if seed is None else RandomSource(seed))
+    complex.counters=counters #optional counters.TransitionCounters, see transitionCounters()
     fluorescence=0
     SumChlTriplets=0
     SumCarTriplets=0
@@ -147,15 +592,196 @@ def simulation(repetitions=1000000,Intensity=75,light='on'):
     ChlTripletPro=SumChlTriplets/float(repetitions)
     CarTripletPro=SumCarTriplets/float(repetitions)
     return fluorescence,ChlTripletPro
-            
-def saturation(intensities): #Models the saturation curve for different excitation power
+
+def simulationAdaptive(relativePrecision=0.01,timeBudget=None,Intensity=75,light='on',seed=None,blockSteps=20000,maxRepetitions=None,confidence=0.95,precisionObservables=None,counters=None):
+    """
+    Adaptive counterpart of simulation(): one complex is run in blocks of blockSteps timesteps until the
+    confidence intervals of the fluorescence rate and of the Chl triplet population are narrower than
+    relativePrecision (half width relative to the mean), or timeBudget seconds or maxRepetitions timesteps are used up.
+    The standard errors are estimated on line by batch means (see batchmeans.runAdaptive); a block of
+    20000 timesteps already spans 2.5 Chl triplet lifetimes and the batches grow with the run.
+
+    Input:
+        precisionObservables: list of 'fluorescence', 'ChlTriplets' and/or 'CarTriplets' that have to reach
+            relativePrecision (fluorescence and ChlTriplets if None)
+
+    returns the fluorescence in counts per second (normalised as in simulation()), the average Chl triplet population
+    and a dict with the estimates of the three observables (mean, standardError, interval, ...), repetitions, elapsed and converged
+    """
+    from batchmeans import runAdaptive
+    complex=PSII(Intensity=Intensity,rng=None if seed is None else RandomSource(seed))
+    complex.counters=counters
+    DetectionEfficiency=1
+    if precisionObservables is None:
+        precisionObservables=['fluorescence','ChlTriplets']
+    def block():
+        fluorescence=0
+        SumChlTriplets=0
+        SumCarTriplets=0
+        for num in xrange(blockSteps):
+            SumChlTriplets+=complex.ChlTriplet
+            SumCarTriplets+=complex.CarTriplet
+            Abs,Fl= complex.update(light)
+            if Fl==True:
+                fluorescence+=1
+        return {'fluorescence':fluorescence/float(blockSteps*13.14E-9)*DetectionEfficiency,
+                'ChlTriplets':SumChlTriplets/float(blockSteps),'CarTriplets':SumCarTriplets/float(blockSteps)}
+    estimate=runAdaptive(block,['fluorescence','ChlTriplets','CarTriplets'],relativePrecision,timeBudget,None if maxRepetitions is None else max(1,maxRepetitions//blockSteps),
+                         confidence,precisionObservables=precisionObservables)
+    estimate['repetitions']=estimate['blocks']*blockSteps
+    return estimate['fluorescence']['mean'],estimate['ChlTriplets']['mean'],estimate
+
+def transitionMatrices(complex,maxTriplets=50):
+    """
+    Builds the per-timestep transition matrices of PSII.update from the probabilities of complex, split
+    into its four stages: Chl and car triplet relaxation, absorption of a photon (with certainty) and decay of
+    the excited state. States are numbered (excited*2+ChlTriplet)*(maxTriplets+1)+CarTriplet, the car triplet
+    count is truncated at maxTriplets.
+
+    returns the relaxation, excitation and decay matrices and the probability to fluoresce in the decay stage per state
+    """
+    numTriplets=maxTriplets+1
+    n=4*numTriplets
+    index=lambda excited,ChlTriplet,CarTriplet: (excited*2+ChlTriplet)*numTriplets+CarTriplet
+    chlRelaxation=np.eye(n)
+    carRelaxation=np.eye(n)
+    excitation=np.zeros((n,n))
+    decay=np.eye(n)
+    fluoresces=np.zeros(n)
+    for excited in range(2):
+        for ChlTriplet in range(2):
+            for CarTriplet in range(numTriplets):
+                i=index(excited,ChlTriplet,CarTriplet)
+                if ChlTriplet==1:
+                    chlRelaxation[i,i]=1-complex.ChlTripletDecay
+                    chlRelaxation[i,index(excited,0,CarTriplet)]=complex.ChlTripletDecay
+                if CarTriplet>=1:
+                    carRelaxation[i,i]=1-complex.CarTripletDecay
+                    carRelaxation[i,index(excited,ChlTriplet,CarTriplet-1)]=complex.CarTripletDecay
+                excitation[i,index(1,ChlTriplet,CarTriplet)]=1
+                if excited==0:
+                    continue
+                ground=index(0,ChlTriplet,CarTriplet)
+                if ChlTriplet==0 and CarTriplet==0:
+                    p=complex.probabilityDecay
+                    noFl=1-complex.FlYield
+                    decay[i,i]=1-p
+                    decay[i,index(0,1,0)]+=p*noFl*complex.ChlTripletYield
+                    decay[i,index(0,0,1)]+=p*noFl*(1-complex.ChlTripletYield)*complex.CarTripletYield
+                    decay[i,ground]+=p*(1-noFl*(complex.ChlTripletYield+(1-complex.ChlTripletYield)*complex.CarTripletYield))
+                    fluoresces[i]=p*complex.FlYield
+                else:
+                    p=complex.probabilityDecayTriplet
+                    decay[i,i]=1-p
+                    decay[i,index(0,ChlTriplet,min(CarTriplet+1,maxTriplets))]+=p*complex.CarTripletYield/10.0
+                    decay[i,ground]+=p*(1-complex.CarTripletYield/10.0)
+                    fluoresces[i]=p*complex.FlYieldTriplet
+    return chlRelaxation.dot(carRelaxation),excitation,decay,fluoresces
+
+def stationaryState(complex,light='on',maxTriplets=50):
+    """
+    Solves the master equation of the stepped model for its stationary state instead of sampling it.
+
+    returns the stationary state distribution (see transitionMatrices), the probability to fluoresce per timestep
+    and the average Chl and car triplet populations
+    """
+    relaxation,excitation,decay,fluoresces=transitionMatrices(complex,maxTriplets)
+    absorptionProbability=min(complex.absorptionProbability,1.0) if light=='on' else 0.0
+    transition=(1-absorptionProbability)*relaxation.dot(decay)+absorptionProbability*relaxation.dot(excitation).dot(decay)
+    fluorescence=(1-absorptionProbability)*relaxation.dot(fluoresces)+absorptionProbability*relaxation.dot(excitation).dot(fluoresces)
+    n=len(fluoresces)
+    equations=transition.T-np.eye(n)
+    equations[-1,:]=1
+    rhs=np.zeros(n)
+    rhs[-1]=1
+    distribution=np.linalg.solve(equations,rhs)
+    ChlTriplets=np.repeat(np.tile([0,1],2),maxTriplets+1)
+    CarTriplets=np.tile(np.arange(maxTriplets+1),4)
+    return distribution,distribution.dot(fluorescence),distribution.dot(ChlTriplets),distribution.dot(CarTriplets)
+
+def segmentPropagator(complex,steps,maxTriplets=50):
+    """
+    Transition matrix of steps timesteps of update('on') at the current intensity of complex: the steps-th power of the
+    per-timestep matrix of the master equation (see stationaryState), computed by repeated squaring. It is exact as long
+    as the car triplet count stays below maxTriplets.
+
+    returns array with the probabilities of the states (see transitionMatrices) after the steps for every initial state
+    """
+    relaxation,excitation,decay,fluoresces=transitionMatrices(complex,maxTriplets)
+    absorptionProbability=min(complex.absorptionProbability,1.0)
+    transition=(1-absorptionProbability)*relaxation.dot(decay)+absorptionProbability*relaxation.dot(excitation).dot(decay)
+    return np.linalg.matrix_power(transition,steps)
+
+def saturationMasterEquation(intensities,maxTriplets=50,parameters=None):
+    """
+    Deterministic counterpart of the simulation() calls in saturation(): the stationary fluorescence
+    and triplet populations for every intensity, from the same per-timestep probabilities.
+    The fluorescence is normalised exactly like in simulation() so that both can be compared.
+    parameters overrides model parameters (see PSII.setParameters).
+
+    returns arrays with the fluorescence, the average Chl triplet population and the average car triplet population
+    """
     Fl=[]
-    Tr=[]
+    ChlTr=[]
+    CarTr=[]
     for e in intensities:
-        print e
-        Fluo,Trip=simulation(Intensity=e)
+        complex=PSII(Intensity=e)
+        if parameters is not None:
+            complex.setParameters(parameters)
+        distribution,Fluo,ChlTrip,CarTrip=stationaryState(complex,maxTriplets=maxTriplets)
+        DetectionEfficiency=1
+        Fl.append(Fluo/13.14E-9*DetectionEfficiency)
+        ChlTr.append(ChlTrip)
+        CarTr.append(CarTrip)
+    return np.asarray(Fl),np.asarray(ChlTr),np.asarray(CarTr)
+
+def saturationCurve(intensities,masterEquation=False,processes=None,seed=0,repetitions=1000000,cache=None):
+    """
+    Computes the saturation curve without plotting, the arguments are those of saturation().
+
+    returns lists with the fluorescence rate and the average triplet population for every intensity
+    """
+    from sweep import runSweep, meanResults
+    from resultcache import modelParameters
+    Fl=[]
+    Tr=[]
+    if masterEquation:
+        Fl,Tr,CarTr=saturationMasterEquation(intensities)
+    elif processes is not None or cache is not None: #intensities x batches of 10^5 repetitions spread over a process pool, cached intensities are not rerun (see sweep.cachedSweep)
+        results=runSweep(simulation,[{'Intensity':e} for e in intensities],repetitions,batchSize=100000,trialsArgument='repetitions',merge=meanResults,processes=1 if processes is None else processes,seed=seed,seedArgument='seed',
+                         cache=cache,models=[modelParameters(PSII(Intensity=e)) for e in intensities])
+        Fl=[Fluo for Fluo,Trip in results]
+        Tr=[Trip for Fluo,Trip in results]
+    else:
+        for e in intensities:
+            print e
+            Fluo,Trip=simulation(repetitions,Intensity=e)
+            Fl.append(Fluo)
+            Tr.append(Trip)
+    return Fl,Tr
+
+def saturationCurveAdaptive(intensities,relativePrecision=0.01,timeBudget=None,seed=0,blockSteps=20000,maxRepetitions=None,confidence=0.95):
+    """
+    Saturation curve with simulationAdaptive(): every intensity runs until its fluorescence rate and Chl triplet
+    population are known to relativePrecision, or for at most timeBudget seconds.
+
+    returns lists with the fluorescence rate and the average Chl triplet population for every intensity
+    and a list with the estimate dict of simulationAdaptive() for every intensity
+    """
+    from sweep import streamSeed
+    Fl=[]
+    Tr=[]
+    estimates=[]
+    for i,e in enumerate(intensities):
+        Fluo,Trip,estimate=simulationAdaptive(relativePrecision,timeBudget,Intensity=e,seed=None if seed is None else streamSeed(seed,i,0),
+                                              blockSteps=blockSteps,maxRepetitions=maxRepetitions,confidence=confidence)
         Fl.append(Fluo)
         Tr.append(Trip)
+        estimates.append(estimate)
+    return Fl,Tr,estimates
+
+def plotSaturation(intensities,Fl,Tr):
+    import matplotlib.pyplot as plt
     plt.plot(intensities,Fl)
     plt.xlabel('Excitation intensity [W/cm^2]')
     plt.ylabel('Fluorescence Intensity [cps]')
@@ -166,98 +792,637 @@ def saturation(intensities): #Models the saturation curve for different excitati
     plt.ylabel('Average population of Car triplet states')
     plt.title('Amplitude ratio of S--T annihilation')
     plt.show()
+
+def saturation(intensities,masterEquation=False,processes=None,seed=0,repetitions=1000000,cache=None): #Models the saturation curve for different excitation power
+    Fl,Tr=saturationCurve(intensities,masterEquation,processes,seed,repetitions,cache)
+    plotSaturation(intensities,Fl,Tr)
     return Fl
     
 #saturation([10,50,150,300,1000,2000])
 
-def simulationAOM(numtrials=1,AOMtimes=[2.5E-3,10E-3],Intensity=75,ChlTripletYield=0.1,CarTripletYield=0.001,binning=2E-5):
-    complex2=PSII(Intensity=Intensity)
+def warmUp(complex,pulses,AOMtimes):
+    """
+    Runs pulses unrecorded AOM pulses on a complex, which carries its triplets into the recorded pulses.
+    """
+    steps=int(AOMtimes[0]/complex.timestep)
+    offsteps=int(round(AOMtimes[1]/complex.timestep))
+    for e in range(pulses):
+        for num in range(steps):
+            complex.update('on')
+        complex.propagateDark(offsteps)
+
+def simulationAOM(numtrials=1,AOMtimes=[2.5E-3,10E-3],Intensity=75,ChlTripletYield=0.1,CarTripletYield=0.001,binning=2E-5,seed=None,recorder=None,photonFile=None,checkpointFile=None,checkpointInterval=600.0,counters=None,weighted=False,warmupPulses=0):
+    """
+    Simulates numtrials AOM pulses on one C2S2 supercomplex. The observables are recorded per timestep in a
+    histograms.StepRecorder and binned in bulk at the end; pass a recorder to rebin them afterwards with any bin width.
+    With photonFile every photon is also appended to a time-tagged photon stream (see photonstream.PhotonStream).
+    With checkpointFile the complete state (complex, histograms, random numbers, trial counter) is saved at most every
+    checkpointInterval seconds; calling it again with the same arguments (or resumeSimulationAOM) continues from there.
+    With counters (see transitionCounters) the transitions are tallied; its bins-1 first bins divide the pulse
+    into equal time bins, the last bin collects the dark intervals.
+    With weighted the triplet-quenched emission is recorded as a statistical weight (see PSIIWeighted) instead of
+    being drawn, which gives unbiased fluorescence and annihilation histograms with a far smaller variance of the
+    annihilation counts.
+    warmupPulses unrecorded pulses are run first, so that a batch of a sweep starts from the periodic steady state
+    (see steadyStatePulses) instead of the ground state.
+
+    returns arrays with the per-bin fluorescence, Chl triplet, car triplet, absorption and annihilation counts
+    (the fluorescence and annihilation counts are float if weighted)
+    """
+    if weighted and photonFile is not None:
+        raise ValueError('a photon stream records single photons, it cannot be combined with weighted')
+    if checkpointFile is not None:
+        from checkpoint import Checkpointer
+        arguments={'numtrials':numtrials,'AOMtimes':list(AOMtimes),'Intensity':Intensity,'ChlTripletYield':ChlTripletYield,
+                   'CarTripletYield':CarTripletYield,'binning':binning,'seed':seed,'photonFile':photonFile}
+        if weighted:
+            arguments['weighted']=True
+        if warmupPulses:
+            arguments['warmupPulses']=warmupPulses
+        checkpointer=Checkpointer(checkpointFile,checkpointInterval,arguments)
+        state=checkpointer.load()
+        if state is not None and state['finished']:
+            return state['result']
+    complex2=(PSIIWeighted if weighted else PSII)(Intensity=Intensity,rng=None if seed is None and checkpointFile is None else RandomSource(seed))
+    complex2.ChlTripletYield=ChlTripletYield
+    complex2.CarTripletYield=CarTripletYield
+    complex2.FlYield=0.15
+    complex2.FlYieldTriplet=0.015
+    timestep=float(complex2.timestep)
+    steps=int(AOMtimes[0]/timestep)
+    offsteps=int(round(AOMtimes[1]/timestep))
+    if recorder is None and weighted:
+        recorder=StepRecorder(steps,timestep,valueChannels=['ChlTriplet','CarTriplet'],eventChannels=['Absorbed'],weightedChannels=['fluorescence','Annihilation'])
+    elif recorder is None:
+        recorder=StepRecorder(steps,timestep,valueChannels=['ChlTriplet','CarTriplet'],eventChannels=['fluorescence','Absorbed','Annihilation'])
+    if photonFile is not None:
+        from photonstream import PhotonWriter, tripletFlags
+        photonStream=PhotonWriter(photonFile,{'model':'PSII','Intensity':Intensity,'duration':AOMtimes[0],'offtime':AOMtimes[1],'timestep':timestep,
+                                              'ChlTripletYield':ChlTripletYield,'CarTripletYield':CarTripletYield},
+                                 append=checkpointFile is not None and state is not None)
+    first=0
+    if checkpointFile is not None and state is not None:
+        complex2=state['complex']
+        recorder.__dict__.update(state['recorder'].__dict__)
+        first=state['trial']
+        if photonFile is not None:
+            photonStream.truncate(state['photonFileSize'])
+    else:
+        warmUp(complex2,warmupPulses,AOMtimes)
+    if counters is not None:
+        if getattr(complex2,'counters',None) is not None: #resumed from a checkpoint
+            counters.__dict__.update(complex2.counters.__dict__)
+        complex2.counters=counters
+        counterBins=np.minimum(np.arange(steps)*(counters.bins-1)//steps,max(counters.bins-2,0)).tolist()
+    SumChlTriplets=recorder.values['ChlTriplet']
+    SumCarTriplets=recorder.values['CarTriplet']
+    fluorescence=recorder.events['fluorescence']
+    Absorbed=recorder.events['Absorbed']
+    Annihilation=recorder.events['Annihilation']
+    if weighted:
+        fluorescenceWeights=recorder.weights['fluorescence']
+        AnnihilationWeights=recorder.weights['Annihilation']
+    if checkpointFile is not None and state is None: #a crash before the first periodic checkpoint resumes from the start, without the photons written since
+        checkpointer.save({'complex':complex2,'recorder':recorder,'trial':0,'photonFileSize':photonStream.tell() if photonFile is not None else None})
+    for e in range(first,numtrials):
+        for num in range(steps):            
+            if counters is not None:
+                counters.bin=counterBins[num]
+            Abs,Fl= complex2.update('on')
+            SumChlTriplets[num]=complex2.ChlTriplet
+            SumCarTriplets[num]=complex2.CarTriplet
+            if Fl: #True, or the weight of a quenched decay if weighted
+                fluorescence.append(num)
+                if weighted:
+                    fluorescenceWeights.append(Fl)
+                if (complex2.ChlTriplet+complex2.CarTriplet)>=1:
+                    Annihilation.append(num)
+                    if weighted:
+                        AnnihilationWeights.append(Fl)
+            if Abs==True:
+                Absorbed.append(num)
+        if photonFile is not None:
+            photons=np.asarray(fluorescence,dtype=int)
+            photonStream.append(e,photons*timestep,tripletFlags(np.take(SumChlTriplets,photons),np.take(SumCarTriplets,photons)))
+        recorder.endPulse()
+                
+        if counters is not None:
+            counters.bin=counters.bins-1
+        complex2.propagateDark(offsteps) #exact and at the cost of a few timesteps, see PSII.propagateDark
+        if checkpointFile is not None and checkpointer.due():
+            checkpointer.save({'complex':complex2,'recorder':recorder,'trial':e+1,'photonFileSize':photonStream.tell() if photonFile is not None else None})
+    if photonFile is not None:
+        photonStream.close()
+    result=tuple(recorder.histogram(channel,binning,AOMtimes[0]) for channel in ['fluorescence','ChlTriplet','CarTriplet','Absorbed','Annihilation'])
+    if checkpointFile is not None:
+        checkpointer.finish(result)
+    return result
+
+def transitionCounters(bins=1):
+    """
+    returns counters.TransitionCounters for the PSII transitions (TRANSITIONS) with bins time bins
+    """
+    from counters import TransitionCounters
+    return TransitionCounters('PSII',TRANSITIONS,bins)
+
+def resumeSimulationAOM(checkpointFile):
+    """
+    Continues an interrupted simulationAOM() run from its checkpoint, with the arguments stored in the checkpoint.
+    """
+    from checkpoint import loadCheckpoint
+    return simulationAOM(checkpointFile=checkpointFile,**loadCheckpoint(checkpointFile)['arguments'])
+
+def simulationProtocol(protocol,numtrials=1,ChlTripletYield=0.1,CarTripletYield=0.001,binning=2E-5,seed=None,counters=None,weighted=False):
+    """
+    Simulates numtrials repetitions of an illumination protocol on one C2S2 supercomplex, e.g. pulse trains, ramps or
+    multi-level steps (see illumination.Protocol), with the yields of simulationAOM. Recorded segments are stepped at
+    their intensity; segments that are not recorded are propagated in one draw, the dark ones with the triplet
+    relaxation (see PSII.propagateDark) and the lit ones with the transition matrix of the whole segment (see
+    segmentPropagator), so a long dark interval such as the 10 ms offtime or a pre-illumination cost O(1).
+    With counters (see transitionCounters) the transitions of all segments are tallied, so the unrecorded lit segments
+    are stepped as well; with weighted the triplet-quenched emission is recorded as a statistical weight (see simulationAOM).
+
+    Input:
+        protocol: illumination.Protocol or its list of (duration, intensity, record) segments
+
+    returns arrays with the per-bin fluorescence, Chl triplet, car triplet, absorption and annihilation counts
+    over the recorded timeline (the recorded segments one after the other)
+    """
+    from illumination import Protocol
+    if not isinstance(protocol,Protocol):
+        protocol=Protocol(protocol)
+    complex2=(PSIIWeighted if weighted else PSII)(rng=None if seed is None else RandomSource(seed))
     complex2.ChlTripletYield=ChlTripletYield
     complex2.CarTripletYield=CarTripletYield
     complex2.FlYield=0.15
     complex2.FlYieldTriplet=0.015
+    complex2.counters=counters
     timestep=float(complex2.timestep)
-    SumChlTriplets=[]
-    SumCarTriplets=[]
-    fluorescence=[]
-    Absorbed=[]
-    Annihilation=[]
-    binning=binning
+    timeline,steps=protocol.timeline(timestep)
+    if steps==0:
+        raise ValueError('the protocol does not record any timestep')
+    if weighted:
+        recorder=StepRecorder(steps,timestep,valueChannels=['ChlTriplet','CarTriplet'],eventChannels=['Absorbed'],weightedChannels=['fluorescence','Annihilation'])
+        fluorescenceWeights=recorder.weights['fluorescence']
+        AnnihilationWeights=recorder.weights['Annihilation']
+    else:
+        recorder=StepRecorder(steps,timestep,valueChannels=['ChlTriplet','CarTriplet'],eventChannels=['fluorescence','Absorbed','Annihilation'])
+    SumChlTriplets=recorder.values['ChlTriplet']
+    SumCarTriplets=recorder.values['CarTriplet']
+    fluorescence=recorder.events['fluorescence']
+    Absorbed=recorder.events['Absorbed']
+    Annihilation=recorder.events['Annihilation']
+    propagators={} #per unrecorded lit segment, computed in the first trial
+    for e in range(numtrials):
+        for j,(segmentSteps,Intensity,offset) in enumerate(timeline):
+            if offset is None and Intensity==0:
+                complex2.propagateDark(segmentSteps)
+                continue
+            complex2.Intensity=Intensity
+            complex2.updatePhotonFlux(Intensity)
+            light='on' if Intensity>0 else 'off'
+            if offset is None and counters is None:
+                if j not in propagators:
+                    propagators[j]=segmentPropagator(complex2,segmentSteps)
+                complex2.propagateLight(propagators[j])
+                continue
+            if offset is None:
+                for num in range(segmentSteps):
+                    complex2.update(light)
+                continue
+            for num in range(offset,offset+segmentSteps):
+                Abs,Fl= complex2.update(light)
+                SumChlTriplets[num]=complex2.ChlTriplet
+                SumCarTriplets[num]=complex2.CarTriplet
+                if Fl:
+                    fluorescence.append(num)
+                    if weighted:
+                        fluorescenceWeights.append(Fl)
+                    if (complex2.ChlTriplet+complex2.CarTriplet)>=1:
+                        Annihilation.append(num)
+                        if weighted:
+                            AnnihilationWeights.append(Fl)
+                if Abs==True:
+                    Absorbed.append(num)
+        recorder.endPulse()
+    return tuple(recorder.histogram(channel,binning) for channel in ['fluorescence','ChlTriplet','CarTriplet','Absorbed','Annihilation'])
+
+def steadyStatePulses(AOMtimes,lifetimes=5):
+    """
+    Number of AOM pulses after which a complex that started in the ground state has reached the periodic steady
+    state of the pulse train: lifetimes Chl triplet lifetimes, the slowest relaxation, divided by the pulse period.
+
+    returns int
+    """
+    return int(np.ceil(lifetimes*PSII().ChlTripletLifetime/float(AOMtimes[0]+AOMtimes[1])))
+
+def simulationAOMEnsemble(numtrials=1000,AOMtimes=[2.5E-3,10E-3],Intensity=75,ChlTripletYield=0.1,CarTripletYield=0.001,binning=2E-5,numComplexes=1000,warmupPulses=None,seed=None,photonFile=None,counters=None,
+                          disorder=None,breakdown=None,parameters=None):
+    """
+    Batched counterpart of simulationAOM(): numComplexes supercomplexes go through the AOM on/off protocol
+    side by side, each running numtrials/numComplexes pulses (rounded up), so the trials are simulated in
+    parallel instead of one after another. The last pulse only records the complexes needed for numtrials trials.
+    warmupPulses unrecorded pulses are run first on every complex to reach the periodic steady state that a long
+    serial run approaches (steadyStatePulses(AOMtimes) if None, 0 starts every complex from the ground state).
+    With photonFile every photon is also appended to a time-tagged photon stream (see photonstream.PhotonStream),
+    the trial index of a photon is pulse*numComplexes+complex.
+    With counters the transitions of the recorded pulses are tallied, in time bins as in simulationAOM().
+    With disorder every complex draws its parameters from the given distributions (see disorder.py), e.g.
+    {'ChlTripletYield':('uniform',0.01,0.03)}, which replace the yields given as arguments. With breakdown, a pair of
+    a parameter name and bin edges, the histograms are also recorded per parameter bin.
+    parameters overrides further model parameters of all complexes (see PSII.setParameters).
+
+    returns arrays with the per-bin fluorescence, Chl triplet, car triplet, absorption and annihilation counts, with
+    breakdown also a dict with the edges, the number of complexes and an array of shape (parameter bins, time bins)
+    for every histogram
+    """
+    numComplexes=min(numComplexes,numtrials)
+    pulses=int(np.ceil(numtrials/float(numComplexes)))
+    lastComplexes=numtrials-(pulses-1)*numComplexes #complexes recorded in the last pulse
+    if counters is not None and lastComplexes<numComplexes:
+        raise ValueError('the transitions are counted for all complexes, numtrials has to be a multiple of numComplexes')
+    if warmupPulses is None:
+        warmupPulses=steadyStatePulses(AOMtimes)
+    ensemble=PSIIEnsemble(numComplexes=numComplexes,Intensity=Intensity,rng=RandomSource(seed))
+    ensemble.ChlTripletYield=ChlTripletYield
+    ensemble.CarTripletYield=CarTripletYield
+    ensemble.FlYield=0.15
+    ensemble.FlYieldTriplet=0.015
+    if parameters is not None:
+        ensemble.setParameters(parameters)
+    if disorder is not None:
+        from disorder import applyDisorder
+        applyDisorder(ensemble,disorder)
+    timestep=float(ensemble.timestep)
+    steps=int(AOMtimes[0]/timestep)
+    channels=['fluorescence','ChlTriplet','CarTriplet','Absorbed','Annihilation']
+    recorder=StepRecorder(steps,timestep,valueChannels=channels)
+    if breakdown is not None: #per parameter bin and timestep, the last row collects the complexes outside the edges
+        from disorder import parameterBins, binSums
+        index,bins=parameterBins(getattr(ensemble,breakdown[0])*np.ones(numComplexes),breakdown[1])
+        perBin=dict((channel,np.zeros((bins+1,steps))) for channel in channels)
+    SumChlTriplets=recorder.values['ChlTriplet']
+    SumCarTriplets=recorder.values['CarTriplet']
+    fluorescence=recorder.values['fluorescence']
+    Absorbed=recorder.values['Absorbed']
+    Annihilation=recorder.values['Annihilation']
+    if photonFile is not None:
+        from photonstream import PhotonWriter, tripletFlags
+        photonStream=PhotonWriter(photonFile,{'model':'PSII','Intensity':Intensity,'duration':AOMtimes[0],'offtime':AOMtimes[1],'timestep':timestep,
+                                              'ChlTripletYield':ChlTripletYield,'CarTripletYield':CarTripletYield,'numComplexes':numComplexes})
+    if counters is not None:
+        counterBins=np.minimum(np.arange(steps)*(counters.bins-1)//steps,max(counters.bins-2,0)).tolist()
+    for e in range(warmupPulses+pulses):
+        record=e>=warmupPulses
+        if record:
+            ensemble.counters=counters
+        n=lastComplexes if e==warmupPulses+pulses-1 else numComplexes #the recorded complexes are the first n
+        for num in range(steps):
+            if ensemble.counters is not None:
+                counters.bin=counterBins[num]
+            Abs,Fl= ensemble.update('on')
+            if record:
+                Abs,Fl,ChlTriplet,CarTriplet=Abs[:n],Fl[:n],ensemble.ChlTriplet[:n],ensemble.CarTriplet[:n]
+                annihilated=Fl & ((ChlTriplet+CarTriplet)>=1)
+                SumChlTriplets[num]=ChlTriplet.sum()
+                SumCarTriplets[num]=CarTriplet.sum()
+                fluorescence[num]=np.count_nonzero(Fl)
+                Annihilation[num]=np.count_nonzero(annihilated)
+                Absorbed[num]=np.count_nonzero(Abs)
+                if breakdown is not None:
+                    perBin['fluorescence'][:,num]+=np.bincount(index[:n][Fl],minlength=bins+1)
+                    perBin['ChlTriplet'][:,num]+=np.bincount(index[:n],weights=ChlTriplet,minlength=bins+1)
+                    perBin['CarTriplet'][:,num]+=np.bincount(index[:n],weights=CarTriplet,minlength=bins+1)
+                    perBin['Absorbed'][:,num]+=np.bincount(index[:n][Abs],minlength=bins+1)
+                    perBin['Annihilation'][:,num]+=np.bincount(index[:n][annihilated],minlength=bins+1)
+                if photonFile is not None and fluorescence[num]:
+                    photons=np.flatnonzero(Fl)
+                    photonStream.append((e-warmupPulses)*numComplexes+photons,num*timestep,tripletFlags(ChlTriplet[photons],CarTriplet[photons]))
+        if record:
+            recorder.endPulse()
+
+        if ensemble.counters is not None:
+            counters.bin=counters.bins-1
+        ensemble.propagateDark(int(round(AOMtimes[1]/timestep)))
+    if photonFile is not None:
+        photonStream.close()
+    histograms=tuple(recorder.histogram(channel,binning,AOMtimes[0]) for channel in channels)
+    if breakdown is not None:
+        timeBins,numBins=recorder.binIndices(binning,AOMtimes[0])
+        result={'edges':np.asarray(breakdown[1],dtype=float),'complexes':binSums(np.ones(numComplexes),index,bins).astype(np.int64)}
+        for channel in channels:
+            result[channel]=np.array([np.bincount(timeBins,weights=row,minlength=numBins) for row in perBin[channel][:bins]])
+        return histograms+(result,)
+    return histograms
+
+def simulationAOMEventDriven(numtrials=1,AOMtimes=[2.5E-3,10E-3],Intensity=75,ChlTripletYield=0.1,CarTripletYield=0.001,binning=2E-5,emissionTimes=False,seed=None):
+    """
+    Event-driven counterpart of simulationAOM(). Only absorption, decay and triplet relaxation events are
+    iterated and the dark interval is propagated with the exact triplet relaxation events in continuous
+    time. The triplet histograms are time integrals divided by the PSII timestep, so they are
+    in the same units as the per-timestep sums of simulationAOM().
+
+    returns arrays with the per-bin fluorescence, Chl triplet, car triplet, absorption and annihilation counts and,
+    if emissionTimes, an array with the trial index and the exact time in the pulse of every fluoresced photon
+    """
+    complex2=PSIIEventDriven(Intensity=Intensity,rng=RandomSource(seed))
+    complex2.ChlTripletYield=ChlTripletYield
+    complex2.CarTripletYield=CarTripletYield
+    complex2.FlYield=0.15
+    complex2.FlYieldTriplet=0.015
     num_bins=int(AOMtimes[0]/binning)
-    for i in range(num_bins):
-        fluorescence.append(0)
-        SumChlTriplets.append(0)
-        SumCarTriplets.append(0)
-        Absorbed.append(0)
-        Annihilation.append(0)
+    SumChlTriplets=np.zeros(num_bins)
+    SumCarTriplets=np.zeros(num_bins)
+    fluorescence=np.zeros(num_bins,dtype=np.int64)
+    Absorbed=np.zeros(num_bins,dtype=np.int64)
+    Annihilation=np.zeros(num_bins,dtype=np.int64)
+    edges=np.arange(num_bins+1)*(AOMtimes[0]/float(num_bins))
+    times=[]
     for e in range(numtrials):
-        for num in range(int(AOMtimes[0]/timestep)):            
-            Abs,Fl= complex2.update('on')
-            SumChlTriplets[int(num*timestep/AOMtimes[0]*num_bins)]+=complex2.ChlTriplet
-            SumCarTriplets[int(num*timestep/AOMtimes[0]*num_bins)]+=complex2.CarTriplet
+        previous=0.0
+        for time,ChlTriplet,CarTriplet,Abs,Fl in complex2.advance(AOMtimes[0],'on'):
+            b=min(int(time/AOMtimes[0]*num_bins),num_bins-1)
+            if ChlTriplet or CarTriplet:
+                if edges[b]<=previous:
+                    SumChlTriplets[b]+=ChlTriplet*(time-previous)
+                    SumCarTriplets[b]+=CarTriplet*(time-previous)
+                else:
+                    overlap=np.clip(np.minimum(edges[1:],time)-np.maximum(edges[:-1],previous),0,None)
+                    SumChlTriplets+=ChlTriplet*overlap
+                    SumCarTriplets+=CarTriplet*overlap
+            previous=time
             if Fl==True:
-                fluorescence[int(num*timestep/AOMtimes[0]*num_bins)]+=1
+                fluorescence[b]+=1
                 if (complex2.ChlTriplet+complex2.CarTriplet)>=1:
-                    Annihilation[int(num*timestep/AOMtimes[0]*num_bins)]+=1
+                    Annihilation[b]+=1
+                if emissionTimes:
+                    times.append((e,time))
             if Abs==True:
-                Absorbed[int(num*timestep/AOMtimes[0]*num_bins)]+=1
-                
-        complex2.CarTripletDecay=1-np.exp(-(float(AOMtimes[1])/3.0)/9.0E-6)
-        complex2.ChlTripletDecay=1-np.exp(-(float(AOMtimes[1])/3.0)/2.0E-3)
-        for num in range(3):
-            Abs,Fl= complex2.update('off')
-            #if Fl==True:
-            #    fluorescence[int(num/binning)]+=1
-        complex2.CarTripletDecay=1-np.exp(-timestep/9.0E-6)
-        complex2.ChlTripletDecay=1-np.exp(-timestep/2.0E-3)
-    return fluorescence, SumChlTriplets,SumCarTriplets,Absorbed,Annihilation
-
-def AOM(numtrials=500,AOMtimes=[0.8E-3,0.1E-3],Intensities=[500]):
+                Absorbed[b]+=1
+        overlap=np.clip(edges[1:]-np.maximum(edges[:-1],previous),0,None)
+        SumChlTriplets+=complex2.ChlTriplet*overlap
+        SumCarTriplets+=complex2.CarTriplet*overlap
+        for event in complex2.advance(AOMtimes[1],'off'):
+            pass
+    SumChlTriplets/=complex2.timestep
+    SumCarTriplets/=complex2.timestep
+    if emissionTimes:
+        return fluorescence,SumChlTriplets,SumCarTriplets,Absorbed,Annihilation,np.asarray(times).reshape(-1,2)
+    return fluorescence,SumChlTriplets,SumCarTriplets,Absorbed,Annihilation
+
+def simulationAOMMultiscale(numtrials=1,AOMtimes=[2.5E-3,10E-3],Intensity=75,ChlTripletYield=0.1,CarTripletYield=0.001,binning=2E-5,seed=None,weighted=False,counters=None,parameters=None,warmupPulses=0):
+    """
+    Multiscale counterpart of simulationAOM() (see PSIIMultiscale): only the triplet formations and relaxations are
+    iterated, so a pulse costs a few dozen slow events instead of one update per timestep, and the dark interval
+    is propagated with the exact triplet relaxations. The photons and absorptions between two slow events are drawn
+    from their Poisson distribution, or with weighted recorded as their expected number (float histograms with less
+    variance). The triplet histograms are time integrals divided by the PSII timestep as in simulationAOMEventDriven().
+    With counters the slow transitions are tallied. parameters overrides further model parameters (see PSII.setParameters).
+    warmupPulses unrecorded pulses are run first (see simulationAOM).
+
+    returns arrays with the per-bin fluorescence, Chl triplet, car triplet, absorption and annihilation counts
+    """
+    complex2=PSIIMultiscale(Intensity=Intensity,rng=RandomSource(seed))
+    complex2.ChlTripletYield=ChlTripletYield
+    complex2.CarTripletYield=CarTripletYield
+    complex2.FlYield=0.15
+    complex2.FlYieldTriplet=0.015
+    if parameters is not None:
+        complex2.setParameters(parameters)
+    for e in range(warmupPulses):
+        for interval in complex2.advance(AOMtimes[0],'on'):
+            pass
+        for interval in complex2.advance(AOMtimes[1],'off'):
+            pass
+    complex2.counters=counters
+    rng=complex2.rng
+    timestep=complex2.timestep
+    recorder=IntervalRecorder(AOMtimes[0],binning,['fluorescence','ChlTriplet','CarTriplet','Absorbed','Annihilation'])
+    for e in range(numtrials):
+        for start,end,ChlTriplet,CarTriplet,fluorescencerate,absorbed,event in complex2.advance(AOMtimes[0],'on'):
+            quenched=(ChlTriplet+CarTriplet)>=1
+            rates={'ChlTriplet':ChlTriplet/timestep,'CarTriplet':CarTriplet/timestep}
+            if weighted:
+                rates['fluorescence']=fluorescencerate
+                rates['Absorbed']=absorbed
+                if quenched:
+                    rates['Annihilation']=fluorescencerate
+            else:
+                recorder.addPoissonEvents(['fluorescence','Annihilation'] if quenched else ['fluorescence'],start,end,fluorescencerate,rng)
+                recorder.addPoissonEvents(['Absorbed'],start,end,absorbed,rng)
+            recorder.addRates(start,end,rates)
+            if event is not None:
+                absorption,photon=event
+                if absorption:
+                    recorder.addEvent('Absorbed',end)
+                if photon and weighted:
+                    recorder.addEvent('fluorescence',end,photon)
+                    recorder.addEvent('Annihilation',end,photon) #only quenched car triplet formations fluoresce
+                elif photon and rng.random()<=photon:
+                    recorder.addEvent('fluorescence',end)
+                    recorder.addEvent('Annihilation',end)
+        for interval in complex2.advance(AOMtimes[1],'off'):
+            pass
+    histograms=tuple(recorder.totals[channel] for channel in ['fluorescence','ChlTriplet','CarTriplet','Absorbed','Annihilation'])
+    if weighted:
+        return histograms
+    return tuple(histogram if channel in ('ChlTriplet','CarTriplet') else np.rint(histogram).astype(np.int64)
+                 for channel,histogram in zip(['fluorescence','ChlTriplet','CarTriplet','Absorbed','Annihilation'],histograms))
+
+def AOMCurves(numtrials=500,AOMtimes=[0.8E-3,0.1E-3],Intensities=[500],numComplexes=None,processes=None,seed=0,batchSize=25,checkpoint=None,
+              Offtimes=[10E-3,1.5E-3,0.5E-3,0.1E-3],ChlTripletYield=0.02,CarTripletYield=0.15,binning=2E-5,weighted=False,multiscale=False,shared=False,disorder=None,warmupPulses=None):
+    """
+    Computes the AOM transients for every offtime without plotting, the other arguments are those of AOM().
+    With numComplexes and disorder the complexes of the ensemble draw their parameters from distributions (see simulationAOMEnsemble).
+    With numComplexes or processes every complex first runs warmupPulses unrecorded pulses (steadyStatePulses of the offtime
+    if None); with processes every trial batch runs on new complexes, so with too few warm-up pulses the result depends on
+    batchSize, because every batch starts from the ground state.
+    With weighted the triplet-quenched emission of the single-complex simulation is recorded as a statistical weight (see simulationAOM),
+    with multiscale the single-complex transients are computed with simulationAOMMultiscale, which has no checkpoints.
+    With processes and shared the workers sum their histograms in shared memory (see sweep.runSharedSweep), which
+    returns float histograms.
+
+    returns list with the fluorescence, Chl triplet, car triplet, absorption and annihilation histograms of every offtime
+    """
+    from sweep import runSweep, runSharedSweep
     #random.seed(1)
-    ChlTripletYield=0.02
-    CarTripletYield=0.15
+    if multiscale and checkpoint is not None:
+        raise ValueError('simulationAOMMultiscale does not write checkpoints')
+    simulate=simulationAOMMultiscale if multiscale else simulationAOM
+    curves=[]
+    if processes is not None: #offtimes x trial batches spread over a process pool, every batch is warmed up from the ground state
+        points=[{'AOMtimes':[AOMtimes[0],Offtime],'Intensity':Intensities[0],'ChlTripletYield':ChlTripletYield,'CarTripletYield':CarTripletYield,'binning':binning,
+                 'warmupPulses':steadyStatePulses([AOMtimes[0],Offtime]) if warmupPulses is None else warmupPulses} for Offtime in Offtimes]
+        if numComplexes is None:
+            for point in points:
+                point['weighted']=weighted
+            function=simulate
+        else:
+            for point in points:
+                point['numComplexes']=numComplexes
+                point['disorder']=disorder
+            function=simulationAOMEnsemble
+        if shared:
+            results=runSharedSweep(function,points,numtrials,(5,int(AOMtimes[0]/binning)),batchSize=batchSize,processes=processes,seed=seed,seedArgument='seed')
+        else:
+            results=runSweep(function,points,numtrials,batchSize=batchSize,processes=processes,seed=seed,seedArgument='seed')
+    for j in range(len(Offtimes)):
+        print j
+        if processes is not None:
+            fluorescence,SumChlTriplets,SumCarTriplets,Absorbed,Annihilation=results[j]
+        elif numComplexes is None and checkpoint is not None: #one checkpoint file per offtime, rerun AOM to resume
+            fluorescence,SumChlTriplets,SumCarTriplets,Absorbed,Annihilation=simulationAOM(numtrials,AOMtimes=[AOMtimes[0],Offtimes[j]],Intensity=Intensities[0],ChlTripletYield=ChlTripletYield,CarTripletYield=CarTripletYield,binning=binning,
+                                                                                           seed=seed+j,checkpointFile='%s.%i' % (checkpoint,j),weighted=weighted)
+        elif numComplexes is None:
+            fluorescence,SumChlTriplets,SumCarTriplets,Absorbed,Annihilation=simulate(numtrials,AOMtimes=[AOMtimes[0],Offtimes[j]],Intensity=Intensities[0],ChlTripletYield=ChlTripletYield,CarTripletYield=CarTripletYield,binning=binning,weighted=weighted)
+        else:
+            fluorescence,SumChlTriplets,SumCarTriplets,Absorbed,Annihilation=simulationAOMEnsemble(numtrials,AOMtimes=[AOMtimes[0],Offtimes[j]],Intensity=Intensities[0],ChlTripletYield=ChlTripletYield,CarTripletYield=CarTripletYield,binning=binning,numComplexes=numComplexes,disorder=disorder,warmupPulses=warmupPulses)
+        curves.append(tuple(np.asarray(curve) for curve in (fluorescence,SumChlTriplets,SumCarTriplets,Absorbed,Annihilation)))
+    return curves
+
+def plotAOM(AOMtimes,Offtimes,curves,binning=2E-5):
+    from plotting import plotHistogram, plotSeries
+    import matplotlib.pyplot as plt
     plt.figure(2)
     plt.figure(1)
     plt.figure(3)
-    Offtimes=[10E-3,1.5E-3,0.5E-3,0.1E-3]
     plt.clf()
     colors=['k','g','darkkhaki','r']
-    binning=2E-5
-    for j in range(4):
-        print j
-        fluorescence,SumChlTriplets,SumCarTriplets,Absorbed,Annihilation=simulationAOM(numtrials,AOMtimes=[AOMtimes[0],Offtimes[j]],Intensity=Intensities[0],ChlTripletYield=ChlTripletYield,CarTripletYield=CarTripletYield,binning=binning)
+    for j in range(len(curves)):
+        fluorescence,SumChlTriplets,SumCarTriplets,Absorbed,Annihilation=curves[j]
         fluorescence=np.asarray(fluorescence)
         SumChlTriplets=np.asarray(SumChlTriplets)
         SumCarTriplets=np.asarray(SumCarTriplets)
         Absorbed=np.asarray(Absorbed)
         Annihilation=np.asarray(Annihilation)
         AvgTripletPop=Annihilation/0.15/(Annihilation/0.15+(fluorescence-Annihilation)/1.5)
-        xaxis=[]
-        for i in range(len(fluorescence)):
-            xaxis.append(AOMtimes[0]/float(len(fluorescence))*i*1E3)  
+        width=AOMtimes[0]/float(len(fluorescence))*1E3
+        xaxis=np.arange(len(fluorescence))*width
         plt.figure(1)      
-        plt.bar(xaxis,fluorescence,width=binning*1E3,color=colors[j])
+        plotHistogram(plt.gca(),fluorescence,width,fill=True,color=colors[j])
         plt.xlabel('AOM time [ms]',size=15)
         plt.figure(2)
-        plt.plot(xaxis,SumChlTriplets,color=colors[j])
+        plotSeries(plt.gca(),xaxis,SumChlTriplets,color=colors[j])
         plt.xlabel('AOM time [ms]',size=15)
         plt.figure(3)
         #plt.plot(xaxis,SumCarTriplets,color=colors[j])
         #plt.xlabel('AOM time [ms]',size=15)
-        plt.plot(xaxis,SumCarTriplets,color=colors[j])
+        plotSeries(plt.gca(),xaxis,SumCarTriplets,color=colors[j])
         plt.xlabel('AOM time [ms]',size=15)
     plt.figure(1)    
     plt.ylabel('Fluorescence Intensity [a.u.]',size=15)
     #plt.ylim([0,700])
     plt.xlim([-0.1,0.9])
-    plt.legend(('Offtime [ms]: ' + str(Offtimes[0]*1E3),'Offtime [ms]: ' + str(Offtimes[1]*1E3),'Offtime [ms]: ' + str(Offtimes[2]*1E3),'Offtime [ms]: ' + str(Offtimes[3]*1E3)))
+    plt.legend(['Offtime [ms]: ' + str(Offtime*1E3) for Offtime in Offtimes])
     plt.title('Simulation of AOM kinetics on a C2S2 supercomplex',size=15)
     #plt.title(('ChlTripletYield: ' + str(ChlTripletYield) + ' \nCarTripletYield: ' + str(CarTripletYield)),size=15)
     #text1=plt.figtext(0.5, 0.6,r'$\tau_{Car}=9\mu s$' +'\n' + r'$\tau_{Chl}=2 ms$',size=15)
 
     plt.show()
-    
-AOM(Intensities=[75])
+
+def AOM(numtrials=500,AOMtimes=[0.8E-3,0.1E-3],Intensities=[500],numComplexes=None,processes=None,seed=0,batchSize=25,checkpoint=None,weighted=False,multiscale=False,shared=False,disorder=None,warmupPulses=None):
+    Offtimes=[10E-3,1.5E-3,0.5E-3,0.1E-3]
+    binning=2E-5
+    plotAOM(AOMtimes,Offtimes,AOMCurves(numtrials,AOMtimes,Intensities,numComplexes,processes,seed,batchSize,checkpoint,Offtimes,binning=binning,weighted=weighted,multiscale=multiscale,shared=shared,disorder=disorder,warmupPulses=warmupPulses),binning)
+
+def fitAOM(data,start,steps,bounds=None,numtrials=1000,AOMtimes=[0.8E-3,10E-3],Intensity=500,binning=2E-5,errors=None,scale=True,
+           processes=1,seed=0,batchSize=None,cache=None,iterations=10,tolerance=1E-3,numComplexes=1000):
+    """
+    Fits model parameters to a measured AOM fluorescence trace (see fitting.fitParameters). Every iteration simulates a
+    batch of candidate parameter sets with simulationAOMEnsemble, spread over processes, and all candidates draw the
+    same random numbers (common random numbers): the ensemble draws the same uniform numbers in every timestep whatever
+    the parameters, so the chi square is smooth in the parameters. The slow events of simulationAOMMultiscale diverge
+    between candidates, which leaves too much noise in the chi square for the quadratic steps of the fit.
+    With cache (see sweep.runSweep) candidates that were simulated before, e.g. in an earlier fit, are not rerun.
+    The errors only account for the noise of data, so numtrials should make the simulated trace far less noisy than data.
+
+    Input:
+        data: array with the measured fluorescence per bin of binning seconds during the pulse
+        start: dict with the initial value of every fitted parameter, e.g. {'ChlTripletYield':0.02,'CarTripletYield':0.15}
+            (any attribute of PSII, see PSII.setParameters)
+        steps: dict with the initial step size of every fitted parameter
+        bounds: dict with (lower, upper) limits, the physical limits if None (see fitting.parameterBounds)
+        numtrials: int representing the number of simulated pulses per candidate
+        errors: array or float with the standard deviation of data, None to estimate it from the residuals
+        scale: bool, True for data in arbitrary units (the amplitude is fitted as well), False for data in photons per pulse
+        numComplexes: int representing the number of complexes simulated side by side (see simulationAOMEnsemble)
+
+    returns dict of fitting.fitParameters, with the amplitude and the simulated trace (curve) of the best parameters
+    """
+    from sweep import runSweep
+    from fitting import fitParameters, chiSquare, parameterBounds
+    if not Intensity>0:
+        raise ValueError('the AOM pulses need an intensity > 0, not %r' % Intensity)
+    data=np.asarray(data,dtype=float)
+    if bounds is None:
+        bounds=parameterBounds(start)
+    def simulate(candidates):
+        points=[{'AOMtimes':AOMtimes,'Intensity':Intensity,'binning':binning,'numComplexes':numComplexes,'parameters':candidate} for candidate in candidates]
+        results=runSweep(simulationAOMEnsemble,points,numtrials,batchSize=batchSize,processes=processes,seed=seed,seedArgument='seed',cache=cache,commonStreams=True)
+        return [fluorescence/float(numtrials) for fluorescence,SumChlTriplets,SumCarTriplets,Absorbed,Annihilation in results]
+    def evaluate(candidates):
+        return [chiSquare(data,curve,errors,scale)[0] for curve in simulate(candidates)]
+    fit=fitParameters(evaluate,start,steps,bounds,iterations,tolerance=tolerance,degreesOfFreedom=None if errors is not None else len(data)-len(start)-scale)
+    curve=simulate([fit['parameters']])[0]
+    fit['amplitude']=chiSquare(data,curve,errors,scale)[1]
+    fit['curve']=fit['amplitude']*curve
+    return fit
+
+def fitSaturation(intensities,data,start,steps,bounds=None,errors=None,scale=True,maxTriplets=50,iterations=10,tolerance=1E-3):
+    """
+    Fits model parameters to a measured saturation curve with saturationMasterEquation(), which has no sampling noise.
+    The arguments are those of fitAOM(), data holds the fluorescence at every intensity.
+
+    returns dict of fitting.fitParameters, with the amplitude and the fluorescence (curve) of the best parameters
+    """
+    from fitting import fitParameters, chiSquare, parameterBounds
+    data=np.asarray(data,dtype=float)
+    if bounds is None:
+        bounds=parameterBounds(start)
+    def evaluate(candidates):
+        return [chiSquare(data,saturationMasterEquation(intensities,maxTriplets,candidate)[0],errors,scale)[0] for candidate in candidates]
+    fit=fitParameters(evaluate,start,steps,bounds,iterations,tolerance=tolerance,degreesOfFreedom=None if errors is not None else len(data)-len(start)-scale)
+    curve=saturationMasterEquation(intensities,maxTriplets,fit['parameters'])[0]
+    fit['amplitude']=chiSquare(data,curve,errors,scale)[1]
+    fit['curve']=fit['amplitude']*curve
+    return fit
+
+def sensitivityAOM(names=['ChlTripletYield','CarTripletYield','FlYield','FlYieldTriplet','lifetime','lifetimeTriplet','ChlTripletLifetime','CarTripletLifetime','absCrossection'],
+                   relativeStep=0.1,numtrials=1000,AOMtimes=[0.8E-3,10E-3],Intensity=500,ChlTripletYield=0.1,CarTripletYield=0.001,binning=2E-5,
+                   processes=1,seed=0,batchSize=100,parameters=None):
+    """
+    Sensitivity of the AOM transients to the kinetic parameters of PSII, by central differences with common random
+    numbers (see sensitivity.centralDifferences): the base parameters and every parameter scaled by 1+-relativeStep are
+    simulated in one sweep with simulationAOMEnsemble, batchSize complexes side by side, and trial batch i of every
+    parameter set draws the same random numbers (as in fitAOM, the slow events of simulationAOMMultiscale diverge
+    between the parameter sets and leave too much noise in the differences). The error bars follow from the spread
+    of the per-batch derivatives, so numtrials should hold at least a few batches of batchSize trials.
+
+    Input:
+        names: list of str, the PSII attributes whose sensitivity is wanted
+        relativeStep: float, relative size of the perturbations
+        parameters: dict overriding further model parameters of the base point (see PSII.setParameters)
+        the other arguments are those of simulationAOMEnsemble()
+
+    returns array with the mean fluorescence, Chl triplet, car triplet, absorption and annihilation histograms per
+    pulse of the base parameters, and dict with the derivative, error and elasticity of these histograms for every name
+    """
+    from sweep import runSweep
+    from sensitivity import perturbations, batchResults, centralDifferences
+    if not Intensity>0:
+        raise ValueError('the AOM pulses need an intensity > 0, not %r' % Intensity)
+    complex=PSII(Intensity=Intensity)
+    complex.setParameters({'ChlTripletYield':ChlTripletYield,'CarTripletYield':CarTripletYield,'FlYield':0.15,'FlYieldTriplet':0.015}) #as in simulationAOMEnsemble
+    if parameters is not None:
+        complex.setParameters(parameters)
+    base=dict((name,getattr(complex,name)) for name in names)
+    points=[{'AOMtimes':AOMtimes,'Intensity':Intensity,'ChlTripletYield':ChlTripletYield,'CarTripletYield':CarTripletYield,'binning':binning,'numComplexes':batchSize,
+             'parameters':dict(parameters or {},**point)} for point in perturbations(base,names,relativeStep)]
+    batches=runSweep(simulationAOMEnsemble,points,numtrials,batchSize=batchSize,merge=batchResults,processes=processes,seed=seed,seedArgument='seed',commonStreams=True)
+    return centralDifferences(batches,base,names,relativeStep)
+
+if __name__=='__main__':
+    AOM(Intensities=[75])
 
 
 
@@ -0,0 +1,174 @@
+import math
+import time
+import numpy as np
+
+
+def normalQuantile(p):
+    """
+    returns the p quantile of the standard normal distribution (bisection on math.erf)
+    """
+    low, high = -40.0, 40.0
+    for iteration in range(200):
+        middle = (low + high)/2
+        if 0.5*(1 + math.erf(middle/math.sqrt(2))) < p:
+            low = middle
+        else:
+            high = middle
+    return (low + high)/2
+
+def tQuantile(p, dof):
+    """
+    returns the p quantile of Student's t distribution with dof degrees of freedom
+    (Cornish-Fisher expansion around the normal quantile, accurate to about 1E-3 for dof >= 5)
+    """
+    z = normalQuantile(p)
+    return (z + (z**3 + z)/(4.0*dof) + (5*z**5 + 16*z**3 + 3*z)/(96.0*dof**2)
+            + (3*z**7 + 19*z**5 + 17*z**3 - 15*z)/(384.0*dof**3))
+
+
+class BatchMeans(object):
+    """
+    On-line standard error of a correlated time series by the method of batch means
+    """
+
+    def __init__(self, numBatches = 64):
+        """
+
+        Initialize a BatchMeans instance.
+
+        Input:
+            numBatches: int (even) representing the maximal number of batches; when it is reached adjacent batches are
+                merged, so the batches grow with the run and outgrow the correlation time (e.g. of long-lived triplets)
+
+        size: int representing the number of added values per batch
+        means: list with the means of the complete batches
+        """
+        self.numBatches = numBatches
+        self.size = 1
+        self.means = []
+        self.pending = []
+        self.total = 0.0
+        self.count = 0
+
+    def add(self, value):
+        """
+        Adds the mean of one block of the simulation (e.g. the fluorescence rate of batchSteps timesteps).
+        """
+        self.total += value
+        self.count += 1
+        self.pending.append(value)
+        if len(self.pending) == self.size:
+            self.means.append(sum(self.pending)/float(self.size))
+            self.pending = []
+            if len(self.means) == self.numBatches:
+                self.means = [(a + b)/2.0 for a, b in zip(self.means[::2], self.means[1::2])]
+                self.size *= 2
+
+    def complete(self):
+        """
+        returns True if there are numBatches/2 batches and no pending values, which happens once per doubling of the
+        run length (right after adjacent batches were merged)
+        """
+        return len(self.means) == self.numBatches//2 and not self.pending
+
+    def mean(self):
+        """
+        returns the mean of all added values
+        """
+        return self.total/max(self.count, 1)
+
+    def standardError(self):
+        """
+        returns the standard error of the mean from the spread of the batch means, infinity with fewer than 2 batches
+        """
+        k = len(self.means)
+        if k < 2:
+            return float('inf')
+        return float(np.std(self.means, ddof = 1)/math.sqrt(k))
+
+    def correlation(self):
+        """
+        returns the lag-1 autocorrelation of the batch means; close to 0 once the batches are longer than the
+        correlation time of the series, so the standard error can be trusted
+        """
+        means = np.asarray(self.means)
+        if len(means) < 3:
+            return 1.0
+        deviations = means - means.mean()
+        variance = np.dot(deviations, deviations)
+        if variance == 0:
+            return 0.0
+        return float(np.dot(deviations[:-1], deviations[1:])/variance)
+
+    def interval(self, confidence = 0.95):
+        """
+        returns the lower and upper limit of the confidence interval of the mean (Student t with batches-1 degrees of freedom)
+        """
+        k = len(self.means)
+        if k < 2:
+            return float('-inf'), float('inf')
+        half = tQuantile(0.5 + confidence/2.0, k - 1)*self.standardError()
+        return self.mean() - half, self.mean() + half
+
+    def estimate(self, confidence = 0.95):
+        """
+        returns dict with the mean, standard error, relative error, confidence interval, lag-1 correlation and batches
+        """
+        mean = self.mean()
+        error = self.standardError()
+        return {'mean': mean, 'standardError': error, 'relativeError': error/abs(mean) if mean else float('inf'),
+                'interval': self.interval(confidence), 'correlation': self.correlation(), 'batches': len(self.means), 'batchSize': self.size}
+
+def runAdaptive(block, observables, relativePrecision = 0.01, timeBudget = None, maxBlocks = None, confidence = 0.95,
+                numBatches = 64, maxCorrelation = 0.2, precisionObservables = None):
+    """
+    Runs a simulation in blocks until the requested precision is reached or the budget is used up.
+    The run has converged when, for every observable in precisionObservables, the half width of the
+    confidence interval relative to the mean is at most relativePrecision and the lag-1 correlation of the
+    batch means is below maxCorrelation. Convergence is only tested each time the run length has doubled
+    (with numBatches/2 batches), testing after every block would stop preferentially on an underestimated
+    standard error and the intervals would cover the mean less often than confidence.
+
+    Input:
+        block: function running the next block of the simulation, returns dict with the block mean of every observable
+        observables: list of str, names of the observables returned by block
+        relativePrecision: float, target relative half width of the confidence intervals
+        timeBudget: float, maximal run time in seconds (None for no limit)
+        maxBlocks: int, maximal number of blocks (None for no limit)
+        precisionObservables: observables that have to reach relativePrecision (all observables if None)
+
+    returns dict with the estimate (see BatchMeans.estimate) of every observable, and blocks, elapsed and converged
+    """
+    if precisionObservables is None:
+        precisionObservables = observables
+    if timeBudget is None and maxBlocks is None and relativePrecision is None:
+        raise ValueError('runAdaptive needs a relativePrecision, timeBudget or maxBlocks to stop')
+    series = dict((observable, BatchMeans(numBatches)) for observable in observables)
+    start = time.time()
+    blocks = 0
+    converged = False
+    while True:
+        values = block()
+        for observable in observables:
+            series[observable].add(values[observable])
+        blocks += 1
+        if relativePrecision is not None and series[observables[0]].complete():
+            converged = True
+            for observable in precisionObservables:
+                low, high = series[observable].interval(confidence)
+                mean = series[observable].mean()
+                if (mean == 0 or (high - low)/2.0 > relativePrecision*abs(mean)
+                        or series[observable].correlation() > maxCorrelation):
+                    converged = False
+                    break
+            if converged:
+                break
+        if timeBudget is not None and time.time() - start >= timeBudget:
+            break
+        if maxBlocks is not None and blocks >= maxBlocks:
+            break
+    result = dict((observable, series[observable].estimate(confidence)) for observable in observables)
+    result['blocks'] = blocks
+    result['elapsed'] = time.time() - start
+    result['converged'] = converged
+    return result
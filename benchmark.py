@@ -0,0 +1,257 @@
+"""
+Throughput benchmarks of the simulation kernels.
+
+    python benchmark.py [--cases PATTERN ...] [--history benchmarks.jsonl] [--tolerance 0.15] [--no-record]
+
+Every case times one kernel (LHCII.update, PSII.update, their ensemble and event-driven counterparts,
+LHCIINetwork.update, Leaf.updateLayers and CountLeaf.updateLayers) in one regime and reports steps/second and
+complexes x steps/second (a step of an ensemble or leaf advances all of its complexes).
+The results are appended as one JSON line to the history file. A case that is slower than the median of
+its last runs on the same machine by more than the tolerance is flagged as a regression, and the exit
+status is 1 then.
+"""
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+from runner import loadModel
+from randomsource import RandomSource
+
+
+def lhciiCase(Intensity, saturated = False):
+    """
+    Scalar LHCII.update at Intensity; saturated keeps a car triplet on the complex (no triplet decay).
+    """
+    def setup():
+        complex = loadModel('LHCII').LHCII(Intensity = Intensity, rng = RandomSource(1))
+        if saturated:
+            complex.triplet = 1
+            complex.TripletDecay = 0.0
+        return lambda: complex.update('on'), 1
+    return setup
+
+def lhciiEnsembleCase(Intensity, numComplexes = 1000, saturated = False):
+    """
+    LHCIIEnsemble.update of numComplexes complexes, saturated as in lhciiCase.
+    """
+    def setup():
+        ensemble = loadModel('LHCII').LHCIIEnsemble(numComplexes = numComplexes, Intensity = Intensity, rng = RandomSource(1))
+        if saturated:
+            ensemble.triplet[:] = 1
+            ensemble.TripletDecay = 0.0
+        return lambda: ensemble.update('on'), numComplexes
+    return setup
+
+def lhciiNetworkCase(Intensity, rows = 300, columns = 300, migrationSteps = 1):
+    """
+    LHCIINetwork.update of the complexes of a periodic rows x columns square lattice.
+    """
+    def setup():
+        from network import squareLattice
+        network = loadModel('LHCII').LHCIINetwork(squareLattice(rows, columns), Intensity = Intensity, rng = RandomSource(1), migrationSteps = migrationSteps)
+        return lambda: network.update('on'), rows*columns
+    return setup
+
+def eventDrivenCase(model, Intensity, steps = 1000):
+    """
+    LHCIIEventDriven/PSIIEventDriven.advance over the time span of steps timesteps, counted as steps steps.
+    """
+    def setup():
+        module = loadModel(model)
+        complex = getattr(module, model + 'EventDriven')(Intensity = Intensity, rng = RandomSource(1))
+        duration = steps*complex.timestep
+        def step():
+            for event in complex.advance(duration, 'on'):
+                pass
+        return step, 1, steps
+    return setup
+
+def psiiCase(Intensity, saturated = False):
+    """
+    Scalar PSII.update at Intensity; saturated keeps a Chl and a car triplet on the complex (no triplet decay).
+    """
+    def setup():
+        complex = loadModel('PSII').PSII(Intensity = Intensity, rng = RandomSource(1))
+        if saturated:
+            complex.ChlTriplet = complex.CarTriplet = 1
+            complex.ChlTripletDecay = complex.CarTripletDecay = 0.0
+        return lambda: complex.update('on'), 1
+    return setup
+
+def psiiEnsembleCase(Intensity, numComplexes = 1000, saturated = False):
+    """
+    PSIIEnsemble.update of numComplexes complexes, saturated as in psiiCase.
+    """
+    def setup():
+        ensemble = loadModel('PSII').PSIIEnsemble(numComplexes = numComplexes, Intensity = Intensity, rng = RandomSource(1))
+        if saturated:
+            ensemble.ChlTriplet[:] = 1
+            ensemble.CarTriplet[:] = 1
+            ensemble.ChlTripletDecay = ensemble.CarTripletDecay = 0.0
+        return lambda: ensemble.update('on'), numComplexes
+    return setup
+
+def leafCase(numPSIIs, layers, photonFlux, countBased = False):
+    """
+    Leaf.updateLayers (or CountLeaf.updateLayers) for numPSIIs PSIIs of size 1 on 10000 area units,
+    so probabilityAbsorbed = photonFlux/10000 (above 1 for multiple excitations per step).
+    """
+    def setup():
+        module = loadModel('leaf')
+        rng = RandomSource(1)
+        if countBased:
+            leaf = module.CountLeaf(numPSIIs, layers, size = 1, photonFlux = photonFlux, leafArea = 10000, rng = rng)
+        else:
+            PSIIs = [module.PSII(size = 1, state = "ground", photonFlux = photonFlux, leafArea = 10000, rng = rng) for nr in range(numPSIIs)]
+            leaf = module.Leaf(PSIIs, layers)
+            leaf.assignPSIIToLayers()
+        leaf.createLayers()
+        return lambda: leaf.updateLayers(light = "on"), numPSIIs
+    return setup
+
+#name: setup function returning the step function, the number of complexes per step and optionally the steps per call
+CASES = [
+    ('LHCII/scalar/low', lhciiCase(75)),
+    ('LHCII/scalar/high', lhciiCase(1500)),
+    ('LHCII/scalar/tripletSaturated', lhciiCase(1500, saturated = True)),
+    ('LHCII/ensemble/low', lhciiEnsembleCase(75)),
+    ('LHCII/ensemble/high', lhciiEnsembleCase(1500)),
+    ('LHCII/ensemble/tripletSaturated', lhciiEnsembleCase(1500, saturated = True)),
+    ('LHCII/network/high', lhciiNetworkCase(1500)),
+    ('LHCII/network/migrating', lhciiNetworkCase(1500, migrationSteps = 10)),
+    ('LHCII/eventDriven/low', eventDrivenCase('LHCII', 75)),
+    ('LHCII/eventDriven/high', eventDrivenCase('LHCII', 1500)),
+    ('PSII/scalar/low', psiiCase(75)),
+    ('PSII/scalar/high', psiiCase(1500)),
+    ('PSII/scalar/tripletSaturated', psiiCase(1500, saturated = True)),
+    ('PSII/ensemble/low', psiiEnsembleCase(75)),
+    ('PSII/ensemble/high', psiiEnsembleCase(1500)),
+    ('PSII/ensemble/tripletSaturated', psiiEnsembleCase(1500, saturated = True)),
+    ('PSII/eventDriven/low', eventDrivenCase('PSII', 75)),
+    ('PSII/eventDriven/high', eventDrivenCase('PSII', 1500)),
+    ('leaf/1layer/dim', leafCase(1000, 1, 1000)),
+    ('leaf/3layers/saturating', leafCase(1000, 3, 30000)),
+    ('leaf/count/1layer/dim', leafCase(100000, 1, 1000, countBased = True)),
+    ('leaf/count/3layers/saturating', leafCase(100000, 3, 30000, countBased = True)),
+]
+
+
+def measure(setup, minTime = 0.5, repeat = 3):
+    """
+    Times a case: the step function is called in rounds of at least minTime seconds, the fastest of repeat rounds counts.
+
+    returns dict with stepsPerSecond and complexStepsPerSecond
+    """
+    case = setup()
+    step, complexes = case[0], case[1]
+    stepsPerCall = case[2] if len(case) > 2 else 1
+    calls = 1
+    while True: #calibration, also warms up the caches of the kernel
+        start = time.time()
+        for call in xrange(calls):
+            step()
+        elapsed = time.time() - start
+        if elapsed >= minTime/10.0:
+            break
+        calls *= 10
+    calls = max(1, int(calls*minTime/max(elapsed, 1E-9)))
+    best = 0.0
+    for attempt in range(repeat):
+        start = time.time()
+        for call in xrange(calls):
+            step()
+        best = max(best, calls/(time.time() - start))
+    return {'stepsPerSecond': best*stepsPerCall, 'complexStepsPerSecond': best*stepsPerCall*complexes}
+
+def environment():
+    """
+    returns dict describing the machine, the interpreter and the checked out commit
+    """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr = subprocess.STDOUT,
+                                         cwd = os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'machine': platform.node(), 'processor': platform.machine(), 'python': platform.python_version(),
+            'numpy': np.__version__, 'commit': commit}
+
+def loadHistory(path):
+    """
+    returns list with the records of the history file (one JSON object per line), empty if there is none
+    """
+    try:
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except IOError:
+        return []
+
+def reference(history, machine, name, window = 5):
+    """
+    returns the median complexes x steps/second of the last window runs of a case on machine, None if it never ran there
+    """
+    values = [record['results'][name]['complexStepsPerSecond'] for record in history
+              if record['environment']['machine'] == machine and name in record['results']]
+    if not values:
+        return None
+    return float(np.median(values[-window:]))
+
+def runBenchmarks(patterns = None, minTime = 0.5, repeat = 3):
+    """
+    Runs the cases whose name matches one of the fnmatch patterns (all cases if None).
+
+    returns dict with the result of every case
+    """
+    results = {}
+    for name, setup in CASES:
+        if patterns and not any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+            continue
+        results[name] = measure(setup, minTime, repeat)
+    return results
+
+def main(arguments = None):
+    parser = argparse.ArgumentParser(description = 'Measures the throughput of the simulation kernels.')
+    parser.add_argument('--cases', nargs = '*', help = 'fnmatch patterns of the cases to run, e.g. "LHCII/*" (default: all)')
+    parser.add_argument('--history', default = 'benchmarks.jsonl', help = 'JSON lines file with the results of earlier runs')
+    parser.add_argument('--tolerance', type = float, default = 0.15, help = 'relative slowdown that is flagged as a regression')
+    parser.add_argument('--min-time', type = float, default = 0.5, help = 'minimal duration of a timing round in seconds')
+    parser.add_argument('--repeat', type = int, default = 3, help = 'number of timing rounds, the fastest counts')
+    parser.add_argument('--no-record', action = 'store_true', help = 'do not append the results to the history')
+    parser.add_argument('--list', action = 'store_true', help = 'list the cases and exit')
+    options = parser.parse_args(arguments)
+    if options.list:
+        for name, setup in CASES:
+            print name
+        return 0
+    history = loadHistory(options.history)
+    record = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'environment': environment(),
+              'results': runBenchmarks(options.cases, options.min_time, options.repeat)}
+    regressions = []
+    print '%-36s %14s %18s %9s' % ('case', 'steps/s', 'complexes*steps/s', 'change')
+    for name, setup in CASES:
+        if name not in record['results']:
+            continue
+        result = record['results'][name]
+        previous = reference(history, record['environment']['machine'], name)
+        change = ''
+        if previous is not None:
+            ratio = result['complexStepsPerSecond']/previous - 1
+            change = '%+.1f%%' % (100*ratio)
+            if ratio < -options.tolerance:
+                regressions.append(name)
+                change += ' SLOWER'
+        print '%-36s %14.4g %18.4g %9s' % (name, result['stepsPerSecond'], result['complexStepsPerSecond'], change)
+    if not options.no_record:
+        with open(options.history, 'a') as f:
+            f.write(json.dumps(record, sort_keys = True) + '\n')
+    if regressions:
+        print 'Regressions (more than %.0f%% slower than the median of the last runs): %s' % (100*options.tolerance, ', '.join(regressions))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+import os
+import time
+import pickle
+
+
+def saveCheckpoint(path, state):
+    """
+    Writes state to path. The file is written under a temporary name first and then renamed, so a crash
+    or preemption during writing leaves the previous checkpoint intact.
+    """
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(temporary, path)
+
+def loadCheckpoint(path):
+    """
+    returns the state saved in path, None if there is no checkpoint
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+class Checkpointer(object):
+    """
+    Periodic checkpointing of a running simulation
+    """
+
+    def __init__(self, path, interval = 600.0, arguments = None):
+        """
+
+        Initialize a Checkpointer instance.
+
+        Input:
+            path: str, file name of the checkpoint
+            interval: float, minimal time in seconds between two checkpoints
+            arguments: dict with the arguments of the simulation; a checkpoint is only resumed by a run with the same arguments
+        """
+        self.path = path
+        self.interval = interval
+        self.arguments = arguments
+        self.last = time.time()
+
+    def load(self):
+        """
+        returns the saved state of the simulation, None if there is no checkpoint yet.
+        A finished run has the state {'finished': True, 'result': result}.
+        """
+        state = loadCheckpoint(self.path)
+        if state is not None and state['arguments'] != self.arguments:
+            raise ValueError('checkpoint %s was written by a run with the arguments %s' % (self.path, state['arguments']))
+        return state
+
+    def due(self):
+        """
+        returns True if the last checkpoint is older than interval
+        """
+        return time.time() - self.last >= self.interval
+
+    def save(self, state):
+        """
+        Saves the complete state of the simulation (a dict that can be pickled).
+        """
+        state = dict(state)
+        state['arguments'] = self.arguments
+        state['finished'] = False
+        saveCheckpoint(self.path, state)
+        self.last = time.time()
+
+    def finish(self, result):
+        """
+        Marks the run as finished, a later run with the same checkpoint just returns result.
+        """
+        saveCheckpoint(self.path, {'arguments': self.arguments, 'finished': True, 'result': result})
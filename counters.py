@@ -0,0 +1,82 @@
+import json
+import numpy as np
+
+
+class TransitionCounters(object):
+    """
+    Opt-in tallies of the transitions of a model, per transition and per time bin
+    """
+
+    def __init__(self, model, transitions, bins = 1):
+        """
+
+        Initialize a TransitionCounters instance. Attach it to a complex (complex.counters = counters) or pass it
+        to a simulation function to switch the counting on; without counters the models only pay for an
+        'is not None' check when a transition happens.
+
+        Input:
+            model: str, name of the complex type, e.g. 'LHCII'
+            transitions: list of str, names of the counted transitions (the TRANSITIONS list of the model)
+            bins: int representing the number of time bins
+
+        bin: int, time bin the transitions are currently counted in, set by the simulation loop
+        counts: dict with a list of per-bin counts for every transition
+        """
+        self.model = model
+        self.transitions = list(transitions)
+        self.bins = bins
+        self.bin = 0
+        self.counts = dict((transition, [0]*bins) for transition in self.transitions)
+
+    def count(self, transition, number = 1):
+        """
+        Adds number transitions (e.g. the count_nonzero of a mask of an ensemble, or the weight of a weighted event) to the current time bin.
+        """
+        self.counts[transition][self.bin] += number
+
+    def totals(self):
+        """
+        returns dict with the count of every transition summed over the time bins
+        """
+        return dict((transition, sum(self.counts[transition])) for transition in self.transitions)
+
+    def merge(self, other):
+        """
+        Adds the counts of other (e.g. counters of another trial batch of the same model) to these counts.
+        """
+        if other.model != self.model or other.bins != self.bins:
+            raise ValueError('cannot merge counters of %s with %i bins into counters of %s with %i bins' % (other.model, other.bins, self.model, self.bins))
+        for transition in other.transitions:
+            if transition not in self.counts:
+                self.transitions.append(transition)
+                self.counts[transition] = [0]*self.bins
+            self.counts[transition] = [a + b for a, b in zip(self.counts[transition], other.counts[transition])]
+
+    def asArrays(self):
+        """
+        returns dict with an int array of the per-bin counts of every transition, named 'model/transition',
+        e.g. for saving them next to the results with numpy.savez (float for transitions counted with weights)
+        """
+        return dict(('%s/%s' % (self.model, transition), np.array(self.counts[transition],
+                     dtype=np.float64 if any(isinstance(count, float) for count in self.counts[transition]) else np.int64)) for transition in self.transitions)
+
+    def export(self):
+        """
+        returns dict with the model, the transitions, the per-bin counts and the totals that can be stored as JSON
+        """
+        return {'model': self.model, 'transitions': self.transitions, 'bins': self.bins, 'counts': self.counts, 'totals': self.totals()}
+
+    def save(self, path):
+        """
+        Writes export() to path as JSON.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.export(), f, sort_keys = True)
+
+    def report(self):
+        """
+        returns str with one line per transition: its total and its share of all counted transitions
+        """
+        totals = self.totals()
+        everything = float(max(1, sum(totals.values())))
+        return '\n'.join('%s %-30s %14i %6.2f%%' % (self.model, transition, totals[transition], 100*totals[transition]/everything) for transition in self.transitions)
@@ -0,0 +1,105 @@
+"""
+Static disorder of ensemble runs: every complex of an LHCIIEnsemble or PSIIEnsemble draws its own parameters.
+
+A distribution is given per parameter name, e.g.
+
+    {'absCrossection': ('lognormal', np.log(1.4E-15), 0.2), 'FlYield': ('normal', 0.33, 0.03), 'TripletLifetime': 9E-6}
+
+as one of
+    number: the same value for every complex
+    (name, arguments...): a draw of numpy's RandomState, e.g. ('normal', mean, sd), ('uniform', low, high),
+        ('lognormal', mean, sigma) or ('gamma', shape, scale); a list works as well, so JSON experiment files can use it
+    array of length numComplexes: the values of the complexes as they are
+    callable: function(generator, size) returning the values
+
+The drawn values are held as per-complex arrays in the attributes of the ensemble. The vectorized update of the
+ensembles compares its random draws against these arrays instead of scalars, so a disordered run costs as much
+as a homogeneous one.
+"""
+import numpy as np
+from fitting import parameterBounds
+
+
+def isDistribution(specification):
+    """
+    returns True if specification is a (name, arguments...) draw of numpy's RandomState
+    """
+    return isinstance(specification, (tuple, list)) and len(specification) > 0 and isinstance(specification[0], basestring)
+
+def drawValues(name, specification, size, generator, maxRedraws = 100):
+    """
+    Draws the values of one parameter for size complexes. Values outside the physical limits of the parameter
+    (see fitting.parameterBounds) are drawn again, so e.g. a normal distribution of a yield is truncated to 0 - 1.
+
+    returns float array of length size
+    """
+    if isDistribution(specification):
+        draw = lambda n: getattr(generator, specification[0])(*specification[1:], size = n)
+    elif callable(specification):
+        draw = lambda n: specification(generator, n)
+    else:
+        values = np.asarray(specification, dtype = float)
+        if values.ndim == 0:
+            values = np.repeat(values, size)
+        elif values.shape != (size,):
+            raise ValueError('%s has %i values for %i complexes' % (name, len(values), size))
+        draw = None
+    if draw is not None:
+        values = np.asarray(draw(size), dtype = float)
+    lower, upper = parameterBounds([name])[name]
+    for attempt in range(maxRedraws + 1):
+        outside = values < lower if upper is None else (values < lower) | (values > upper)
+        if not outside.any():
+            return values
+        if draw is None or attempt == maxRedraws:
+            break
+        values[outside] = draw(np.count_nonzero(outside))
+    raise ValueError('%s has values outside the limits %s' % (name, (lower, upper)))
+
+def drawParameters(distributions, size, rng):
+    """
+    Draws the parameters of size complexes.
+
+    Input:
+        distributions: dict with a distribution (see above) for every parameter name
+        size: int representing the number of complexes
+        rng: randomsource.RandomSource or numpy RandomState the values are drawn from
+
+    returns dict with a float array of length size for every parameter name
+    """
+    generator = getattr(rng, 'generator', rng)
+    return dict((name, drawValues(name, distributions[name], size, generator)) for name in sorted(distributions))
+
+def applyDisorder(ensemble, distributions):
+    """
+    Draws the parameters of every complex of an ensemble from its random source and sets them with
+    ensemble.setParameters, so the probabilities that depend on them become per-complex arrays as well.
+
+    returns dict with the drawn per-complex arrays, also kept as ensemble.disorder
+    """
+    drawn = drawParameters(distributions, ensemble.numComplexes, ensemble.rng)
+    ensemble.setParameters(drawn)
+    ensemble.disorder = drawn
+    return drawn
+
+def parameterBins(values, edges):
+    """
+    Bin of the parameter value of every complex for the bin edges, complexes outside the edges get the
+    overflow bin len(edges)-1, which is left out of the breakdowns.
+
+    returns int array with the bin of every complex and the number of bins
+    """
+    edges = np.asarray(edges, dtype = float)
+    bins = len(edges) - 1
+    index = np.searchsorted(edges, values, side = 'right') - 1
+    index[values == edges[-1]] = bins - 1 #the last bin includes its right edge
+    index[(index < 0) | (index >= bins)] = bins
+    return index, bins
+
+def binSums(perComplex, index, bins):
+    """
+    Sums a per-complex quantity over the complexes of every parameter bin.
+
+    returns float array of length bins
+    """
+    return np.bincount(index, weights = perComplex, minlength = bins + 1)[:bins]
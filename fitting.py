@@ -0,0 +1,152 @@
+import numpy as np
+
+
+def chiSquare(data, model, errors = None, scale = False):
+    """
+    Weighted sum of squared residuals between measured and simulated data, e.g. an AOM trace and a simulated
+    fluorescence histogram.
+
+    Input:
+        data: array with the measured values
+        model: array with the simulated values, same shape as data
+        errors: array or float with the standard deviation of the data (1 if None)
+        scale: bool, True to multiply model by the amplitude that fits data best (for data in arbitrary units)
+
+    returns the chi square and the amplitude (1 without scale)
+    """
+    data = np.asarray(data, dtype = float)
+    model = np.asarray(model, dtype = float)
+    weights = np.ones_like(data) if errors is None else 1/np.asarray(errors, dtype = float)**2*np.ones_like(data)
+    amplitude = 1.0
+    if scale:
+        norm = np.sum(weights*model*model)
+        amplitude = np.sum(weights*data*model)/norm if norm > 0 else 0.0
+    return float(np.sum(weights*(data - amplitude*model)**2)), amplitude
+
+def quadraticDesign(dimensions):
+    """
+    Design of a quadratic fit in coordinates scaled to the step sizes: the center, +-1 along every axis
+    and (+1,+1) and (-1,-1) in every pair of axes.
+
+    returns array of shape (points, dimensions)
+    """
+    design = [np.zeros(dimensions)]
+    for i in range(dimensions):
+        for sign in (1, -1):
+            point = np.zeros(dimensions)
+            point[i] = sign
+            design.append(point)
+    for i in range(dimensions):
+        for j in range(i + 1, dimensions):
+            for sign in (1, -1):
+                point = np.zeros(dimensions)
+                point[i] = point[j] = sign
+                design.append(point)
+    return np.asarray(design)
+
+def fitQuadratic(design, values):
+    """
+    Least squares fit of value = c + g.u + u.H.u/2 to the values at the design points u.
+
+    returns c, the gradient g and the Hessian H
+    """
+    points, dimensions = design.shape
+    pairs = [(i, j) for i in range(dimensions) for j in range(i, dimensions)]
+    features = np.hstack([np.ones((points, 1)), design, np.asarray([[u[i]*u[j] for i, j in pairs] for u in design])])
+    coefficients = np.linalg.lstsq(features, values, rcond = None)[0]
+    hessian = np.zeros((dimensions, dimensions))
+    for (i, j), coefficient in zip(pairs, coefficients[1 + dimensions:]):
+        if i == j:
+            hessian[i, i] = 2*coefficient
+        else:
+            hessian[i, j] = hessian[j, i] = coefficient
+    return coefficients[0], coefficients[1:1 + dimensions], hessian
+
+def fitParameters(evaluate, start, steps, bounds = None, iterations = 10, shrink = 0.5, tolerance = 1E-3, degreesOfFreedom = None):
+    """
+    Minimizes a noisy objective, e.g. the chi square of a simulation, by a sequence of quadratic response surfaces.
+    Every iteration evaluates all points of quadraticDesign around the current center in one batch (which the
+    objective can spread over a process pool), fits a quadratic to them and moves to its minimum, at most two steps
+    away. When the minimum lies within the design, or the move did not improve on the best point of the previous
+    design (the quadratic did not describe the objective), the steps shrink by shrink. When the quadratic has no
+    minimum the fit moves to the best point of the design, and if that is the center (the differences are drowned
+    in noise) the steps grow again. The objective should draw the same
+    random numbers for every candidate (common random numbers, see sweep.runSweep) so that the differences between
+    the candidates are smooth in the parameters. The uncertainties follow from the curvature of the quadratic:
+    the covariance is twice the inverse Hessian of the chi square, scaled by chi square/degreesOfFreedom if given
+    (for data without known errors). Shrinking the steps below the uncertainties gains nothing, so the fit has also
+    converged when the minimum is enclosed by steps smaller than the errors.
+
+    Input:
+        evaluate: function taking a list of candidates (dicts of parameter names and values), returns the list of
+            their objective values
+        start: dict with the initial value of every parameter
+        steps: dict with the initial step size of every parameter
+        bounds: dict with (lower, upper) limits of some parameters (None for no limit)
+        iterations: int, maximal number of iterations
+        shrink: float, factor reducing the steps once the minimum is enclosed
+        tolerance: float, the fit has converged when the minimum is enclosed and the predicted decrease of the
+            objective is below tolerance times its value
+        degreesOfFreedom: int, number of data points minus fitted parameters, None if the chi square uses the errors of the data
+
+    returns dict with the best parameters, their errors (standard deviation, nan if the objective had no minimum)
+    and covariance, the objective at the best parameters (predicted by the quadratic), and evaluations, iterations,
+    converged and history (center and objective of every iteration)
+    """
+    if iterations < 1:
+        raise ValueError('the fit needs at least one iteration, not %r' % iterations)
+    names = sorted(start)
+    center = np.asarray([float(start[name]) for name in names])
+    step = np.asarray([abs(float(steps[name])) for name in names])
+    lower = np.asarray([-np.inf if bounds is None or name not in bounds or bounds[name][0] is None else bounds[name][0] for name in names], dtype = float)
+    upper = np.asarray([np.inf if bounds is None or name not in bounds or bounds[name][1] is None else bounds[name][1] for name in names], dtype = float)
+    design = quadraticDesign(len(names))
+    covariance = np.full((len(names), len(names)), np.nan)
+    history = []
+    evaluations = 0
+    converged = False
+    previous = np.inf
+    for iteration in range(iterations):
+        step = np.minimum(step, (upper - lower)/2.0)
+        origin = np.clip(center, lower + step, upper - step) #the design stays within the bounds
+        candidates = [dict(zip(names, origin + step*u)) for u in design]
+        values = np.asarray(evaluate(candidates), dtype = float)
+        evaluations += len(candidates)
+        constant, gradient, hessian = fitQuadratic(design, values)
+        history.append((dict(zip(names, origin)), values[0]))
+        if values[0] > previous:
+            step = step*shrink
+        previous = min(values)
+        if np.all(np.linalg.eigvalsh(hessian) > 0):
+            minimum = -np.linalg.solve(hessian, gradient)
+            enclosed = np.all(np.abs(minimum) <= 1)
+            minimum = np.clip(minimum, -2, 2)
+            predicted = constant + gradient.dot(minimum) + minimum.dot(hessian).dot(minimum)/2
+            covariance = 2*np.linalg.inv(hessian)*np.outer(step, step)
+            if degreesOfFreedom is not None:
+                covariance *= max(predicted, 0)/max(degreesOfFreedom, 1)
+            center = np.clip(origin + step*minimum, lower, upper)
+        else:
+            enclosed = False
+            predicted = min(values)
+            center = origin + step*design[np.argmin(values)]
+            if np.argmin(values) == 0:
+                step = step/shrink
+        if enclosed:
+            if min(values) - predicted <= tolerance*abs(predicted) or np.all(step <= np.sqrt(np.diag(covariance))):
+                converged = True
+                break
+            step = step*shrink
+    return {'parameters': dict(zip(names, center)), 'errors': dict(zip(names, np.sqrt(np.abs(np.diag(covariance))))),
+            'covariance': covariance, 'names': names, 'objective': predicted, 'evaluations': evaluations,
+            'iterations': iteration + 1, 'converged': converged, 'history': history}
+
+def parameterBounds(names):
+    """
+    Physical limits of model parameters: yields and probabilities (names containing Yield, starting with probability
+    or ending with Decay) lie between 0 and 1, all other parameters (lifetimes, cross sections) are positive.
+
+    returns dict with (lower, upper) of every name
+    """
+    bounded = lambda name: 'Yield' in name or name.startswith('probability') or name.endswith('Decay')
+    return dict((name, (0.0, 1.0) if bounded(name) else (0.0, None)) for name in names)
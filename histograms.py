@@ -0,0 +1,153 @@
+import numpy as np
+
+
+class StepRecorder(object):
+    """
+    Per-timestep recording of pulsed (AOM) simulations, binned in bulk
+    """
+
+    def __init__(self, steps, timestep, valueChannels = (), eventChannels = (), weightedChannels = ()):
+        """
+
+        Initialize a StepRecorder instance with preallocated buffers for one pulse.
+
+        Input:
+            steps: int representing the number of timesteps in one pulse
+            timestep: float, length of a timestep in seconds
+            valueChannels: names of quantities that are recorded every timestep by assignment,
+                values[channel][num] = value (e.g. triplet populations or per-step counts of an ensemble)
+            eventChannels: names of rare events that are recorded by appending the timestep number,
+                events[channel].append(num) (e.g. fluoresced photons of a single complex)
+            weightedChannels: names of rare events that carry a statistical weight, recorded by appending the
+                timestep number to events[channel] and the weight to weights[channel] (e.g. the expected
+                emission of a triplet-quenched decay in the weighted AOM simulations)
+
+        totals: dict with an int array per channel (float for the weighted channels), summed over all finished pulses per timestep
+        pulses: int representing the number of finished pulses
+        """
+        self.steps = steps
+        self.timestep = timestep
+        self.valueChannels = list(valueChannels)
+        self.eventChannels = list(eventChannels)
+        self.values = dict((channel, [0]*steps) for channel in self.valueChannels)
+        self.weightedChannels = list(weightedChannels)
+        self.events = dict((channel, []) for channel in self.eventChannels + self.weightedChannels)
+        self.weights = dict((channel, []) for channel in self.weightedChannels)
+        self.totals = dict((channel, np.zeros(steps, dtype=np.int64)) for channel in self.valueChannels + self.eventChannels)
+        self.totals.update((channel, np.zeros(steps)) for channel in self.weightedChannels)
+        self.pulses = 0
+
+    def endPulse(self):
+        """
+        Adds the buffers of the finished pulse to the totals in bulk and empties the event buffers in place,
+        so references to the buffers stay valid. The value buffers are overwritten during the next pulse.
+        """
+        for channel in self.valueChannels:
+            self.totals[channel] += self.values[channel]
+        for channel in self.eventChannels:
+            if self.events[channel]:
+                self.totals[channel] += np.bincount(self.events[channel], minlength=self.steps)
+                del self.events[channel][:]
+        for channel in self.weightedChannels:
+            if self.events[channel]:
+                self.totals[channel] += np.bincount(self.events[channel], weights=self.weights[channel], minlength=self.steps)
+                del self.events[channel][:]
+                del self.weights[channel][:]
+        self.pulses += 1
+
+    def binIndices(self, binning, duration = None):
+        """
+        Bin of every timestep for bins of width binning, using the same rule as simulationAOM:
+        int(num*timestep/duration*num_bins) with num_bins = int(duration/binning).
+
+        returns int array of length steps and the number of bins
+        """
+        if duration is None:
+            duration = self.steps*self.timestep
+        num_bins = int(duration/binning)
+        return np.minimum((np.arange(self.steps)*self.timestep/duration*num_bins).astype(int), num_bins-1), num_bins
+
+    def histogram(self, channel, binning, duration = None):
+        """
+        Bins the totals of a channel; the bin width can be chosen freely after the run.
+
+        Input:
+            channel: str, name of a value or event channel
+            binning: float, bin width in seconds (at least one timestep)
+            duration: float, length of the pulse in seconds (steps*timestep if None)
+
+        returns int array with the per-bin sums (float array for a weighted channel)
+        """
+        bins, num_bins = self.binIndices(binning, duration)
+        return np.bincount(bins, weights=self.totals[channel], minlength=num_bins).astype(self.totals[channel].dtype)
+
+
+class IntervalRecorder(object):
+    """
+    Binned recording of continuous-time simulations, whose observables are given per time interval
+    """
+
+    def __init__(self, duration, binning, channels):
+        """
+
+        Initialize an IntervalRecorder instance for a window of duration seconds, with bins as in
+        StepRecorder.binIndices: num_bins = int(duration/binning) bins of equal width.
+
+        Input:
+            duration: float, length of the recorded window in seconds
+            binning: float, bin width in seconds
+            channels: names of the recorded quantities
+
+        totals: dict with a float array of the per-bin sums of every channel
+        """
+        self.duration = duration
+        self.num_bins = int(duration/binning)
+        self.width = duration/float(self.num_bins)
+        self.edges = np.arange(self.num_bins + 1)*self.width
+        self.totals = dict((channel, np.zeros(self.num_bins)) for channel in channels)
+
+    def binOf(self, time):
+        """
+        returns the bin of a time in the window
+        """
+        return min(int(time/self.width), self.num_bins - 1)
+
+    def addRates(self, start, end, rates):
+        """
+        Adds rate*(time the interval [start, end) spends in a bin) to every bin, for every channel in the dict rates,
+        e.g. an expected photon count or the time integral of a triplet population.
+        """
+        first = self.binOf(start)
+        last = self.binOf(end)
+        if first == last:
+            for channel, rate in rates.items():
+                self.totals[channel][first] += rate*(end - start)
+            return
+        overlap = np.clip(np.minimum(self.edges[first+1:last+2], end) - np.maximum(self.edges[first:last+1], start), 0, None)
+        for channel, rate in rates.items():
+            self.totals[channel][first:last+1] += rate*overlap
+
+    def addEvent(self, channel, time, number = 1):
+        """
+        Adds number events (or the weight of an event) at time.
+        """
+        self.totals[channel][self.binOf(time)] += number
+
+    def addPoissonEvents(self, channels, start, end, rate, rng):
+        """
+        Draws the events of a Poisson process with rate during [start, end) and adds them to every channel in channels.
+
+        returns the number of events
+        """
+        number = rng.poisson(rate*(end - start)) if rate > 0 else 0
+        if number == 0:
+            return 0
+        if self.binOf(start) == self.binOf(end):
+            for channel in channels:
+                self.totals[channel][self.binOf(start)] += number
+            return number
+        times = start + (end - start)*rng.random_sample(number)
+        counts = np.bincount(np.minimum((times/self.width).astype(int), self.num_bins - 1), minlength=self.num_bins)
+        for channel in channels:
+            self.totals[channel] += counts
+        return number
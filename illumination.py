@@ -0,0 +1,95 @@
+class Protocol(object):
+    """
+    Illumination protocol: a piecewise constant intensity waveform made of segments
+    """
+
+    def __init__(self, segments = ()):
+        """
+
+        Initialize a Protocol instance. The methods that add segments return the protocol, so waveforms can be
+        chained, e.g. Protocol().add(0.8E-3, 500).dark(10E-3) is one AOM period.
+
+        Input:
+            segments: list of (duration, intensity) or (duration, intensity, record) as read from JSON
+
+        segments: list of [duration in seconds, intensity in W/cm^2, record] lists; the observables are only
+            recorded during segments with record True, and segments that are not recorded are propagated in
+            one draw by the simulations (see propagateDark and propagateLight of the models)
+        """
+        self.segments = []
+        for segment in segments:
+            self.add(*segment)
+
+    def add(self, duration, intensity, record = True):
+        """
+        Appends a segment of constant intensity (0 for darkness).
+        """
+        if duration < 0 or intensity < 0:
+            raise ValueError('a segment needs a duration and an intensity >= 0, not %r and %r' % (duration, intensity))
+        self.segments.append([float(duration), float(intensity), bool(record)])
+        return self
+
+    def dark(self, duration, record = False):
+        """
+        Appends a dark segment, which is not recorded by default.
+        """
+        return self.add(duration, 0.0, record)
+
+    def levels(self, duration, intensities, record = True):
+        """
+        Appends one segment of duration seconds for every intensity, e.g. a multi-level step protocol.
+        """
+        for intensity in intensities:
+            self.add(duration, intensity, record)
+        return self
+
+    def ramp(self, duration, start, end, levels = 10, record = True):
+        """
+        Appends a linear ramp from intensity start to end as levels steps of equal duration, each at the intensity
+        of the middle of its step.
+        """
+        return self.levels(duration/float(levels), [start + (end - start)*(level + 0.5)/levels for level in range(levels)], record)
+
+    def pulseTrain(self, pulses, onTime, offTime, intensity, record = True):
+        """
+        Appends pulses AOM periods: onTime seconds at intensity followed by offTime seconds of darkness.
+        """
+        for pulse in range(pulses):
+            self.add(onTime, intensity, record)
+            self.dark(offTime)
+        return self
+
+    def duration(self):
+        """
+        returns the total duration of the protocol in seconds
+        """
+        return sum(duration for duration, intensity, record in self.segments)
+
+    def timeline(self, timestep):
+        """
+        Converts the segments to timesteps of the model.
+
+        returns list with (steps, intensity, offset) of every segment, where offset is the index of the first
+        timestep of the segment in the recorded timeline (None for segments that are not recorded),
+        and the number of recorded timesteps
+        """
+        timeline = []
+        recorded = 0
+        for duration, intensity, record in self.segments:
+            steps = int(round(duration/timestep))
+            timeline.append((steps, intensity, recorded if record else None))
+            if record:
+                recorded += steps
+        return timeline, recorded
+
+    def export(self):
+        """
+        returns list with the segments that can be stored as JSON and passed to Protocol again
+        """
+        return [list(segment) for segment in self.segments]
+
+def AOMProtocol(onTime, offTime, intensity):
+    """
+    returns Protocol of one AOM period as in simulationAOM: onTime seconds recorded at intensity, then offTime seconds of darkness
+    """
+    return Protocol().add(onTime, intensity).dark(offTime)
@@ -0,0 +1,74 @@
+"""
+Sparse neighbour lists of connected complexes, e.g. the LHCII trimers of a membrane patch.
+
+The neighbours are kept as a padded table: row i holds the indices of the neighbours of complex i, left aligned,
+followed by -1 up to the largest number of neighbours. A complex only looks up its own row, so stepping the few
+excited complexes of a network of 10^5 - 10^6 complexes costs time in proportion to the excited complexes and
+their neighbours, not to the size of the network.
+"""
+import numpy as np
+
+
+def fromEdges(edges, numComplexes):
+    """
+    Neighbour table of an arbitrary graph.
+
+    Input:
+        edges: array of shape (number of edges, 2) with the indices of the connected pairs, every pair is connected
+            in both directions (repeated pairs and self loops are dropped)
+        numComplexes: int representing the number of complexes
+
+    returns int32 array of shape (numComplexes, largest number of neighbours), padded with -1
+    """
+    edges = np.asarray(edges, dtype = np.int64).reshape(-1, 2)
+    if len(edges) and (edges.min() < 0 or edges.max() >= numComplexes):
+        raise ValueError('edges connect complexes outside 0 - %i' % (numComplexes - 1))
+    pairs = np.concatenate([edges, edges[:, ::-1]])
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    pairs = np.unique(pairs[:, 0]*numComplexes + pairs[:, 1]) #sorted by complex, then neighbour
+    complexes, others = pairs//numComplexes, pairs % numComplexes
+    degree = np.bincount(complexes, minlength = numComplexes)
+    starts = np.cumsum(degree) - degree
+    neighbours = -np.ones((numComplexes, int(degree.max()) if numComplexes else 0), dtype = np.int32)
+    neighbours[complexes, np.arange(len(pairs)) - starts[complexes]] = others
+    return neighbours
+
+def squareLattice(rows, columns, periodic = True):
+    """
+    Neighbour table of a rows x columns square lattice, complex r*columns+c sits in row r and column c.
+    With periodic the lattice wraps around at the edges (a torus), so every complex has four neighbours.
+
+    returns int32 array of shape (rows*columns, 4), padded with -1 at the edges of a non-periodic lattice
+    """
+    if periodic and min(rows, columns) < 3:
+        raise ValueError('a periodic lattice needs at least 3 rows and columns')
+    index = np.arange(rows*columns).reshape(rows, columns)
+    if periodic:
+        return np.stack([np.roll(index, 1, 0), np.roll(index, -1, 0), np.roll(index, 1, 1), np.roll(index, -1, 1)], axis = -1).reshape(-1, 4).astype(np.int32)
+    edges = np.concatenate([np.column_stack([index[:-1].ravel(), index[1:].ravel()]),
+                            np.column_stack([index[:, :-1].ravel(), index[:, 1:].ravel()])])
+    return fromEdges(edges, rows*columns)
+
+def triangularLattice(rows, columns, periodic = True):
+    """
+    Neighbour table of a rows x columns triangular (hexagonally packed) lattice, as for trimers packed in a
+    membrane, every complex has six neighbours: the four of the square lattice and the two along one diagonal.
+
+    returns int32 array of shape (rows*columns, 6), padded with -1 at the edges of a non-periodic lattice
+    """
+    if periodic and min(rows, columns) < 3:
+        raise ValueError('a periodic lattice needs at least 3 rows and columns')
+    index = np.arange(rows*columns).reshape(rows, columns)
+    if periodic:
+        shifts = [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (-1, -1)]
+        return np.stack([np.roll(np.roll(index, r, 0), c, 1) for r, c in shifts], axis = -1).reshape(-1, 6).astype(np.int32)
+    edges = np.concatenate([np.column_stack([index[:-1].ravel(), index[1:].ravel()]),
+                            np.column_stack([index[:, :-1].ravel(), index[:, 1:].ravel()]),
+                            np.column_stack([index[:-1, :-1].ravel(), index[1:, 1:].ravel()])])
+    return fromEdges(edges, rows*columns)
+
+def degrees(neighbours):
+    """
+    returns int array with the number of neighbours of every complex
+    """
+    return np.count_nonzero(neighbours >= 0, axis = 1)
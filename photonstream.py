@@ -0,0 +1,210 @@
+import json
+import os
+import struct
+import numpy as np
+
+MAGIC = b'TTPHOTON'
+VERSION = 1
+HEADERALIGNMENT = 64
+
+#one record per fluoresced photon, like a TTTR record of a photon counting card
+RECORD = np.dtype([('trial', '<u4'), ('time', '<f8'), ('flags', 'u1')])
+
+#flags of a record
+TRIPLET = 1 #emitted while a (car or Chl) triplet was present
+CHLTRIPLET = 2 #emitted while a Chl triplet was present
+CARTRIPLET = 4 #emitted while a car triplet was present
+
+
+def writeHeader(f, metadata):
+    """
+    Writes the self-describing header of a photon stream file: magic, version, the length of the
+    JSON metadata, the metadata itself, padded so that the records start at a multiple of HEADERALIGNMENT bytes.
+    """
+    text = json.dumps(metadata, sort_keys=True).encode('utf-8')
+    length = len(MAGIC) + 8 + len(text)
+    padding = -length % HEADERALIGNMENT
+    f.write(MAGIC + struct.pack('<II', VERSION, len(text) + padding) + text + b' '*padding)
+
+def readHeader(path):
+    """
+    returns the metadata dict of a photon stream file and the byte offset of its first record
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a photon stream file' % path)
+        version, length = struct.unpack('<II', f.read(8))
+        if version != VERSION:
+            raise ValueError('%s has unsupported photon stream version %i' % (path, version))
+        metadata = json.loads(f.read(length).decode('utf-8'))
+    return metadata, len(MAGIC) + 8 + length
+
+def tripletFlags(ChlTriplet = 0, CarTriplet = 0):
+    """
+    returns the flags of photons emitted with the given Chl and car triplet populations (numbers or arrays)
+    """
+    ChlTriplet = np.asarray(ChlTriplet) >= 1
+    CarTriplet = np.asarray(CarTriplet) >= 1
+    return TRIPLET*(ChlTriplet | CarTriplet) + CHLTRIPLET*ChlTriplet + CARTRIPLET*CarTriplet
+
+
+class PhotonWriter(object):
+    """
+    Append-only writer of time-tagged photons
+    """
+
+    def __init__(self, path, metadata = None, bufferSize = 2**16, append = False):
+        """
+
+        Initialize a PhotonWriter instance. The file gets a header with metadata (e.g. the model, intensity,
+        pulse length and timestep); an existing file is overwritten. With append the records are appended to an
+        existing file instead, e.g. when a run is resumed, which is only allowed if its header has the same metadata.
+
+        Input:
+            path: str, file name
+            metadata: dict that can be stored as JSON
+            bufferSize: int representing the number of records kept in memory before they are written
+            append: boolean, True to continue an existing file
+        """
+        self.path = path
+        self.bufferSize = bufferSize
+        self.buffer = []
+        self.buffered = 0
+        metadata = json.loads(json.dumps(metadata or {}))
+        if append and os.path.exists(path) and os.path.getsize(path) > 0:
+            stored = readHeader(path)[0]
+            if stored != metadata:
+                raise ValueError('%s was written with the metadata %s, not %s' % (path, stored, metadata))
+        else:
+            with open(path, 'wb') as f:
+                writeHeader(f, metadata)
+
+    def append(self, trials, times, flags = 0):
+        """
+        Adds photons to the stream.
+
+        Input:
+            trials: int or int array, trial (pulse) index of every photon
+            times: float or float array, time in the pulse in seconds
+            flags: int or int array, sum of the flags (TRIPLET, CHLTRIPLET, CARTRIPLET) of every photon
+        """
+        trials, times, flags = np.broadcast_arrays(np.atleast_1d(trials), np.atleast_1d(times), np.atleast_1d(flags))
+        records = np.empty(len(times), dtype=RECORD)
+        records['trial'] = trials
+        records['time'] = times
+        records['flags'] = flags
+        self.buffer.append(records)
+        self.buffered += len(records)
+        if self.buffered >= self.bufferSize:
+            self.flush()
+
+    def flush(self):
+        """
+        Appends the buffered records to the file.
+        """
+        if self.buffer:
+            with open(self.path, 'ab') as f:
+                np.concatenate(self.buffer).tofile(f)
+            self.buffer = []
+            self.buffered = 0
+
+    def tell(self):
+        """
+        Writes the buffered records and returns the size of the file in bytes.
+        """
+        self.flush()
+        return os.path.getsize(self.path)
+
+    def truncate(self, size):
+        """
+        Drops everything behind the first size bytes of the file, e.g. the photons written after a checkpoint.
+        """
+        self.buffer = []
+        self.buffered = 0
+        with open(self.path, 'r+b') as f:
+            f.truncate(size)
+
+    def close(self):
+        self.flush()
+
+
+class PhotonStream(object):
+    """
+    Read-only, memory-mapped view on a photon stream file
+    """
+
+    def __init__(self, path):
+        """
+
+        Initialize a PhotonStream instance; the records are not loaded but memory mapped.
+
+        metadata: dict stored in the header
+        records: structured numpy memmap with the fields trial, time and flags
+        """
+        self.path = path
+        self.metadata, offset = readHeader(path)
+        count = (os.path.getsize(path) - offset)//RECORD.itemsize
+        if count:
+            self.records = np.memmap(path, dtype=RECORD, mode='r', offset=offset, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=RECORD)
+
+    def __len__(self):
+        return len(self.records)
+
+    def chunks(self, chunkSize = 2**22):
+        """
+        Yields consecutive slices of the records, so that gigabytes of photons can be analysed piece by piece.
+        """
+        for start in range(0, len(self.records), chunkSize):
+            yield self.records[start:start + chunkSize]
+
+    def select(self, records, start = None, stop = None, flags = None, noflags = None):
+        """
+        Gates a chunk of records on the time in the pulse and on the flags.
+
+        Input:
+            start, stop: float, time window in seconds (None for no limit)
+            flags: int, only photons that have all these flags
+            noflags: int, only photons that have none of these flags
+
+        returns boolean array
+        """
+        selected = np.ones(len(records), dtype=bool)
+        if start is not None:
+            selected &= records['time'] >= start
+        if stop is not None:
+            selected &= records['time'] < stop
+        if flags is not None:
+            selected &= (records['flags'] & flags) == flags
+        if noflags is not None:
+            selected &= (records['flags'] & noflags) == 0
+        return selected
+
+    def histogram(self, binning, duration = None, **gate):
+        """
+        Bins the photons on their time in the pulse, with any bin width and optional gating (see select).
+
+        Input:
+            binning: float, bin width in seconds
+            duration: float, pulse length in seconds (the 'duration' entry of the metadata if None)
+
+        returns int array with the number of photons per bin
+        """
+        if duration is None:
+            duration = self.metadata['duration']
+        num_bins = int(duration/binning)
+        counts = np.zeros(num_bins, dtype=np.int64)
+        for records in self.chunks():
+            times = records['time'][self.select(records, **gate)]
+            bins = np.minimum((times/duration*num_bins).astype(int), num_bins-1)
+            counts += np.bincount(bins, minlength=num_bins)
+        return counts
+
+    def tripletFraction(self, binning, duration = None):
+        """
+        returns the per-bin fraction of photons that were emitted while a triplet was present
+        """
+        total = self.histogram(binning, duration)
+        quenched = self.histogram(binning, duration, flags=TRIPLET)
+        return quenched/np.maximum(total, 1).astype(float)
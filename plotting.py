@@ -0,0 +1,108 @@
+"""
+Fast drawing of large histograms and time series, and headless rendering of stored results.
+
+    python plotting.py results.npz [--output figures.png] [--dpi 100]
+
+Histograms are drawn as steps instead of one bar per bin, and a series with more points than the axes has
+pixels is decimated to the minimum and maximum of every pixel column first, which draws the same image from
+a few thousand points. matplotlib is only imported by the functions that draw.
+"""
+import argparse
+import json
+import numpy as np
+
+
+def decimate(values, pixels):
+    """
+    Reduces a series to the minimum and maximum of every group of consecutive values that falls into one pixel column.
+
+    Input:
+        values: array with the series
+        pixels: int representing the number of pixel columns the series spans
+
+    returns arrays with the index of the first value, the minimum and the maximum of every group, None if the
+    series has no more than two values per pixel and is drawn as it is
+    """
+    values = np.asarray(values, dtype = float)
+    count = len(values)
+    if count <= 2*pixels:
+        return None
+    size = -(-count//pixels)
+    groups = -(-count//size)
+    padded = np.empty(groups*size)
+    padded[:count] = values
+    padded[count:] = values[-1]
+    padded = padded.reshape(groups, size)
+    return np.arange(groups)*size, padded.min(axis = 1), padded.max(axis = 1)
+
+def axesPixels(ax):
+    """
+    returns the width of the axes in pixels (at the dpi of its figure)
+    """
+    return max(int(ax.get_window_extent().width), 1)
+
+def plotHistogram(ax, values, binWidth, offset = 0.0, pixels = None, fill = False, **style):
+    """
+    Draws a histogram as a step line, or with fill as bars without gaps (like plt.bar with width binWidth), decimated
+    to the min/max of every pixel column (see decimate).
+
+    Input:
+        ax: matplotlib axes
+        values: array with the value of every bin
+        binWidth: float, width of a bin in the units of the x axis
+        offset: float, left edge of the first bin
+        pixels: int representing the pixel columns the histogram spans (the width of ax if None)
+        style: keyword arguments of ax.plot or ax.fill_between, e.g. color and label
+
+    returns the drawn matplotlib artist
+    """
+    values = np.asarray(values, dtype = float)
+    reduced = decimate(values, axesPixels(ax) if pixels is None else pixels)
+    if reduced is None:
+        starts, lows, highs = np.arange(len(values)), values, values
+    else:
+        starts, lows, highs = reduced
+    edges = offset + np.append(starts, len(values))*binWidth
+    if fill:
+        return ax.fill_between(edges, 0, np.append(highs, highs[-1]), step = 'post', linewidth = 0, **style)
+    x = np.repeat(edges, 3)[1:-2] #left edge at the minimum and maximum, right edge at the maximum of every group
+    y = np.column_stack([lows, highs, highs]).ravel()
+    return ax.plot(x, y, **style)[0]
+
+def plotSeries(ax, x, values, pixels = None, **style):
+    """
+    Draws a series over evenly spaced x as a line, decimated to the min/max of every pixel column (see decimate).
+
+    returns the drawn matplotlib line
+    """
+    x = np.asarray(x, dtype = float)
+    reduced = decimate(values, axesPixels(ax) if pixels is None else pixels)
+    if reduced is None:
+        return ax.plot(x, values, **style)[0]
+    starts, lows, highs = reduced
+    return ax.plot(np.repeat(x[starts], 2), np.column_stack([lows, highs]).ravel(), **style)[0]
+
+def renderFile(path, output = None, dpi = 100):
+    """
+    Renders the results of runner.py stored in path (an .npz file with the experiment under 'experiment') with
+    the Agg backend, without running anything.
+
+    returns list of the written PNG files (output or path with the extension replaced by .figure<number>.png)
+    """
+    from runner import plotExperiment
+    with np.load(path) as data:
+        results = dict((name, data[name]) for name in data.files)
+    experiment = json.loads(str(results.pop('experiment')))
+    return plotExperiment(experiment, results, output or path, dpi)
+
+def main(arguments = None):
+    parser = argparse.ArgumentParser(description = 'Renders the figures of stored simulation results without a display.')
+    parser.add_argument('results', help = 'npz file written by runner.py')
+    parser.add_argument('--output', '-o', help = 'base name of the PNG files (default: the results file)')
+    parser.add_argument('--dpi', type = int, default = 100, help = 'resolution of the figures')
+    options = parser.parse_args(arguments)
+    for fileName in renderFile(options.results, options.output, options.dpi):
+        print 'Figure written to %s' % fileName
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import random
+import numpy as np
+
+
+class RandomSource(object):
+    """
+    Explicitly seeded source of random numbers for the simulations
+    """
+
+    def __init__(self, seed = None, blockSize = 2**20):
+        """
+
+        Initialize a RandomSource instance.
+
+        Input:
+            seed: int or None, seeds both generators of the source (None seeds from the operating system)
+            blockSize: int representing the number of uniform numbers that are pre-generated at once for the bulk draws
+
+        The scalar draws (random, expovariate) of the per-step classes go to a random.Random instance, whose C-level
+        random() is cheaper per call than handing out single values from a NumPy array. The bulk draws of the ensemble
+        classes (random_sample) are served as slices of pre-generated NumPy blocks, the other array draws
+        (binomial, multinomial, ...) go directly to a numpy RandomState.
+        """
+        self.seed = seed
+        self.blockSize = blockSize
+        self.scalar = random.Random(seed)
+        self.generator = np.random.RandomState(None if seed is None else [seed, 1])
+        self.bindDraws()
+        self.block = np.zeros(0)
+        self.position = 0
+
+    def bindDraws(self):
+        """
+        Binds the draw methods of the generators to the source, which saves an attribute lookup per draw.
+        """
+        self.random = self.scalar.random
+        self.expovariate = self.scalar.expovariate
+        self.binomial = self.generator.binomial
+        self.multinomial = self.generator.multinomial
+        self.poisson = self.generator.poisson
+        self.exponential = self.generator.exponential
+
+    def __getstate__(self):
+        """
+        The complete state of the source (both generators and the unused rest of the current block),
+        so that a pickled source continues with exactly the same numbers.
+        """
+        return {'seed': self.seed, 'blockSize': self.blockSize, 'scalar': self.scalar.getstate(),
+                'generator': self.generator.get_state(), 'block': self.block[self.position:]}
+
+    def __setstate__(self, state):
+        self.seed = state['seed']
+        self.blockSize = state['blockSize']
+        self.scalar = random.Random()
+        self.scalar.setstate(state['scalar'])
+        self.generator = np.random.RandomState()
+        self.generator.set_state(state['generator'])
+        self.block = state['block']
+        self.position = 0
+        self.bindDraws()
+
+    def refill(self):
+        """
+        Pre-generates a new block of uniform random numbers (the first block is generated at the first bulk draw).
+        """
+        self.block = self.generator.random_sample(self.blockSize)
+        self.position = 0
+
+    def random_sample(self, size = None):
+        """
+        Uniform random numbers in [0, 1), with the same interface as numpy's RandomState.random_sample.
+        The values are a read-only view on the current block, the rest of a block that is too short is skipped.
+
+        returns float or array of shape size
+        """
+        if size is None:
+            return self.random()
+        n = int(np.prod(size))
+        if n > self.blockSize:
+            return self.generator.random_sample(size)
+        if self.position + n > len(self.block):
+            self.refill()
+        values = self.block[self.position:self.position + n]
+        values.flags.writeable = False
+        self.position += n
+        return values.reshape(size)
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import pickle
+from checkpoint import saveCheckpoint, loadCheckpoint
+
+
+def modelParameters(model):
+    """
+    Collects the parameters of a model instance (e.g. LHCII or PSII): its class name and all number, string
+    and bool attributes, i.e. rate constants, yields, lifetimes, timestep and initial state.
+
+    returns dict that can be part of a cache key
+    """
+    parameters = dict((name, value) for name, value in vars(model).items() if isinstance(value, (bool, int, long, float, str)))
+    parameters['class'] = type(model).__name__
+    return parameters
+
+def functionName(function):
+    """
+    returns str with the module and the name of a function, e.g. 'LHCIIannihilation.simulationAOM', so that
+    functions of the same name in different models get different cache keys
+    """
+    return '%s.%s' % (function.__module__, function.__name__)
+
+def cacheKey(identity):
+    """
+    Content address of a result: the SHA-1 of the canonical JSON form of identity, a dict with everything
+    the result depends on (model parameters, simulation function, arguments, seed, ...).
+
+    returns str of 40 hexadecimal digits
+    """
+    text = json.dumps(identity, sort_keys=True, default=repr)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class ResultCache(object):
+    """
+    Persistent, size-bounded cache of simulation results, one pickle file per result
+    """
+
+    def __init__(self, directory, maxBytes = 2**30):
+        """
+
+        Initialize a ResultCache instance, the directory is created if needed.
+
+        Input:
+            directory: str, directory holding the cached results
+            maxBytes: int, size limit of the cache; the least recently used results are removed above it
+
+        An entry is a dict with the keys identity, trials (the number of trials behind the result),
+        batches (the number of trial batches, i.e. random streams, used so far) and result.
+        """
+        self.directory = directory
+        self.maxBytes = maxBytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key):
+        """
+        returns the entry stored under key and marks it as recently used, None if there is none
+        """
+        path = self.path(key)
+        try:
+            entry = loadCheckpoint(path)
+        except (EOFError, ValueError, IndexError, KeyError, pickle.UnpicklingError):
+            entry = None #a damaged file is treated as missing and overwritten
+        if entry is not None:
+            os.utime(path, None)
+        return entry
+
+    def put(self, key, entry):
+        """
+        Stores entry under key (atomically, see checkpoint.saveCheckpoint) and evicts old entries if the cache is too big.
+        """
+        saveCheckpoint(self.path(key), entry)
+        self.evict(keep = key)
+
+    def entries(self):
+        """
+        returns list of (last use, size, key) of all cached results, least recently used first
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                status = os.stat(os.path.join(self.directory, name))
+                entries.append((status.st_mtime, status.st_size, name[:-len('.pkl')]))
+        return sorted(entries)
+
+    def evict(self, keep = None):
+        """
+        Removes the least recently used results until the cache fits into maxBytes; keep is never removed.
+        """
+        entries = self.entries()
+        total = sum(size for used, size, key in entries)
+        for used, size, key in entries:
+            if total <= self.maxBytes:
+                break
+            if key != keep:
+                os.remove(self.path(key))
+                total -= size
+
+    def clear(self):
+        """
+        Removes all cached results, e.g. after the model code has changed.
+        """
+        for used, size, key in self.entries():
+            os.remove(self.path(key))
@@ -0,0 +1,196 @@
+"""
+Headless runner of the simulation experiments.
+
+    python runner.py experiment.json [--output results.npz] [--plot] [--set name=value ...]
+
+The experiment file is JSON, e.g.
+
+    {"model": "LHCII", "experiment": "saturation",
+     "parameters": {"intensities": [10, 30, 50, 100], "repetitions": 1000000, "processes": 4},
+     "output": "saturation.npz"}
+
+model is LHCII, PSII or leaf; experiment is saturation, adaptiveSaturation, AOM or protocol for LHCII and PSII
+and lightDependency for the leaf. The parameters are the keyword arguments of saturationCurve,
+saturationCurveAdaptive, AOMCurves, simulationProtocol or lightDependency; the protocol is given as its
+list of [duration, intensity, record] segments (see illumination.Protocol).
+The numeric results are written to an .npz file, together with the experiment as JSON under 'experiment'.
+matplotlib is only imported with --plot, then the figures are saved as PNG files next to the results.
+"""
+import argparse
+import imp
+import json
+import os
+import sys
+import numpy as np
+
+MODELS = {'LHCII': 'LHCII annihilation.py', 'PSII': 'PSII kinetics.py', 'leaf': 'FluorescencePSIIsLayersLeafSimulated.py'}
+
+#names of the histograms returned by AOMCurves for every pulse
+AOMCHANNELS = {'LHCII': ['fluorescence'], 'PSII': ['fluorescence', 'ChlTriplet', 'CarTriplet', 'Absorbed', 'Annihilation']}
+
+#names of the histograms returned by simulationProtocol
+PROTOCOLCHANNELS = {'LHCII': ['fluorescence', 'triplet', 'Annihilation'], 'PSII': ['fluorescence', 'ChlTriplet', 'CarTriplet', 'Absorbed', 'Annihilation']}
+
+
+def loadModel(model):
+    """
+    Imports the simulation script of model once; the scripts only define the simulation, importing them
+    runs nothing and does not import matplotlib.
+
+    returns module
+    """
+    name = model.lower()
+    if name not in sys.modules:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        if directory not in sys.path:
+            sys.path.insert(0, directory)
+        imp.load_source(name, os.path.join(directory, MODELS[model]))
+    return sys.modules[name]
+
+def runSaturation(module, parameters):
+    """
+    returns dict with the intensities, the fluorescence rates and the average triplet populations
+    """
+    Fl, Tr = module.saturationCurve(**parameters)
+    return {'intensities': np.asarray(parameters['intensities']), 'fluorescence': np.asarray(Fl), 'triplets': np.asarray(Tr)}
+
+def runAdaptiveSaturation(module, parameters):
+    """
+    returns dict with the intensities, the fluorescence rates and average triplet populations with their
+    confidence intervals (arrays of shape (intensities, 2)), the repetitions and whether each point converged
+    """
+    Fl, Tr, estimates = module.saturationCurveAdaptive(**parameters)
+    triplets = [name for name, value in estimates[0].items() if isinstance(value, dict) and name != 'fluorescence']
+    results = {'intensities': np.asarray(parameters['intensities']), 'fluorescence': np.asarray(Fl),
+               'fluorescenceInterval': np.array([estimate['fluorescence']['interval'] for estimate in estimates]),
+               'repetitions': np.array([estimate['repetitions'] for estimate in estimates]),
+               'converged': np.array([estimate['converged'] for estimate in estimates])}
+    for name in triplets:
+        results[name] = np.array([estimate[name]['mean'] for estimate in estimates])
+        results[name + 'Interval'] = np.array([estimate[name]['interval'] for estimate in estimates])
+    return results
+
+def runAOM(module, parameters, channels):
+    """
+    returns dict with one array of shape (pulse settings, bins) per channel
+    """
+    curves = module.AOMCurves(**parameters)
+    if len(channels) == 1:
+        return {channels[0]: np.array(curves)}
+    return dict((channel, np.array([curve[i] for curve in curves])) for i, channel in enumerate(channels))
+
+def runProtocol(module, parameters, channels):
+    """
+    returns dict with one histogram over the recorded timeline per channel
+    """
+    return dict(zip(channels, module.simulationProtocol(**parameters)))
+
+def runLightDependency(module, parameters):
+    """
+    returns dict with the photon fluxes and the summed fluorescence per timestep for every photon flux
+    """
+    results = module.lightDependency(**parameters)
+    return {'photonFlux': np.asarray(parameters['photonFluxList']), 'trialsSum': np.array(results)}
+
+def runExperiment(experiment):
+    """
+    Runs one experiment (a dict with the keys model, experiment and parameters, see the module docstring).
+
+    returns dict with the numeric results
+    """
+    model = experiment['model']
+    if model not in MODELS:
+        raise ValueError('unknown model %s, expected one of %s' % (model, sorted(MODELS)))
+    module = loadModel(model)
+    parameters = dict((str(name), value) for name, value in experiment.get('parameters', {}).items())
+    name = experiment['experiment']
+    if name == 'saturation' and model != 'leaf':
+        return runSaturation(module, parameters)
+    if name == 'adaptiveSaturation' and model != 'leaf':
+        return runAdaptiveSaturation(module, parameters)
+    if name == 'AOM' and model != 'leaf':
+        return runAOM(module, parameters, AOMCHANNELS[model])
+    if name == 'protocol' and model != 'leaf':
+        return runProtocol(module, parameters, PROTOCOLCHANNELS[model])
+    if name == 'lightDependency' and model == 'leaf':
+        return runLightDependency(module, parameters)
+    raise ValueError('unknown experiment %s for model %s' % (name, model))
+
+def plotExperiment(experiment, results, output, dpi = 100):
+    """
+    Plots the results with the plotting functions of the scripts on the Agg backend and saves every figure
+    as output with the extension replaced by .figure<number>.png. The histograms are drawn with the decimating
+    functions of plotting.py, so the figures of fine binned results take about as long as those of coarse ones.
+
+    returns list of the written file names
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    matplotlib.rcParams['figure.dpi'] = dpi #the histograms are decimated to the pixels of the saved figure
+    import matplotlib.pyplot as plt
+    from plotting import plotHistogram
+    module = loadModel(experiment['model'])
+    parameters = experiment.get('parameters', {})
+    name = experiment['experiment']
+    if name == 'saturation':
+        module.plotSaturation(results['intensities'], results['fluorescence'], results['triplets'])
+    elif name == 'adaptiveSaturation':
+        module.plotSaturation(results['intensities'], results['fluorescence'], results['triplets' if experiment['model'] == 'LHCII' else 'ChlTriplets'])
+    elif name == 'AOM' and experiment['model'] == 'LHCII':
+        module.plotAOM(parameters.get('AOMtimes', [50E-6, 50E-6]), list(results['fluorescence']))
+    elif name == 'AOM':
+        channels = AOMCHANNELS['PSII']
+        curves = [tuple(results[channel][j] for channel in channels) for j in range(len(results['fluorescence']))]
+        module.plotAOM(parameters.get('AOMtimes', [0.8E-3, 0.1E-3]), parameters.get('Offtimes', [10E-3, 1.5E-3, 0.5E-3, 0.1E-3]), curves, parameters.get('binning', 2E-5))
+    elif name == 'protocol':
+        binning = parameters.get('binning', 1.0E-6 if experiment['model'] == 'LHCII' else 2E-5)
+        for channel in PROTOCOLCHANNELS[experiment['model']]:
+            plt.figure()
+            plotHistogram(plt.gca(), results[channel], binning*1E3)
+            plt.xlabel('Time in the recorded segments [ms]')
+            plt.ylabel(channel)
+    else:
+        for light, trialsSum in zip(results['photonFlux'], results['trialsSum']):
+            module.plotLeaf(list(trialsSum), parameters['timeSteps'], parameters['size'], light, parameters['layer'])
+    files = []
+    for number in plt.get_fignums():
+        fileName = '%s.figure%i.png' % (os.path.splitext(output)[0], number)
+        plt.figure(number).savefig(fileName, dpi = dpi)
+        files.append(fileName)
+    plt.close('all')
+    return files
+
+def parseSetting(setting):
+    """
+    Splits a name=value command line setting, the value is read as JSON (as a string if it is no valid JSON).
+    """
+    name, value = setting.split('=', 1)
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+def main(arguments = None):
+    parser = argparse.ArgumentParser(description = 'Runs a simulation experiment from a JSON experiment file without plotting.')
+    parser.add_argument('experiment', help = 'JSON experiment file')
+    parser.add_argument('--output', '-o', help = 'npz file for the results (default: output of the experiment file or its name with .npz)')
+    parser.add_argument('--plot', action = 'store_true', help = 'also save the figures as PNG files')
+    parser.add_argument('--set', '-s', action = 'append', default = [], metavar = 'NAME=VALUE', help = 'overrides a parameter, the value is read as JSON')
+    options = parser.parse_args(arguments)
+    with open(options.experiment) as f:
+        experiment = json.load(f)
+    experiment.setdefault('parameters', {})
+    for setting in options.set:
+        name, value = parseSetting(setting)
+        experiment['parameters'][name] = value
+    output = options.output or experiment.get('output') or os.path.splitext(options.experiment)[0] + '.npz'
+    results = runExperiment(experiment)
+    results['experiment'] = np.array(json.dumps(experiment, sort_keys = True))
+    np.savez(output, **results)
+    print 'Results written to %s' % output
+    if options.plot or experiment.get('plot', False):
+        for fileName in plotExperiment(experiment, results, output):
+            print 'Figure written to %s' % fileName
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import numpy as np
+
+
+def batchResults(results, trials):
+    """
+    Merge function for sweep.runSweep that keeps the trial batches of a point apart instead of summing them,
+    so their spread gives error bars.
+
+    returns list with the result of every batch, each divided by its number of trials
+    """
+    return [np.asarray(result, dtype = float)/size for result, size in zip(results, trials)]
+
+def perturbations(base, names, relativeStep = 0.1):
+    """
+    Parameter sets of central differences: the base parameters followed by every parameter in names scaled by
+    1 + relativeStep and by 1 - relativeStep.
+
+    Input:
+        base: dict with the values of the model parameters
+        names: list of str, parameters whose sensitivity is wanted
+        relativeStep: float, relative size of the perturbations
+
+    returns list of dicts with the parameters of every point
+    """
+    points = [dict(base)]
+    for name in names:
+        for sign in (1, -1):
+            point = dict(base)
+            point[name] = base[name]*(1 + sign*relativeStep)
+            points.append(point)
+    return points
+
+def centralDifferences(batches, base, names, relativeStep = 0.1):
+    """
+    Derivatives of a simulated result with respect to every parameter in names, from the batches of the points of
+    perturbations(). Batch i of every point must have been run with the same random numbers (commonStreams of
+    sweep.runSweep), then most of the noise cancels in the difference and the per-batch derivatives have a far
+    smaller spread than the difference of two independent runs.
+
+    Input:
+        batches: list with the batches (see batchResults) of every point of perturbations(base, names, relativeStep)
+
+    returns the mean result of the base point, and dict with for every name a dict with the derivative, its
+    standard error (from the spread of the per-batch derivatives) and the elasticity (relative derivative
+    d ln result/d ln parameter, nan where the result is 0)
+    """
+    trace = np.mean(batches[0], axis = 0)
+    sensitivities = {}
+    for i, name in enumerate(names):
+        plus, minus = np.asarray(batches[1 + 2*i]), np.asarray(batches[2 + 2*i])
+        derivatives = (plus - minus)/(2*relativeStep*base[name])
+        count = len(derivatives)
+        derivative = derivatives.mean(axis = 0)
+        error = derivatives.std(axis = 0, ddof = 1)/np.sqrt(count) if count > 1 else np.full(derivative.shape, np.inf)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            elasticity = np.where(trace != 0, derivative*base[name]/trace, np.nan)
+        sensitivities[name] = {'derivative': derivative, 'error': error, 'elasticity': elasticity}
+    return trace, sensitivities
@@ -0,0 +1,228 @@
+"""
+Sweeps split into shards that run independently on any number of machines sharing a filesystem.
+
+    python shards.py run sweep.json [--shard 3] [--processes 4] [--stale 86400]
+    python shards.py status sweep.json
+    python shards.py merge sweep.json [--output results.npz]
+
+A manifest (see createManifest) describes the complete sweep: the model script and simulation function, the
+parameter points, the trials with their batch size and the seed. Its work units (parameter point x trial batch,
+see sweep.workUnits) are divided into shards; every unit keeps the random stream it has in sweep.runSweep.
+run claims pending shards through lock files next to the manifest, so several nodes can start it at the same
+time without a scheduler, and writes one compressed result file per shard. merge combines the shard files in
+batch order with the merge function of the sweep, which gives exactly the result of runSweep on one machine.
+"""
+import argparse
+import json
+import os
+import socket
+import time
+import numpy as np
+import sweep
+from resultcache import cacheKey
+from runner import loadModel
+
+
+def createManifest(path, model, function, points, trials, batchSize = None, trialsArgument = 'numtrials', seed = 0, seedArgument = None,
+                   merge = 'sumResults', unitsPerShard = 1):
+    """
+    Writes the manifest of a sharded sweep as JSON.
+
+    Input:
+        path: str, file name of the manifest; the shard results and locks are written next to it
+        model: str, model whose script defines function (see runner.MODELS)
+        function: str, name of the simulation function, called as in sweep.runSweep
+        points: list of dicts with the keyword arguments of every parameter point (JSON types only)
+        trials, batchSize, trialsArgument, seed, seedArgument: as in sweep.runSweep
+        merge: str, name of the merge function in sweep (sumResults or meanResults)
+        unitsPerShard: int representing the number of work units per shard
+
+    returns dict with the manifest; every shard lists its units as [point, batch, first trial, trials]
+    """
+    sizes = sweep.batchSizes(trials, batchSize)
+    units = []
+    for point in range(len(points)):
+        first = 0
+        for batch, size in enumerate(sizes):
+            units.append([point, batch, first, size])
+            first += size
+    shards = [{'shard': i, 'units': units[start:start + unitsPerShard]} for i, start in enumerate(range(0, len(units), unitsPerShard))]
+    manifest = {'model': model, 'function': function, 'points': points, 'trials': trials, 'batchSize': batchSize,
+                'trialsArgument': trialsArgument, 'seed': seed, 'seedArgument': seedArgument, 'merge': merge, 'shards': shards}
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent = 1, sort_keys = True)
+    return manifest
+
+def loadManifest(path):
+    """
+    returns the manifest stored in path
+    """
+    with open(path) as f:
+        return json.load(f)
+
+def shardPath(path, shard, extension = '.npz'):
+    """
+    returns the file name of the result (or with extension '.lock' the lock) of a shard of the manifest in path
+    """
+    return '%s.shard%04i%s' % (os.path.splitext(path)[0], shard, extension)
+
+def runShard(path, shard, processes = 1):
+    """
+    Runs the work units of one shard and writes their results to shardPath(path, shard); the file is written
+    under a temporary name first and then renamed, so it is either complete or missing.
+
+    returns the name of the result file
+    """
+    manifest = loadManifest(path)
+    function = getattr(loadModel(manifest['model']), manifest['function'])
+    units = []
+    for point, batch, first, size in manifest['shards'][shard]['units']:
+        unitArgs = dict((str(name), value) for name, value in manifest['points'][point].items())
+        unitArgs[manifest['trialsArgument']] = size
+        units.append((function, unitArgs, point, batch, manifest['seed'], manifest['seedArgument'], point))
+    start = time.time()
+    results = dict(((point, batch), result) for point, batch, result in sweep.runUnits(units, processes))
+    arrays = {}
+    channels = []
+    for i, (point, batch, first, size) in enumerate(manifest['shards'][shard]['units']):
+        result = results[(point, batch)]
+        if isinstance(result, tuple):
+            channels.append(len(result))
+            for j, channel in enumerate(result):
+                arrays['unit%i_%i' % (i, j)] = np.asarray(channel)
+        else:
+            channels.append(None)
+            arrays['unit%i' % i] = np.asarray(result)
+    header = {'manifest': cacheKey(manifest), 'shard': shard, 'units': manifest['shards'][shard]['units'], 'channels': channels,
+              'host': socket.gethostname(), 'elapsed': time.time() - start}
+    fileName = shardPath(path, shard)
+    temporary = shardPath(path, shard, '.tmp.npz')
+    np.savez_compressed(temporary, header = np.array(json.dumps(header)), **arrays)
+    os.rename(temporary, fileName)
+    return fileName
+
+def loadShard(path, shard):
+    """
+    returns the header of the result file of a shard and a dict with the result of every (point, batch)
+    """
+    with np.load(shardPath(path, shard)) as data:
+        header = json.loads(str(data['header']))
+        results = {}
+        for i, (point, batch, first, size) in enumerate(header['units']):
+            if header['channels'][i] is None:
+                results[(point, batch)] = data['unit%i' % i]
+            else:
+                results[(point, batch)] = tuple(data['unit%i_%i' % (i, j)] for j in range(header['channels'][i]))
+    return header, results
+
+def claimShard(path, shard, staleAfter = None):
+    """
+    Claims a shard by creating its lock file exclusively (O_EXCL, atomic on local and NFS v3+ filesystems).
+    A lock older than staleAfter seconds is taken to belong to a node that died and is claimed again; if two nodes
+    take it over at once the shard runs twice, which only costs time since both write the same result.
+
+    returns True if the shard was claimed
+    """
+    lock = shardPath(path, shard, '.lock')
+    if staleAfter is not None and os.path.exists(lock) and time.time() - os.path.getmtime(lock) > staleAfter:
+        try:
+            os.remove(lock)
+        except OSError:
+            pass #another node removed it first
+    try:
+        descriptor = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except OSError:
+        return False
+    os.write(descriptor, ('%s %i %f\n' % (socket.gethostname(), os.getpid(), time.time())).encode('utf-8'))
+    os.close(descriptor)
+    return True
+
+def status(path):
+    """
+    returns dict with the lists of the finished, running (claimed) and pending shards of the manifest in path
+    """
+    manifest = loadManifest(path)
+    shards = {'finished': [], 'running': [], 'pending': []}
+    for shard in range(len(manifest['shards'])):
+        if os.path.exists(shardPath(path, shard)):
+            shards['finished'].append(shard)
+        elif os.path.exists(shardPath(path, shard, '.lock')):
+            shards['running'].append(shard)
+        else:
+            shards['pending'].append(shard)
+    return shards
+
+def runShards(path, shards = None, processes = 1, staleAfter = None):
+    """
+    Runs the shards that are neither finished nor claimed by another node, one after another, until none is left.
+    Every node of a cluster can call this on the same manifest.
+
+    Input:
+        shards: list of int, shards to run (all if None)
+        processes: int representing the number of worker processes per shard (see sweep.runUnits)
+        staleAfter: float, age in seconds after which the lock of an unfinished shard is taken over (None never)
+
+    returns list of the shards run by this call
+    """
+    manifest = loadManifest(path)
+    done = []
+    for shard in range(len(manifest['shards'])) if shards is None else shards:
+        if os.path.exists(shardPath(path, shard)) or not claimShard(path, shard, staleAfter):
+            continue
+        if os.path.exists(shardPath(path, shard)): #finished by another node between the check and the claim
+            os.remove(shardPath(path, shard, '.lock'))
+            continue
+        try:
+            runShard(path, shard, processes)
+        finally:
+            os.remove(shardPath(path, shard, '.lock'))
+        done.append(shard)
+    return done
+
+def mergeShards(path):
+    """
+    Combines the shard results into the result of every parameter point, merging the batches of a point in batch
+    order with the merge function of the manifest exactly like sweep.runSweep.
+
+    returns list with the merged result of every parameter point
+    """
+    manifest = loadManifest(path)
+    key = cacheKey(manifest)
+    shards = status(path)
+    missing = shards['running'] + shards['pending']
+    if missing:
+        raise ValueError('shards %s of %s are not finished' % (sorted(missing), path))
+    results = {}
+    for shard in range(len(manifest['shards'])):
+        header, shardResults = loadShard(path, shard)
+        if header['manifest'] != key:
+            raise ValueError('%s was written for a different manifest' % shardPath(path, shard))
+        results.update(shardResults)
+    sizes = sweep.batchSizes(manifest['trials'], manifest['batchSize'])
+    merge = getattr(sweep, manifest['merge'])
+    return [merge([results[(point, batch)] for batch in range(len(sizes))], sizes) for point in range(len(manifest['points']))]
+
+def main(arguments = None):
+    parser = argparse.ArgumentParser(description = 'Runs, monitors and merges the shards of a sweep manifest.')
+    parser.add_argument('command', choices = ['run', 'status', 'merge'])
+    parser.add_argument('manifest', help = 'JSON manifest written by createManifest')
+    parser.add_argument('--shard', type = int, action = 'append', help = 'run only this shard (repeatable)')
+    parser.add_argument('--processes', type = int, default = 1, help = 'worker processes per shard')
+    parser.add_argument('--stale', type = float, help = 'take over locks older than this many seconds')
+    parser.add_argument('--output', '-o', help = 'npz file for the merged results (default: manifest name with .npz)')
+    options = parser.parse_args(arguments)
+    if options.command == 'run':
+        done = runShards(options.manifest, options.shard, options.processes, options.stale)
+        print 'Ran shards %s' % done
+    elif options.command == 'status':
+        for state, shards in sorted(status(options.manifest).items()):
+            print '%s: %i %s' % (state, len(shards), shards)
+    else:
+        output = options.output or os.path.splitext(options.manifest)[0] + '.npz'
+        manifest = loadManifest(options.manifest)
+        np.savez(output, results = np.array(mergeShards(options.manifest)), points = np.array(json.dumps(manifest['points'])),
+                 manifest = np.array(json.dumps(manifest, sort_keys = True)))
+        print 'Results written to %s' % output
+
+if __name__ == '__main__':
+    main()
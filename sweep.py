@@ -0,0 +1,274 @@
+import random
+import numpy as np
+from multiprocessing import Pool, RawArray, Value, cpu_count
+from resultcache import ResultCache, cacheKey, functionName
+
+
+def streamSeed(seed, point, batch):
+    """
+    Derives the seed of the random stream of one work unit of a sweep.
+    The stream only depends on the sweep seed, the parameter point and the trial batch, never on
+    the process that happens to run the unit, so a sweep is reproducible for any number of processes.
+
+    returns int in the range 0 - 2**32-1
+    """
+    return int(np.random.RandomState([seed, point, batch]).randint(0, 2**32, dtype=np.uint64))
+
+def seedStreams(seed, point, batch):
+    """
+    Seeds the random module and the global numpy RandomState with the stream of one work unit,
+    which is what the scalar simulations (LHCII, PSII and Leaf) draw from.
+    """
+    words = np.random.RandomState([seed, point, batch]).randint(0, 2**31, size=4)
+    random.seed(sum(int(word) << (31*i) for i, word in enumerate(words)))
+    np.random.seed(words)
+
+def sumResults(results, trials):
+    """
+    Merges the results of the trial batches of one parameter point by summing them element by element.
+    Suited for histograms and counts, e.g. the return values of simulationAOM() or the trialsSum of the leaf.
+
+    Input:
+        results: list of results in batch order; a result is a number, an array or a list/tuple of those
+        trials: list of int with the number of trials of every batch (not used)
+    """
+    merged = results[0]
+    for result in results[1:]:
+        if isinstance(merged, tuple):
+            merged = tuple(np.add(m, r) for m, r in zip(merged, result))
+        else:
+            merged = np.add(merged, result)
+    return merged
+
+def scaleResult(result, factor):
+    """
+    Multiplies a result (a number, an array or a tuple of those) by factor.
+    """
+    if isinstance(result, tuple):
+        return tuple(np.multiply(factor, r) for r in result)
+    return np.multiply(factor, result)
+
+def meanResults(results, trials):
+    """
+    Merges the results of the trial batches of one parameter point by averaging them, weighted by the number
+    of trials of every batch. Suited for rates and averages, e.g. the return values of simulation().
+    """
+    total = float(sum(trials))
+    return sumResults([scaleResult(result, size/total) for result, size in zip(results, trials)], trials)
+
+def batchSizes(trials, batchSize):
+    """
+    Splits trials into batches of at most batchSize trials.
+
+    returns list of int
+    """
+    if batchSize is None or batchSize >= trials:
+        return [trials]
+    sizes = [batchSize]*(trials//batchSize)
+    if trials % batchSize:
+        sizes.append(trials % batchSize)
+    return sizes
+
+def runUnit(unit):
+    """
+    Runs one work unit (one trial batch of one parameter point) in a worker process.
+
+    returns the point and batch number together with the result
+    """
+    function, kwargs, point, batch, seed, seedArgument, stream = unit
+    seedStreams(seed, stream, batch)
+    if seedArgument is not None:
+        kwargs = dict(kwargs)
+        kwargs[seedArgument] = streamSeed(seed, stream, batch)
+    return point, batch, function(**kwargs)
+
+def workUnits(function, points, trials, batchSize=None, trialsArgument='numtrials', seed=0, seedArgument=None, commonStreams=False):
+    """
+    Splits a sweep into work units: (parameter point x trial batch).
+    With commonStreams batch i of every point draws from the same random stream (common random numbers), otherwise
+    every point has its own streams.
+
+    returns list of tuples that can be passed to runUnit, and the list of batch sizes
+    """
+    sizes = batchSizes(trials, batchSize)
+    units = []
+    for point, kwargs in enumerate(points):
+        for batch, size in enumerate(sizes):
+            unitArgs = dict(kwargs)
+            unitArgs[trialsArgument] = size
+            units.append((function, unitArgs, point, batch, seed, seedArgument, 0 if commonStreams else point))
+    return units, sizes
+
+def runUnits(units, processes=None):
+    """
+    Runs work units in this process (processes == 1) or on a pool of worker processes.
+
+    returns list of (point, batch, result) in the order in which the units finished
+    """
+    if processes is None:
+        processes = cpu_count()
+    if processes == 1:
+        return [runUnit(unit) for unit in units]
+    pool = Pool(processes)
+    try:
+        return list(pool.imap_unordered(runUnit, units))
+    finally:
+        pool.close()
+        pool.join()
+
+sharedRows = {} #the per-worker partial sums of runSharedSweep, set by initSharedWorker in every worker process
+
+def initSharedWorker(buffer, shape, counter):
+    """
+    Initializes a worker process of runSharedSweep: claims the next row of the shared buffer for its partial sums.
+    """
+    with counter.get_lock():
+        row = counter.value
+        counter.value += 1
+    sharedRows['sums'] = np.frombuffer(buffer, dtype=np.float64).reshape(shape)[row]
+
+def runSharedUnit(unit):
+    """
+    Runs one work unit and adds its result to the partial sums of this worker, only the point and batch are sent back.
+    """
+    point, batch, result = runUnit(unit)
+    sums = sharedRows['sums'][point]
+    sums += np.asarray(result, dtype=np.float64).reshape(sums.shape)
+    return point, batch
+
+def runSharedSweep(function, points, trials, shape, batchSize=None, trialsArgument='numtrials', processes=None, seed=0, seedArgument=None, commonStreams=False):
+    """
+    runSweep for histograms that are summed over the trial batches (merge=sumResults) without sending them between
+    processes: every worker adds the results of its units directly into its own row of a shared-memory array
+    (multiprocessing.RawArray viewed with numpy.frombuffer, no copies, no locks), and at the end the rows are
+    reduced in place into the first one. The parent receives no copies of the unit results and holds no merged
+    histograms besides the shared array, which has one row of partial sums per worker.
+    The sums are float64, which is exact for counts below 2**53. Float results (e.g. weighted histograms) are summed
+    in the order in which the units finish, so they can differ from runSweep in the last digits.
+
+    Input:
+        shape: tuple with the shape of the result of function, e.g. (5, bins) for the five histograms of
+            simulationAOM() or (timeSteps + 1,) for leafTrials()
+        the other arguments are those of runSweep()
+
+    returns list with the summed result of every parameter point, arrays of shape shape that are views of the shared array
+    """
+    if processes is None:
+        processes = cpu_count()
+    units, sizes = workUnits(function, points, trials, batchSize, trialsArgument, seed, seedArgument, commonStreams)
+    rows = min(processes, len(units))
+    shape = (rows, len(points)) + tuple(shape)
+    buffer = RawArray('d', int(np.prod(shape)))
+    counter = Value('i', 0)
+    if rows == 1:
+        initSharedWorker(buffer, shape, counter)
+        try:
+            for unit in units:
+                runSharedUnit(unit)
+        finally:
+            sharedRows.clear()
+    else:
+        pool = Pool(rows, initSharedWorker, (buffer, shape, counter))
+        try:
+            for point, batch in pool.imap_unordered(runSharedUnit, units):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+    sums = np.frombuffer(buffer, dtype=np.float64).reshape(shape)
+    for row in range(1, rows):
+        sums[0] += sums[row]
+    return [sums[0][point] for point in range(len(points))]
+
+def runSweep(function, points, trials, batchSize=None, trialsArgument='numtrials', merge=sumResults, processes=None, seed=0, seedArgument=None, cache=None, models=None, commonStreams=False):
+    """
+    Runs a parameter sweep on a pool of worker processes. Every parameter point is split into trial batches
+    and every (point x batch) work unit gets its own, reproducibly seeded random stream. The results are
+    merged per point in batch order, so the outcome does not depend on the number of processes or on the
+    order in which the units finish.
+
+    Input:
+        function: module level function running the simulation, called as function(**point) with the trials
+            argument set to the batch size
+        points: list of dicts with the keyword arguments of every parameter point
+        trials: int representing the number of trials (or repetitions) per parameter point
+        batchSize: int representing the maximal number of trials per work unit, None for one unit per point
+        trialsArgument: str, name of the keyword argument of function that receives the number of trials
+        merge: function merging the list of batch results of one point (sumResults or meanResults)
+        processes: int representing the number of worker processes, None for all cores, 1 runs in this process
+        seed: int, seed of the whole sweep
+        seedArgument: str, name of a keyword argument of function that receives the stream seed (e.g. 'seed'
+            for the ensemble and event-driven simulations), None if function only uses the global generators
+        cache: resultcache.ResultCache or the name of its directory, None for no caching (see cachedSweep)
+        models: list with the model parameters of every point (see resultcache.modelParameters), part of the cache key
+        commonStreams: bool, True to run batch i of every point with the same random stream (common random numbers), so
+            the differences between the points are not swamped by the noise of independent runs, e.g. when fitting
+
+    returns list with the merged result of every parameter point
+    """
+    if cache is not None:
+        return cachedSweep(function, points, trials, batchSize, trialsArgument, merge, processes, seed, seedArgument, cache, models, commonStreams)
+    units, sizes = workUnits(function, points, trials, batchSize, trialsArgument, seed, seedArgument, commonStreams)
+    results = [[None]*len(sizes) for kwargs in points]
+    for point, batch, result in runUnits(units, processes):
+        results[point][batch] = result
+    return [merge(pointResults, sizes) for pointResults in results]
+
+def cachedSweep(function, points, trials, batchSize, trialsArgument, merge, processes, seed, seedArgument, cache, models=None, commonStreams=False):
+    """
+    runSweep with a persistent result cache: only the points and trials that are missing in the cache are run.
+    A point is identified by the function (module and name), its arguments, its model parameters, the seed, the batch size and
+    the merge function. Its random streams are derived from this identity instead of its position in the sweep,
+    so a cached point gives the same result in any sweep.
+    A point that is cached with fewer trials is topped up: only the missing trials are run, in new batches
+    with new streams, and merged with the stored result. If the stored trials are a multiple of batchSize the
+    topped-up result equals that of a fresh run. A point that is cached with more trials is recomputed,
+    without replacing the larger entry.
+    With commonStreams the streams only depend on the seed and the batch, as in runSweep, and the entries are kept
+    apart from those of independent streams.
+
+    returns list with the merged result of every parameter point
+    """
+    if not isinstance(cache, ResultCache):
+        cache = ResultCache(cache)
+    keys = []
+    pending = {}
+    units = []
+    for point, kwargs in enumerate(points):
+        identity = {'function': functionName(function), 'arguments': kwargs, 'model': None if models is None else models[point],
+                    'trialsArgument': trialsArgument, 'merge': functionName(merge), 'seed': seed, 'batchSize': batchSize}
+        if commonStreams:
+            identity['commonStreams'] = True
+        key = cacheKey(identity)
+        keys.append(key)
+        if key in pending:
+            continue
+        entry = cache.get(key)
+        store = entry is None or entry['trials'] < trials
+        if entry is not None and entry['trials'] > trials:
+            entry = None
+        stored = 0 if entry is None else entry['trials']
+        first = 0 if entry is None else entry['batches']
+        sizes = batchSizes(trials - stored, batchSize) if trials > stored else []
+        pending[key] = {'identity': identity, 'entry': entry, 'store': store, 'first': first, 'sizes': sizes, 'results': [None]*len(sizes)}
+        stream = 0 if commonStreams else int(key[:8], 16)
+        for batch, size in enumerate(sizes):
+            unitArgs = dict(kwargs)
+            unitArgs[trialsArgument] = size
+            units.append((function, unitArgs, key, first + batch, seed, seedArgument, stream))
+    for key, batch, result in runUnits(units, processes):
+        point = pending[key]
+        point['results'][batch - point['first']] = result
+    merged = {}
+    for key, point in pending.items():
+        entry = point['entry']
+        if not point['sizes']:
+            merged[key] = entry['result']
+            continue
+        if entry is None:
+            merged[key] = merge(point['results'], point['sizes'])
+        else:
+            merged[key] = merge([entry['result']] + point['results'], [entry['trials']] + point['sizes'])
+        if point['store']:
+            cache.put(key, {'identity': point['identity'], 'trials': trials, 'batches': point['first'] + len(point['sizes']), 'result': merged[key]})
+    return [merged[key] for key in keys]
@@ -0,0 +1,20 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from runner import loadModel
+
+
+@pytest.fixture(scope = 'session')
+def LHCII():
+    return loadModel('LHCII')
+
+@pytest.fixture(scope = 'session')
+def PSII():
+    return loadModel('PSII')
+
+@pytest.fixture(scope = 'session')
+def leaf():
+    return loadModel('leaf')
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+import photonstream
+from photonstream import PhotonStream
+
+
+class Crash(Exception):
+    pass
+
+def crashAfter(monkeypatch, writes):
+    #lets the photon writer fail at its writes+1-th append, like a preempted run
+    append = photonstream.PhotonWriter.append
+    calls = [0]
+    def failing(self, *args, **kwargs):
+        calls[0] += 1
+        if calls[0] > writes:
+            raise Crash()
+        return append(self, *args, **kwargs)
+    monkeypatch.setattr(photonstream.PhotonWriter, 'append', failing)
+
+@pytest.mark.parametrize('interval', [0.0, 1E9])
+def test_resumed_lhcii_aom_is_bit_identical(LHCII, tmpdir, monkeypatch, interval):
+    arguments = dict(numtrials = 6, AOMtimes = [20E-6, 20E-6], Intensity = 500, seed = 3, checkpointInterval = interval)
+    reference = LHCII.simulationAOM(checkpointFile = str(tmpdir.join('reference.ckpt')), photonFile = str(tmpdir.join('reference.bin')), **arguments)
+    with monkeypatch.context() as patch:
+        crashAfter(patch, 4)
+        with pytest.raises(Crash):
+            LHCII.simulationAOM(checkpointFile = str(tmpdir.join('run.ckpt')), photonFile = str(tmpdir.join('run.bin')), **arguments)
+    resumed = LHCII.simulationAOM(checkpointFile = str(tmpdir.join('run.ckpt')), photonFile = str(tmpdir.join('run.bin')), **arguments)
+    assert np.array_equal(resumed, reference)
+    assert np.array_equal(PhotonStream(str(tmpdir.join('run.bin'))).records, PhotonStream(str(tmpdir.join('reference.bin'))).records)
+
+def test_resumed_leaf_is_bit_identical(leaf, tmpdir, monkeypatch):
+    arguments = dict(numPSIIs = 200, timeSteps = 20, trialsNum = 4, photonFlux = 3000, seed = 5, countBased = True)
+    reference = leaf.leafTrials(**arguments)
+    path = str(tmpdir.join('leaf.ckpt'))
+    updateLayers = leaf.CountLeaf.updateLayers
+    calls = [0]
+    def failing(self, *args, **kwargs):
+        calls[0] += 1
+        if calls[0] > 50: #during the third trial
+            raise Crash()
+        return updateLayers(self, *args, **kwargs)
+    with monkeypatch.context() as patch:
+        patch.setattr(leaf.CountLeaf, 'updateLayers', failing)
+        with pytest.raises(Crash):
+            leaf.leafTrials(checkpointFile = path, checkpointInterval = 0.0, **arguments)
+    assert leaf.leafTrials(checkpointFile = path, checkpointInterval = 0.0, **arguments) == reference
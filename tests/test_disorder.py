@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from randomsource import RandomSource
+from disorder import applyDisorder, drawParameters, parameterBins
+
+
+def test_derived_probabilities_can_be_disordered(LHCII):
+    ensemble = LHCII.LHCIIEnsemble(numComplexes = 1000, rng = RandomSource(1))
+    drawn = applyDisorder(ensemble, {'probabilityDecay': ('uniform', 0.1, 0.2)})
+    assert np.array_equal(ensemble.probabilityDecay, drawn['probabilityDecay'])
+    assert 0.1 <= ensemble.probabilityDecay.min() and ensemble.probabilityDecay.max() < 0.2
+
+def test_disordered_lifetimes_set_per_complex_probabilities(PSII):
+    ensemble = PSII.PSIIEnsemble(numComplexes = 1000, rng = RandomSource(1))
+    applyDisorder(ensemble, {'ChlTripletLifetime': ('uniform', 1E-3, 3E-3), 'FlYield': ('normal', 0.18, 0.5)})
+    assert np.allclose(ensemble.ChlTripletDecay, 1-np.exp(-ensemble.timestep/ensemble.ChlTripletLifetime))
+    assert np.isscalar(ensemble.CarTripletDecay)
+    #draws outside the physical limits are drawn again
+    assert 0 <= ensemble.FlYield.min() and ensemble.FlYield.max() <= 1
+
+def test_homogeneous_disorder_matches_the_ensemble(LHCII):
+    #disorder with the default values draws per-complex arrays but follows the same random numbers
+    homogeneous = LHCII.simulationEnsemble(repetitions = 2000, numComplexes = 200, Intensity = 500, seed = 4)
+    disordered = LHCII.simulationEnsemble(repetitions = 2000, numComplexes = 200, Intensity = 500, seed = 4,
+                                          disorder = {'absCrossection': 1.4E-15, 'lifetime': 3.5E-9})
+    assert np.allclose(homogeneous, disordered)
+
+def test_breakdown_by_parameter_bin(LHCII):
+    edges = [0.5E-15, 1.4E-15, 3E-15]
+    fluorescence, triplets, perBin = LHCII.simulationEnsemble(repetitions = 2000, numComplexes = 400, Intensity = 100, seed = 4,
+                                                              disorder = {'absCrossection': ('uniform', 0.5E-15, 3E-15)},
+                                                              breakdown = ('absCrossection', edges))
+    assert perBin['complexes'].sum() == 400
+    assert np.isclose((perBin['fluorescence']*perBin['complexes']).sum()/400, fluorescence)
+    #larger cross sections absorb more photons
+    assert perBin['fluorescence'][1] > perBin['fluorescence'][0]
+
+def test_parameter_bins_include_the_last_edge():
+    index, bins = parameterBins(np.array([0.0, 0.5, 1.0, 1.5, -1.0]), [0.0, 0.5, 1.0])
+    assert bins == 2
+    assert list(index) == [0, 1, 1, 2, 2]
+
+def test_saturation_curve_simulates_the_disorder(LHCII, tmpdir):
+    disorder = {'absCrossection': ('uniform', 2.6E-15, 3E-15)}
+    Fl, Tr = LHCII.saturationCurve([100], numComplexes = 100, repetitions = 1000000, seed = 4, disorder = disorder)
+    assert np.allclose([Fl[0], Tr[0]], LHCII.simulationEnsemble(10000, numComplexes = 100, Intensity = 100, seed = 4, disorder = disorder))
+    #the ensemble arguments are part of the cache key, the disordered curve is not the cached homogeneous one
+    homogeneous = LHCII.saturationCurve([100], numComplexes = 100, repetitions = 1000000, cache = str(tmpdir))[0]
+    disordered = LHCII.saturationCurve([100], numComplexes = 100, repetitions = 1000000, cache = str(tmpdir), disorder = disorder)[0]
+    assert abs(disordered[0] - Fl[0]) < 0.08*Fl[0]
+    assert homogeneous[0] < 0.8*Fl[0]
+
+def test_saturation_curve_needs_the_ensemble_for_disorder(LHCII):
+    with pytest.raises(ValueError):
+        LHCII.saturationCurve([100], repetitions = 1000, disorder = {'absCrossection': ('uniform', 1E-15, 2E-15)})
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+
+def perPulse(histograms, numtrials):
+    return [np.sum(histogram)/float(numtrials) for histogram in histograms]
+
+def close(value, expected, tolerance):
+    return abs(value - expected) < tolerance*abs(expected)
+
+def assertAgree(engine, stepped, tolerances):
+    #fluorescence, Chl triplet, car triplet, absorption and annihilation per pulse
+    for value, expected, tolerance in zip(engine, stepped, tolerances):
+        assert close(value, expected, tolerance)
+
+@pytest.mark.parametrize('Intensity', [75, 500])
+def test_psii_event_driven_matches_the_stepped_simulation(PSII, Intensity):
+    #above ~180 W/cm^2 the stepped simulation absorbs at most one photon per timestep
+    arguments = dict(AOMtimes = [0.2E-3, 0.1E-3], Intensity = Intensity, ChlTripletYield = 0.02, CarTripletYield = 0.15, binning = 1E-4, seed = 1)
+    stepped = perPulse(PSII.simulationAOM(1000, **arguments), 1000)
+    eventDriven = perPulse(PSII.simulationAOMEventDriven(1000, **arguments), 1000)
+    assertAgree(eventDriven, stepped, [0.1, 0.1, 0.15, 0.01, 0.1])
+
+@pytest.mark.parametrize('Intensity', [75, 500])
+def test_psii_multiscale_matches_the_stepped_simulation(PSII, Intensity):
+    arguments = dict(AOMtimes = [0.2E-3, 0.1E-3], Intensity = Intensity, ChlTripletYield = 0.02, CarTripletYield = 0.15, binning = 1E-4, seed = 1)
+    stepped = perPulse(PSII.simulationAOM(1000, **arguments), 1000)
+    multiscale = perPulse(PSII.simulationAOMMultiscale(1000, **arguments), 1000)
+    assertAgree(multiscale, stepped, [0.1, 0.1, 0.15, 0.01, 0.1])
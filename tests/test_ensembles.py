@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+
+def test_psii_ensemble_records_numtrials_pulses(PSII):
+    #at Intensity 500 every timestep absorbs a photon, so the absorption histogram counts the recorded timesteps
+    AOMtimes = [2E-5, 1E-5]
+    steps = int(AOMtimes[0]/2.5E-7)
+    for numtrials, numComplexes in [(15, 10), (20, 10), (7, 10)]:
+        histograms = PSII.simulationAOMEnsemble(numtrials, AOMtimes, Intensity = 500, binning = 2E-5, numComplexes = numComplexes, warmupPulses = 0, seed = 1)
+        assert histograms[3].sum() == numtrials*steps
+
+def test_psii_ensemble_warms_up_to_the_steady_state(PSII):
+    AOMtimes = [0.8E-3, 0.1E-3]
+    assert PSII.steadyStatePulses(AOMtimes) == 12
+    cold = PSII.simulationAOMEnsemble(200, AOMtimes, Intensity = 500, ChlTripletYield = 0.02, CarTripletYield = 0.15, binning = 1E-4, numComplexes = 200, warmupPulses = 0, seed = 1)
+    warm = PSII.simulationAOMEnsemble(200, AOMtimes, Intensity = 500, ChlTripletYield = 0.02, CarTripletYield = 0.15, binning = 1E-4, numComplexes = 200, seed = 1)
+    #Chl triplets left over from the previous pulses are present from the start of a warm pulse
+    assert warm[1][0] > 2*cold[1][0]
+
+def close(value, expected, tolerance):
+    return abs(value - expected) < tolerance*abs(expected)
+
+def test_lhcii_ensemble_matches_the_scalar_simulation(LHCII):
+    #the same number of complex timesteps; the ensemble starts its complexes together, so its triplets lag a little
+    scalar = LHCII.simulation(2000000, Intensity = 500, seed = 1)
+    ensemble = LHCII.simulationEnsemble(20000, numComplexes = 100, Intensity = 500, seed = 1)
+    assert close(ensemble[0], scalar[0], 0.08)
+    assert close(ensemble[1], scalar[1], 0.05)
+
+def test_lhcii_saturation_curve_splits_the_repetitions_over_the_ensemble(LHCII, monkeypatch):
+    calls = []
+    def simulationEnsemble(repetitions, **kwargs):
+        calls.append((repetitions, kwargs['numComplexes']))
+        return 0.0, 0.0
+    monkeypatch.setattr(LHCII, 'simulationEnsemble', simulationEnsemble)
+    LHCII.saturationCurve([100, 500], numComplexes = 500, repetitions = 1000000)
+    assert calls == [(2000, 500), (2000, 500)]
+    with pytest.raises(ValueError):
+        LHCII.saturationCurve([100], numComplexes = 300, repetitions = 1000)
+
+def test_lhcii_master_equation_matches_the_simulation(LHCII):
+    Fl, Tr = LHCII.saturationMasterEquation([100, 500])
+    for i, Intensity in enumerate([100, 500]):
+        simulated = LHCII.simulationEnsemble(20000, numComplexes = 100, Intensity = Intensity, seed = 2)
+        assert close(simulated[0], Fl[i], 0.08)
+        assert close(simulated[1], Tr[i], 0.05)
+
+def test_psii_master_equation_matches_the_simulation(PSII):
+    master = PSII.saturationMasterEquation([100])
+    simulated = PSII.simulation(300000, Intensity = 100, seed = 1)
+    assert close(simulated[0], master[0][0], 0.03)
+    assert close(simulated[1], master[1][0], 0.01)
+
+def test_psii_ensemble_matches_the_scalar_simulation(PSII):
+    AOMtimes = [0.2E-3, 0.1E-3]
+    scalar = PSII.simulationAOM(100, AOMtimes, Intensity = 500, binning = 1E-4, seed = 1)
+    ensemble = PSII.simulationAOMEnsemble(1000, AOMtimes, Intensity = 500, binning = 1E-4, numComplexes = 100, warmupPulses = 0, seed = 1)
+    #fluorescence and annihilation per pulse
+    for channel in (0, 4):
+        assert close(ensemble[channel].sum()/1000.0, scalar[channel].sum()/100.0, 0.1)
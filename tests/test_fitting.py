@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+from fitting import fitParameters
+
+
+def chiSquare(candidates):
+    return [(c['a'] - 2.0)**2/0.01 + (c['b'] + 1.0)**2/0.04 for c in candidates]
+
+def test_fit_finds_the_minimum_of_a_quadratic():
+    fit = fitParameters(chiSquare, {'a': 0.0, 'b': 0.0}, {'a': 0.5, 'b': 0.5}, iterations = 20)
+    assert np.isclose(fit['parameters']['a'], 2.0, atol = 1E-6)
+    assert np.isclose(fit['parameters']['b'], -1.0, atol = 1E-6)
+    assert np.isclose(fit['errors']['a'], 0.1, rtol = 1E-3)
+
+def test_fit_needs_an_iteration():
+    with pytest.raises(ValueError):
+        fitParameters(chiSquare, {'a': 0.0, 'b': 0.0}, {'a': 0.5, 'b': 0.5}, iterations = 0)
+
+def test_psii_fit_recovers_the_car_triplet_yield_of_a_synthetic_trace(PSII):
+    data = PSII.simulationAOMEnsemble(1000, AOMtimes = [0.8E-3, 10E-3], Intensity = 500, seed = 99, parameters = {'CarTripletYield': 0.15})[0]/1000.
+    fit = PSII.fitAOM(data, {'CarTripletYield': 0.08}, {'CarTripletYield': 0.03})
+    assert abs(fit['parameters']['CarTripletYield'] - 0.15) < 0.015
+
+def test_lhcii_fit_recovers_the_triplet_yield_of_a_synthetic_trace(LHCII):
+    data = LHCII.simulationAOMMultiscale(20000, Intensity = 500, seed = 99, parameters = {'TripletYield': 0.5})/20000.
+    fit = LHCII.fitAOM(data, {'TripletYield': 0.3}, {'TripletYield': 0.1})
+    assert abs(fit['parameters']['TripletYield'] - 0.5) < 0.05
+
+@pytest.mark.parametrize('model', ['PSII', 'LHCII'])
+def test_fit_needs_a_positive_intensity(model, request):
+    with pytest.raises(ValueError):
+        request.getfixturevalue(model).fitAOM(np.ones(10), {'lifetime': 1E-9}, {'lifetime': 1E-10}, Intensity = 0)
@@ -0,0 +1,19 @@
+import numpy as np
+
+
+def test_count_layer_dark_decay(leaf):
+    layer = leaf.CountLayer(100000, 1, rng = np.random.RandomState(1))
+    layer.counts["ground"], layer.counts["closed excited"] = 0, 100000
+    layer.probabilityDecay = 0.5
+    fluoresced, absorbed = layer.updatePSIIs("off", 0)
+    #half of the closed excited PSIIs decay, 30% of them fluoresce; the other half stays excited
+    assert abs(fluoresced - 15000) < 600
+    assert abs(layer.counts["closed excited"] - 50000) < 1000
+    assert layer.counts["closed excited"] + layer.counts["closed ground"] == 100000
+
+def test_count_leaf_matches_the_leaf(leaf):
+    #the PSIIs of the leaf and the state counts of the CountLeaf follow the same kinetics
+    PSIIs = leaf.leafTrials(500, 20, 40, photonFlux = 1000, seed = 1)
+    counts = leaf.leafTrials(500, 20, 40, photonFlux = 1000, countBased = True, seed = 1)
+    assert abs(sum(counts) - sum(PSIIs)) < 0.1*sum(PSIIs)
+    assert abs(sum(counts[11:]) - sum(PSIIs[11:])) < 0.1*sum(PSIIs[11:])
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from randomsource import RandomSource
+from network import fromEdges, squareLattice
+
+
+def test_disconnected_network_matches_the_ensemble(LHCII):
+    #without neighbours nothing migrates or is quenched by a neighbour, the network is an ensemble of independent complexes
+    fluorescence, triplets, annihilated = LHCII.simulationNetwork(10000, neighbours = fromEdges(np.zeros((0, 2)), 2000), Intensity = 500, seed = 3)
+    expected = LHCII.simulationEnsemble(10000, numComplexes = 2000, Intensity = 500, seed = 3)
+    assert abs(fluorescence - expected[0]) < 0.05*expected[0]
+    assert abs(triplets - expected[1]) < 0.03*expected[1]
+
+@pytest.mark.parametrize('hoppingProbability', [0.3, 1.0])
+def test_neighbouring_excitations_annihilate_on_encounter(LHCII, hoppingProbability):
+    #the pair meets unless neither singlet hops, also when both hop and cross
+    network = LHCII.LHCIINetwork(fromEdges([[0, 1]], 2), rng = RandomSource(5), hoppingProbability = hoppingProbability)
+    trials = 4000
+    for trial in range(trials):
+        network.excited[:] = True
+        network.refresh()
+        network.migrate()
+        assert network.excited.sum() == len(network.excitedComplexes)
+    assert abs(network.encounters/float(trials) - (1 - (1 - hoppingProbability)**2)) < 0.03
+
+def test_network_keeps_the_indices_of_its_state(LHCII):
+    network = LHCII.LHCIINetwork(squareLattice(20, 20), Intensity = 3000, rng = RandomSource(2), migrationSteps = 3)
+    for step in range(2000):
+        network.update('on')
+    assert np.array_equal(network.excitedComplexes, np.flatnonzero(network.excited))
+    assert np.array_equal(np.sort(network.tripletComplexes), np.flatnonzero(network.triplet >= 1))
+    network.propagateDark(1000)
+    assert np.array_equal(np.sort(network.tripletComplexes), np.flatnonzero(network.triplet >= 1))
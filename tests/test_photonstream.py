@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+from photonstream import PhotonWriter, PhotonStream
+
+
+def writeRun(path, metadata, trials, append = False):
+    writer = PhotonWriter(path, metadata, append = append)
+    writer.append(np.arange(trials), 1E-6)
+    writer.close()
+
+def test_new_run_overwrites_the_file(tmpdir):
+    path = str(tmpdir.join('photons.bin'))
+    writeRun(path, {'Intensity': 75, 'duration': 5E-5}, 3)
+    writeRun(path, {'Intensity': 500, 'duration': 5E-5}, 2)
+    stream = PhotonStream(path)
+    assert stream.metadata['Intensity'] == 500
+    assert list(stream.records['trial']) == [0, 1]
+
+def test_append_requires_the_same_metadata(tmpdir):
+    path = str(tmpdir.join('photons.bin'))
+    writeRun(path, {'Intensity': 75, 'duration': 5E-5}, 3)
+    writeRun(path, {'Intensity': 75, 'duration': 5E-5}, 2, append = True)
+    assert len(PhotonStream(path)) == 5
+    with pytest.raises(ValueError):
+        PhotonWriter(path, {'Intensity': 500, 'duration': 5E-5}, append = True)
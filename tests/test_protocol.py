@@ -0,0 +1,36 @@
+import numpy as np
+from randomsource import RandomSource
+
+
+def close(value, expected, tolerance):
+    return abs(value - expected) < tolerance*abs(expected)
+
+def test_psii_lit_segment_is_propagated_in_one_draw(PSII):
+    steps = 400
+    stepped = PSII.PSII(Intensity = 500, rng = RandomSource(1))
+    propagated = PSII.PSII(Intensity = 500, rng = RandomSource(2))
+    for complex in (stepped, propagated):
+        complex.ChlTripletYield = 0.02
+        complex.CarTripletYield = 0.15
+    propagator = PSII.segmentPropagator(propagated, steps)
+    triplets = {'stepped': [], 'propagated': []}
+    for trial in range(1000):
+        for complex in (stepped, propagated):
+            complex.state, complex.ChlTriplet, complex.CarTriplet = 'ground', 0, 0
+        for num in range(steps):
+            stepped.update('on')
+        propagated.propagateLight(propagator)
+        triplets['stepped'].append((stepped.ChlTriplet, stepped.CarTriplet))
+        triplets['propagated'].append((propagated.ChlTriplet, propagated.CarTriplet))
+    stepped, propagated = np.mean(triplets['stepped'], axis = 0), np.mean(triplets['propagated'], axis = 0)
+    assert close(propagated[0], stepped[0], 0.15)
+    assert close(propagated[1], stepped[1], 0.1)
+
+def test_lhcii_protocol_propagates_the_unrecorded_light(LHCII):
+    #the triplets of an unrecorded strong pulse quench the recorded weak light; counters step every segment,
+    #so they give the stepped reference of the propagated pulse
+    protocol = [(50E-6, 0, False), (10E-6, 2000, False), (2E-6, 200, True)]
+    propagated = LHCII.simulationProtocol(protocol, numtrials = 2000, seed = 3)
+    stepped = LHCII.simulationProtocol(protocol, numtrials = 2000, seed = 4, counters = LHCII.transitionCounters())
+    assert close(propagated[1].sum(), stepped[1].sum(), 0.05)
+    assert close(propagated[0].sum(), stepped[0].sum(), 0.3)
@@ -0,0 +1,14 @@
+import os
+import subprocess
+import sys
+
+
+def test_loading_the_models_only_imports_the_simulation_core():
+    #the helpers of sweeps, caching, checkpoints, fits and plots are imported by the functions using them
+    helpers = ['sweep', 'resultcache', 'checkpoint', 'photonstream', 'counters', 'batchmeans', 'illumination',
+               'fitting', 'sensitivity', 'plotting', 'disorder', 'network', 'multiprocessing', 'matplotlib']
+    script = ('import sys\nfrom runner import loadModel\nfor model in ["LHCII", "PSII", "leaf"]:\n    loadModel(model)\n'
+              'print(" ".join(name for name in %r if name in sys.modules))' % helpers)
+    directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, '-c', script], cwd = directory)
+    assert output.split() == []
@@ -0,0 +1,16 @@
+import numpy as np
+import pytest
+
+
+def test_psii_sensitivity_matches_a_finite_difference_of_the_stepped_simulation(PSII):
+    arguments = dict(AOMtimes = [0.2E-3, 2E-3], Intensity = 500, ChlTripletYield = 0.02, binning = 1E-4)
+    trace, sensitivities = PSII.sensitivityAOM(names = ['CarTripletYield'], relativeStep = 0.2, CarTripletYield = 0.15, batchSize = 250, **arguments)
+    derivative = np.sum(sensitivities['CarTripletYield']['derivative'][2]) #car triplets per pulse
+    carTriplets = lambda CarTripletYield: np.sum(PSII.simulationAOM(1000, CarTripletYield = CarTripletYield, seed = 1,
+                                                                  warmupPulses = PSII.steadyStatePulses(arguments['AOMtimes']), **arguments)[2])/1000.
+    difference = (carTriplets(0.18) - carTriplets(0.12))/0.06
+    assert abs(derivative - difference) < 0.1*difference
+
+def test_psii_sensitivity_needs_a_positive_intensity(PSII):
+    with pytest.raises(ValueError):
+        PSII.sensitivityAOM(names = ['CarTripletYield'], Intensity = 0)
@@ -0,0 +1,45 @@
+import numpy as np
+
+
+def test_pooled_psii_batches_are_warmed_up(PSII):
+    #one-trial batches on new complexes: without warm-up every recorded pulse starts without Chl triplets
+    arguments = dict(numtrials = 10, AOMtimes = [0.2E-3, 0.1E-3], Offtimes = [0.1E-3], processes = 1, batchSize = 1, binning = 1E-4)
+    cold = PSII.AOMCurves(warmupPulses = 0, **arguments)[0]
+    warm = PSII.AOMCurves(**arguments)[0]
+    assert warm[1][0] > 1.5*cold[1][0]
+
+def count(numtrials):
+    return numtrials
+
+def test_cache_keeps_functions_of_different_modules_apart(tmpdir):
+    import types
+    from sweep import runSweep
+    #the same name in another model module, e.g. simulationAOM of LHCII and of PSII
+    other = types.FunctionType(count.__code__, {}, 'count')
+    other.__module__ = 'othermodel'
+    assert runSweep(count, [{}], 3, processes = 1, cache = str(tmpdir)) == [3]
+    assert runSweep(other, [{}], 3, processes = 1, cache = str(tmpdir)) == [3]
+    assert len(tmpdir.listdir()) == 2
+
+def test_sweep_does_not_depend_on_the_processes(LHCII):
+    from sweep import runSweep, meanResults
+    points = [{'Intensity': 100}, {'Intensity': 500}]
+    arguments = dict(batchSize = 500, trialsArgument = 'repetitions', merge = meanResults)
+    for function, seedArgument in [(LHCII.simulationEnsemble, 'seed'), (LHCII.simulation, None)]:
+        single = runSweep(function, points, 2000, processes = 1, seedArgument = seedArgument, seed = 3, **arguments)
+        pooled = runSweep(function, points, 2000, processes = 3, seedArgument = seedArgument, seed = 3, **arguments)
+        assert single == pooled
+        assert single != runSweep(function, points, 2000, processes = 1, seedArgument = seedArgument, seed = 4, **arguments)
+
+def test_merged_shards_equal_the_sweep(LHCII, tmpdir):
+    from sweep import runSweep, meanResults
+    from shards import createManifest, runShards, mergeShards
+    points = [{'Intensity': 100}, {'Intensity': 500}]
+    path = str(tmpdir.join('sweep.json'))
+    createManifest(path, 'LHCII', 'simulationEnsemble', points, 2000, batchSize = 500, trialsArgument = 'repetitions', seed = 3,
+                   seedArgument = 'seed', merge = 'meanResults', unitsPerShard = 3)
+    runShards(path)
+    merged = mergeShards(path)
+    swept = runSweep(LHCII.simulationEnsemble, points, 2000, batchSize = 500, trialsArgument = 'repetitions', merge = meanResults,
+                     processes = 1, seed = 3, seedArgument = 'seed')
+    assert [tuple(result) for result in merged] == [tuple(result) for result in swept]